@@ -0,0 +1,371 @@
+"""Benchmarks -- run offline against recorded outputs and synthetic data.
+
+Usage (from the repo's root):
+  $ python benchmarks.py
+  $ python benchmarks.py cli
+
+Each benchmark prints one line per measurement.  None of them require a
+running OpenBTS instance.
+"""
+
+import cStringIO
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+from openbts import cli
+from openbts.components import SIPAuthServe
+from openbts.core import iter_data
+from openbts.export import export_subscribers
+from openbts.reconcile import reconcile
+from openbts.subscribers import SUBSCRIBER_FIELDS, Subscriber
+from openbts.tmsis import TMSIStore
+
+
+# Recorded CLI outputs in openbts/tests/fixtures, keyed by the command that
+# produced them.
+CLI_CORPUS = [
+  ('load', 'load'),
+  ('load', 'load_low_gprs'),
+  ('noise', 'noise'),
+  ('gprs list', 'gprs_list'),
+  ('gprs list', 'gprs_list_duplicate_imsis'),
+]
+
+
+def benchmark_cli(iterations=2000):
+  """Times the label-driven CLI parsers over the recorded corpus."""
+  for command, name in CLI_CORPUS:
+    with open('openbts/tests/fixtures/%s.txt' % name) as output:
+      text = output.read()
+    elapsed = timeit.timeit(lambda: cli.parse(command, text),
+                            number=iterations)
+    print '%-28s %8.1f us/parse' % (name, 1e6 * elapsed / iterations)
+
+
+def iter_synthetic_tmsis(count, now=None):
+  """Generates TMSI rows spread over the last day."""
+  if now is None:
+    now = time.time()
+  for index in xrange(count):
+    created = now - random.uniform(0, 86400)
+    yield {
+      'IMSI': '90155%010d' % index,
+      'TMSI': '0x%08x' % (0x40000000 + index),
+      'IMEI': '35553406%07d' % random.randint(0, count),
+      'AUTH': str(random.choice([1, 2, 2, 2, 3])),
+      'CREATED': created,
+      'ACCESSED': random.uniform(created, now),
+      'TMSI_ASSIGNED': '0',
+    }
+
+
+def synthetic_tmsis(count, now=None):
+  """Generates a list of TMSI rows spread over the last day."""
+  return list(iter_synthetic_tmsis(count, now))
+
+
+def benchmark_tmsis(count=50000, iterations=100):
+  """Times TMSIStore queries against the equivalent loops over dicts."""
+  now = time.time()
+  rows = synthetic_tmsis(count, now)
+  start = time.time()
+  store = TMSIStore(rows)
+  print '%-28s %8.1f ms' % ('load %d rows' % count,
+                            1e3 * (time.time() - start))
+
+  def loops():
+    for seconds in (300, 900, 3600):
+      len([r for r in rows if r['ACCESSED'] > now - seconds])
+
+  def columnar():
+    store.window_counts(now=now)
+
+  for name, query in (('dict loops', loops), ('TMSIStore', columnar)):
+    elapsed = timeit.timeit(query, number=iterations)
+    print '%-28s %8.3f ms/query' % ('window counts, ' + name,
+                                    1e3 * elapsed / iterations)
+
+
+def peak_rss_delta(setup, func, *args):
+  """Runs a function in a child process and measures its peak RSS growth.
+
+  ru_maxrss is a high-water mark, so the growth is measured from the peak
+  reached by setup(*args), whose result is passed to func.
+
+  Returns:
+    the growth in KB of the child's peak RSS while running func, and func's
+    return value
+  """
+  queue = multiprocessing.Queue()
+
+  def child():
+    prepared = setup(*args)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = func(prepared)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((peak - baseline, result))
+
+  process = multiprocessing.Process(target=child)
+  process.start()
+  result = queue.get()
+  process.join()
+  return result
+
+
+def tmsis_payload(count):
+  """Encodes a NodeManager reply holding count TMSI rows, row by row."""
+  payload = cStringIO.StringIO()
+  payload.write('{"code": 200, "data": [')
+  for index, row in enumerate(iter_synthetic_tmsis(count)):
+    if index:
+      payload.write(', ')
+    payload.write(json.dumps(row))
+  payload.write(']}')
+  return payload.getvalue()
+
+
+def _count_active_list(raw):
+  """Counts active rows the way tmsis() used to: decode all, then filter."""
+  cutoff = time.time() - 3600
+  rows = json.loads(raw)['data']
+  return len(raw), len(filter(lambda row: row['ACCESSED'] > cutoff, rows))
+
+
+def _count_active_streaming(raw):
+  """Counts active rows the way iter_tmsis() does."""
+  cutoff = time.time() - 3600
+  return len(raw), sum(1 for row in iter_data(raw) if row['ACCESSED'] > cutoff)
+
+
+def benchmark_tmsis_memory(counts=(10000, 100000, 500000)):
+  """Compares the memory used to decode the TMSI table as a list or a stream.
+
+  The reply arrives as a single zmq frame, so both approaches hold the raw
+  payload; what is measured is the memory used on top of it.
+  """
+  for count in counts:
+    for name, func in (('list', _count_active_list),
+                       ('stream', _count_active_streaming)):
+      delta, (payload, _) = peak_rss_delta(tmsis_payload, func, count)
+      print '%-28s %8.1f MB peak growth (%5.1f MB payload)' % (
+        '%d rows, %s' % (count, name), delta / 1024.0, payload / 1048576.0)
+
+
+def iter_synthetic_subscribers(count, bts_count=50):
+  """Generates subscriber dicts as decoded from NodeManager replies.
+
+  Every value is a separate unicode object, as json.loads would return.
+  """
+  for index in xrange(count):
+    number = u'555%07d' % index
+    yield {
+      'name': u'IMSI90155%010d' % index,
+      'openbts_ipaddr': u'10.0.0.%d' % random.randint(1, bts_count),
+      'openbts_port': unicode(5062),
+      'numbers': [number],
+      'account_balance': unicode(random.randint(0, 100000)),
+      'caller_id': number[:],
+    }
+
+
+def _keep_dicts(count):
+  """Holds count subscribers as get_subscribers() returns them."""
+  return len(list(iter_synthetic_subscribers(count)))
+
+
+def _keep_compact(count):
+  """Holds count subscribers as get_subscribers(compact=True) returns them."""
+  return len([Subscriber.from_dict(subscriber)
+              for subscriber in iter_synthetic_subscribers(count)])
+
+
+def benchmark_subscribers_memory(counts=(10000, 100000)):
+  """Compares the memory held by subscriber dicts and compact records."""
+  for count in counts:
+    for name, func in (('dicts', _keep_dicts), ('compact', _keep_compact)):
+      delta, _ = peak_rss_delta(lambda count: count, func, count)
+      print '%-28s %8.1f MB peak growth (%4d bytes/subscriber)' % (
+        '%d subscribers, %s' % (count, name), delta / 1024.0,
+        1024.0 * delta / count)
+
+
+# The sip_buddies columns of a subscriber registry row, besides those
+# read by get_subscribers.
+SIP_BUDDIES_EXTRA_COLUMNS = (
+  'id', 'context', 'callingpres', 'deny', 'permit', 'secret', 'md5secret',
+  'remotesecret', 'transport', 'host', 'nat', 'type', 'accountcode',
+  'amaflags', 'callgroup', 'defaultuser', 'fromuser', 'fromdomain',
+  'fullcontact', 'regserver', 'regexten', 'insecure', 'regseconds',
+  'useragent', 'lastms', 'defaultip', 'mask', 'mailbox', 'RRLPSupported',
+  'hardware', 'regTime', 'a3_a8', 'ki',
+)
+
+
+def synthetic_registry(count, bts_count=50):
+  """Generates full sip_buddies rows and dialdata_table rows."""
+  sip_buddies, dialdata = [], []
+  for index in xrange(count):
+    name = 'IMSI90155%010d' % index
+    number = '555%07d' % index
+    row = dict((column, '') for column in SIP_BUDDIES_EXTRA_COLUMNS)
+    row.update({
+      'id': str(index),
+      'name': name,
+      'context': 'sip-external',
+      'host': 'dynamic',
+      'type': 'friend',
+      'ipaddr': '10.0.0.%d' % random.randint(1, bts_count),
+      'port': '5062',
+      'callerid': number,
+      'account_balance': str(random.randint(0, 100000)),
+      'regseconds': str(int(time.time())),
+      'ki': '%032x' % random.getrandbits(128),
+    })
+    sip_buddies.append(row)
+    dialdata.append({'id': str(index), 'dial': name, 'exten': number})
+  return sip_buddies, dialdata
+
+
+class FakeNodeManager(object):
+  """Answers sip_buddies and dialdata_table reads from synthetic tables.
+
+  Stands in for both the REQ and the pipeline socket of a component, and
+  counts the requests and the reply bytes sent to it.
+  """
+
+  def __init__(self, sip_buddies, dialdata):
+    self.tables = {'sip_buddies': sip_buddies, 'dialdata_table': dialdata}
+    # Rows indexed by the columns get_subscribers matches on.
+    self.indexes = {}
+    for command, column in (('sip_buddies', 'name'),
+                            ('dialdata_table', 'dial')):
+      index = self.indexes[command, column] = {}
+      for row in self.tables[command]:
+        index.setdefault(row[column], []).append(row)
+    self.replies = []
+    self.requests = 0
+    self.pipelined = 0
+    self.reply_bytes = 0
+
+  def _answer(self, payload):
+    """Queues the reply to an encoded request."""
+    message = json.loads(payload)
+    match = message['match'].items()
+    if not match:
+      rows = self.tables[message['command']]
+    else:
+      column, value = match[0]
+      rows = self.indexes[message['command'], column].get(value, [])
+    fields = message.get('fields')
+    if fields:
+      rows = [dict((field, row[field]) for field in fields) for row in rows]
+    reply = json.dumps({'code': 200 if rows else 404, 'data': rows})
+    self.requests += 1
+    self.reply_bytes += len(reply)
+    self.replies.append(reply)
+
+  def send(self, payload):
+    self._answer(payload)
+
+  def recv(self):
+    return self.replies.pop(0)
+
+  def send_multipart(self, frames):
+    self.pipelined += 1
+    self._answer(frames[-1])
+
+  def recv_multipart(self):
+    return ['', self.replies.pop(0)]
+
+  def poll(self, timeout=None):
+    return 1
+
+
+def benchmark_subscribers_projection(count=10000):
+  """Measures requests and reply bytes for get_subscribers projections."""
+  sip_buddies, dialdata = synthetic_registry(count)
+  for name, fields in (('all fields', None),
+                       ('all fields, projected', list(SUBSCRIBER_FIELDS)),
+                       ('name, openbts_ipaddr', ['name', 'openbts_ipaddr'])):
+    sipauthserve = SIPAuthServe()
+    node_manager = FakeNodeManager(sip_buddies, dialdata)
+    sipauthserve.socket = node_manager
+    sipauthserve.pipeline_socket = node_manager
+    start = time.time()
+    sipauthserve.get_subscribers(fields=fields)
+    elapsed = time.time() - start
+    serial = node_manager.requests - node_manager.pipelined
+    # Pipelined requests cost a round trip per window.
+    round_trips = serial + -(-node_manager.pipelined //
+                             sipauthserve.pipeline_window)
+    print '%-24s %6d requests %6d round trips %6.1f MB %6.2f s client' % (
+      name, node_manager.requests, round_trips,
+      node_manager.reply_bytes / 1048576.0, elapsed)
+
+
+def benchmark_export(count=50000):
+  """Measures export throughput per format against a fake NodeManager."""
+  sip_buddies, dialdata = synthetic_registry(count)
+  directory = tempfile.mkdtemp()
+  try:
+    for name in ('registry.jsonl', 'registry.csv', 'registry.columns',
+                 'registry.jsonl.gz'):
+      sipauthserve = SIPAuthServe()
+      node_manager = FakeNodeManager(sip_buddies, dialdata)
+      sipauthserve.socket = node_manager
+      sipauthserve.pipeline_socket = node_manager
+      stats = export_subscribers(sipauthserve, os.path.join(directory, name))
+      print '%-28s %8.0f rows/s %6.1f MB' % (
+        name, stats['rows_per_second'], stats['bytes'] / 1048576.0)
+  finally:
+    shutil.rmtree(directory)
+
+
+def benchmark_reconcile(count=50000, changed=100):
+  """Measures reconciling a registry that is in sync or nearly so."""
+  sip_buddies, dialdata = synthetic_registry(count)
+  desired = [{
+    'name': row['name'],
+    'openbts_ipaddr': row['ipaddr'],
+    'openbts_port': row['port'],
+    'numbers': [row['callerid']],
+    'caller_id': row['callerid'],
+    'account_balance': row['account_balance'],
+  } for row in sip_buddies]
+  for name, changes in (('in sync', 0), ('%d changed' % changed, changed)):
+    for subscriber in desired[:changes]:
+      subscriber['openbts_ipaddr'] = '10.1.0.1'
+    sipauthserve = SIPAuthServe()
+    node_manager = FakeNodeManager(sip_buddies, dialdata)
+    sipauthserve.socket = node_manager
+    sipauthserve.pipeline_socket = node_manager
+    start = time.time()
+    report = reconcile(sipauthserve, desired)
+    print '%-32s %6d requests %6d operations %6.2f s' % (
+      '%d subscribers, %s' % (count, name), node_manager.requests,
+      len(report['plan']), time.time() - start)
+
+
+BENCHMARKS = {
+  'cli': benchmark_cli,
+  'export': benchmark_export,
+  'reconcile': benchmark_reconcile,
+  'subscribers_projection': benchmark_subscribers_projection,
+  'subscribers_memory': benchmark_subscribers_memory,
+  'tmsis': benchmark_tmsis,
+  'tmsis_memory': benchmark_tmsis_memory,
+}
+
+
+if __name__ == '__main__':
+  for benchmark_name in sys.argv[1:] or sorted(BENCHMARKS):
+    print '== %s ==' % benchmark_name
+    BENCHMARKS[benchmark_name]()
@@ -0,0 +1,335 @@
+"""openbts.cli
+label-driven parsers for OpenBTSCLI output
+
+The CLI prints human-oriented text, so rather than indexing into the result of
+str.split (which silently shifts when a line is added or reworded) these
+parsers find values by the labels that precede them.  Every field the CLI
+prints is returned, including ones the components do not use themselves.
+"""
+
+import re
+
+
+# Lines like "== GSM ==" start a new section.
+SECTION_PATTERN = re.compile(r'^==\s*(?P<section>.+?)\s*==$')
+# Lines like "noise RSSI is -72 dB wrt full scale".
+NOISE_PATTERN = re.compile(
+  r'^(?P<label>.+?) is (?P<value>-?[\d.]+) dB wrt full scale$')
+# Lines like "INFO: the current noise level is acceptable."
+STATUS_PATTERN = re.compile(
+  r'^(?P<level>INFO|NOTICE|WARNING|ERROR|ALERT|CRITICAL):\s*(?P<message>.*)$')
+# Records in the output of "gprs list".  The TBF records mention their MS as
+# "mtMS= MS#1,..." so we must not treat that as the start of an MS record.
+GPRS_RECORD_PATTERN = re.compile(
+  r'(?<!mtMS= )(?P<kind>MS|TBF)#(?P<id>\d+)|(?P<pdch>PDCH )')
+# Tokens like "rrmode=PacketIdle" or "RSSI=(-12 min=-13 max=-7 N=4550)".
+ASSIGNMENT_PATTERN = re.compile(r'(?P<key>\w+)=+(?P<value>\([^)]*\)|[^\s(]*)')
+# Tokens like "Bytes:53495up/139441down".
+BYTES_PATTERN = re.compile(r'Bytes:(?P<up>\d+)up/(?P<down>\d+)down')
+# Tokens like "dataER:.2% (5928)" and the "recent:0% (0)" that may follow.
+RATE_PATTERN = re.compile(
+  r'(?P<key>\w+):(?P<rate>[\d.]+)%\s*\((?P<count>\d+)\)')
+# Tokens like "channels: down=( 1:0 1:1) up=( 1:2,usf=3)".
+CHANNELS_PATTERN = re.compile(
+  r'channels:\s*down=\((?P<down>[^)]*)\)\s*up=\((?P<up>[^)]*)\)')
+
+# Values that look numeric but are identifiers and must stay strings.
+IDENTIFIERS = ('imsi', 'ptmsi', 'tlli', 'ips', 'mt_tlli')
+# Qualifiers that refine the error rate printed just before them.
+RATE_QUALIFIERS = ('recent', 'low')
+
+
+def to_number(token):
+  """Converts a CLI token to an int or float if possible.
+
+  Percent signs are dropped and scientific notation is supported.  Tokens that
+  are not numeric are returned unchanged.
+  """
+  stripped = token.strip().rstrip('%')
+  try:
+    return int(stripped)
+  except ValueError:
+    pass
+  try:
+    return float(stripped)
+  except ValueError:
+    return token
+
+
+def slugify(label):
+  """Converts a CLI label into a snake_case dict key.
+
+  For instance "TCH/F" becomes "tchf", "current PDCHs" becomes "current_pdchs"
+  and "TimingError" becomes "timing_error".
+  """
+  label = label.replace('/', '')
+  label = re.sub(r'([a-z])([A-Z])', r'\1_\2', label)
+  label = re.sub(r'[^0-9a-zA-Z]+', '_', label)
+  return label.strip('_').lower()
+
+
+def tokenize(text):
+  """Splits section-style CLI output into labelled tokens.
+
+  Args:
+    text: CLI output made of "label: value" lines, optionally grouped under
+          "== SECTION ==" headers
+
+  Returns:
+    a list of (section, label, value) tuples in the order they were printed,
+    where section is None for lines printed before any header
+  """
+  tokens = []
+  section = None
+  for line in text.splitlines():
+    line = line.strip()
+    if not line:
+      continue
+    match = SECTION_PATTERN.match(line)
+    if match:
+      section = match.group('section')
+      continue
+    label, separator, value = line.partition(':')
+    if not separator:
+      continue
+    tokens.append((section, label.strip(), value.strip()))
+  return tokens
+
+
+def _split_label(label, value):
+  """Pairs up the names and values of a single CLI line.
+
+  Handles "SDCCH load/available: 2/4" and "PCH load: active, total: 3, 7" as
+  well as the simple "current PDCHs: 4".  A value that contains a colon but
+  does not pair up with names, like the "12:30" of "uptime: 12:30", is kept
+  whole.
+
+  Returns:
+    a list of (name, value) tuples
+  """
+  words = label.split()
+  names_text, separator, values_text = value.rpartition(':')
+  if separator:
+    # The names follow the label, e.g. "active, total: 3, 7".
+    names = [n.strip() for n in names_text.split(',')]
+    values = [v for v in re.split(r'[/,]\s*', values_text.strip()) if v]
+  else:
+    # The names are the last word of the label, e.g. "load/available".
+    names = words[-1].split('/')
+    values = [v for v in re.split(r'[/,]\s*', value) if v]
+  if (len(values) < 2 or len(names) != len(values) or
+      not all(re.search(r'[a-zA-Z]', name) for name in names)):
+    return [(slugify(label), value)]
+  # The first word of the label names the channel.  A single word like
+  # "ARFCN/BSIC" is just a list of names.
+  if len(words) == 1 and not separator:
+    return [(slugify(name), v) for name, v in zip(names, values)]
+  return [('%s_%s' % (slugify(words[0]), slugify(name)), v)
+          for name, v in zip(names, values)]
+
+
+def parse_key_values(text, section_prefixes=None):
+  """Parses generic "label: value" CLI output into a flat dict.
+
+  Args:
+    text: the CLI output
+    section_prefixes: optional dict mapping a section name to a prefix that is
+                      prepended to the keys of that section
+
+  Returns:
+    a dict of every labelled value, with numeric values converted
+  """
+  section_prefixes = section_prefixes or {}
+  result = {}
+  for section, label, value in tokenize(text):
+    for name, item in _split_label(label, value):
+      prefix = section_prefixes.get(section)
+      if prefix:
+        name = '%s_%s' % (prefix, name)
+      result[name] = to_number(item)
+  return result
+
+
+def parse_load(text):
+  """Parses the output of "load".
+
+  Returns a dict of the form: {
+    'sdcch_load': 2,
+    'sdcch_available': 4,
+    'tchf_load': 1,
+    'tchf_available': 3,
+    'pch_active': 3,
+    'pch_total': 7,
+    'agch_active': 5,
+    'agch_pending': 9,
+    'gprs_current_pdchs': 4,
+    'gprs_utilization': 41,
+  }
+
+  Any additional lines the CLI prints are included in the same fashion.
+  """
+  result = parse_key_values(text, section_prefixes={'GPRS': 'gprs'})
+  # The utilization is a percentage and may be printed in scientific
+  # notation, so we always return a float.
+  if 'gprs_utilization' in result:
+    result['gprs_utilization'] = float(result['gprs_utilization'])
+  return result
+
+
+def parse_noise(text):
+  """Parses the output of "noise".
+
+  Returns a dict of the form: {
+    'noise_rssi_db': -72,
+    'ms_rssi_target_db': -55,
+    'info': 'the current noise level is acceptable.',
+  }
+
+  The status line is keyed by its lower-cased level (e.g. 'warning').
+  """
+  result = {}
+  for line in text.splitlines():
+    line = line.strip()
+    match = NOISE_PATTERN.match(line)
+    if match:
+      key = '%s_db' % slugify(match.group('label'))
+      result[key] = to_number(match.group('value'))
+      continue
+    match = STATUS_PATTERN.match(line)
+    if match:
+      result[match.group('level').lower()] = match.group('message')
+  return result
+
+
+def _parse_group(group):
+  """Parses a parenthesized stat group like "(1.02 min=-2.21 N=4550)"."""
+  body = group.strip('()').strip()
+  result = {}
+  head = body.split(' ', 1)[0]
+  if head and '=' not in head:
+    result['value'] = to_number(head)
+  for match in ASSIGNMENT_PATTERN.finditer(body):
+    result[slugify(match.group('key'))] = to_number(match.group('value'))
+  return result
+
+
+def _parse_assignments(text, result):
+  """Adds every "key=value" token in some text to a dict."""
+  for match in ASSIGNMENT_PATTERN.finditer(text):
+    key = slugify(match.group('key'))
+    value = match.group('value')
+    if value.startswith('('):
+      result[key] = _parse_group(value)
+    elif key in IDENTIFIERS:
+      result[key] = value
+    else:
+      result[key] = to_number(value)
+  return result
+
+
+def _parse_ms(ms_id, body):
+  """Parses one MS record from "gprs list"."""
+  result = {'ms': int(ms_id)}
+  header, _, gmm = body.partition('GMM Context:')
+  # Error rates look like "dataER:.2% (5928) recent:0% (0)"; the qualifiers
+  # refine the rate printed just before them.
+  rates, last_rate = {}, None
+  for match in RATE_PATTERN.finditer(gmm):
+    key = slugify(match.group('key'))
+    entry = {
+      'percentage': float(match.group('rate')),
+      'count': int(match.group('count')),
+    }
+    if key in RATE_QUALIFIERS and last_rate:
+      rates[last_rate][key] = entry
+    else:
+      rates[key] = entry
+      last_rate = key
+  gmm = RATE_PATTERN.sub('', gmm)
+  match = BYTES_PATTERN.search(header)
+  if match:
+    result['uploaded_bytes'] = int(match.group('up'))
+    result['downloaded_bytes'] = int(match.group('down'))
+    header = BYTES_PATTERN.sub('', header)
+  _parse_assignments(header.lstrip(','), result)
+  # The GMM context repeats some keys of the header (e.g. the TLLI), so it is
+  # kept in its own dict, while the radio stats that follow it are not.
+  context, _, stats = gmm.partition('TimingError')
+  result['gmm'] = _parse_assignments(context, {})
+  _parse_assignments('TimingError' + stats if stats else '', result)
+  result.update(rates)
+  return result
+
+
+def _parse_tbf(tbf_id, body):
+  """Parses one TBF record from "gprs list"."""
+  result = {'tbf': int(tbf_id)}
+  match = CHANNELS_PATTERN.search(body)
+  if match:
+    result['channels'] = {
+      'down': match.group('down').split(),
+      'up': match.group('up').split(),
+    }
+    body = CHANNELS_PATTERN.sub('', body)
+  ms_match = re.search(r'mtMS=\s*MS#(\d+)', body)
+  if ms_match:
+    result['ms'] = int(ms_match.group(1))
+    body = body[ms_match.end():]
+  _parse_assignments(body, result)
+  # Enum-like values are printed with their scope, e.g. "RLCDir::Up".
+  for key, value in result.items():
+    if isinstance(value, basestring) and '::' in value:
+      result[key] = value.rsplit('::', 1)[1]
+  return result
+
+
+def parse_gprs_list(text):
+  """Parses the output of "gprs list".
+
+  Returns a dict of the form: {
+    'ms': [{
+      'ms': 1,
+      'tlli': 'c001f001,78428eca',
+      'rrmode': 'PacketIdle',
+      'uploaded_bytes': 53495,
+      'downloaded_bytes': 139441,
+      'utilization': 0,
+      'gmm': {'imsi': '901550000000022', 'ips': '192.168.99.4', ...},
+      'rssi': {'value': -12, 'min': -13, 'max': -7, 'avg': -12.43, ...},
+      'data_er': {'percentage': 0.2, 'count': 5928, 'recent': {...}},
+      ...
+    }, ...],
+    'tbfs': [{'tbf': 853, 'ms': 1, 'mt_dir': 'Up', ...}, ...],
+    'pdchs': [{'arfcn': 51, 'tn': 1, 'fer': 21}, ...],
+  }
+  """
+  result = {'ms': [], 'tbfs': [], 'pdchs': []}
+  matches = list(GPRS_RECORD_PATTERN.finditer(text))
+  for index, match in enumerate(matches):
+    end = matches[index + 1].start() if index + 1 < len(matches) else None
+    body = text[match.end():end]
+    # Some recorded outputs contain escaped whitespace.
+    body = body.replace('\\n', ' ').replace('\\t', ' ')
+    if match.group('pdch'):
+      result['pdchs'].append(_parse_assignments(body, {}))
+    elif match.group('kind') == 'MS':
+      result['ms'].append(_parse_ms(match.group('id'), body))
+    else:
+      result['tbfs'].append(_parse_tbf(match.group('id'), body))
+  return result
+
+
+# Parsers keyed by the CLI command whose output they handle.
+PARSERS = {
+  'load': parse_load,
+  'noise': parse_noise,
+  'gprs list': parse_gprs_list,
+}
+
+
+def parse(command, text):
+  """Parses the output of a CLI command.
+
+  Commands without a dedicated parser are handled by parse_key_values.
+  """
+  return PARSERS.get(command, parse_key_values)(text)
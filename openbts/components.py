@@ -2,13 +2,41 @@
 manages components in the OpenBTS application suite
 """
 
-import re
 import time
 
 import envoy
 
-from openbts.core import BaseComponent
-from openbts.exceptions import InvalidRequestError
+from openbts import cli
+from openbts.core import BaseComponent, iter_data
+from openbts.exceptions import InvalidRequestError, NotFoundError
+from openbts.replica import RegistryReplica
+from openbts.subscribers import (SUBSCRIBER_COLUMNS, SUBSCRIBER_FIELDS,
+                                 Subscriber, sip_buddies_columns)
+
+
+def _run_cli(command):
+  """Runs an OpenBTSCLI command and returns its output.
+
+  Raises:
+    InvalidRequestError if the CLI exits with a non-zero status
+  """
+  response = envoy.run('/OpenBTS/OpenBTSCLI -c "%s"' % command)
+  if response.status_code != 0:
+    raise InvalidRequestError(
+      'CLI returned with non-zero status: %d' % response.status_code)
+  return response.std_out
+
+
+def _missing_label(command, error):
+  """Builds the error raised when CLI output lacks an expected label."""
+  return InvalidRequestError('"%s" output has no %s label' %
+                             (command, error.args[0]))
+
+
+# The TMSI table fields fetched by default.
+TMSI_FIELDS = (
+  'IMSI', 'TMSI', 'IMEI', 'AUTH', 'CREATED', 'ACCESSED', 'TMSI_ASSIGNED'
+)
 
 
 class OpenBTS(BaseComponent):
@@ -16,12 +44,14 @@ class OpenBTS(BaseComponent):
 
   Args:
     address: tcp socket for the zmq connection
+    addresses: an ordered list of tcp sockets (primary first) to use instead
+               of a single address
   """
 
   def __init__(self, **kwargs):
     super(OpenBTS, self).__init__(**kwargs)
-    self.address = kwargs.pop('address', 'tcp://127.0.0.1:45060')
-    self.socket.connect(self.address)
+    self.connect(kwargs.pop('addresses', None) or
+                 kwargs.pop('address', 'tcp://127.0.0.1:45060'))
 
   def __repr__(self):
     return 'OpenBTS component'
@@ -42,7 +72,7 @@ class OpenBTS(BaseComponent):
     }
     return self._send_and_receive(message)
 
-  def tmsis(self, access_period=0, auth=2):
+  def tmsis(self, access_period=0, auth=2, imsi=None, fields=None):
     """Gets all active subscribers from the TMSI table.
 
     Args:
@@ -53,31 +83,62 @@ class OpenBTS(BaseComponent):
               Authorized by registrar = 1
               Open registration (default) = 2
               Failed open registration = 3
+      imsi: fetches only the entry of this IMSI
+      fields: the fields to fetch (default IMSI, TMSI, IMEI, AUTH, CREATED,
+              ACCESSED and TMSI_ASSIGNED)
 
     Returns a list of objects defined by the list of fields.  See section 4.3
-    of the OpenBTS 4.0 Manual for more fields.
+    of the OpenBTS 4.0 Manual for more fields.  An empty list is returned if
+    the request fails; use iter_tmsis to tell a failure from an empty table.
+    """
+    try:
+      return list(self.iter_tmsis(access_period=access_period, auth=auth,
+                                  imsi=imsi, fields=fields))
+    except InvalidRequestError:
+      return []
+
+  def iter_tmsis(self, access_period=0, auth=2, imsi=None, fields=None,
+                 predicate=None):
+    """Iterates over entries in the TMSI table.
+
+    Takes the same arguments as tmsis, but rows are decoded from the reply one
+    at a time and filtered as they are decoded, so the whole table is never
+    held in memory as a list.  The request is sent when iteration begins.
+
+    Args:
+      predicate: if given, only rows for which predicate(row) is true are
+                 yielded
+
+    Yields:
+      TMSI row dicts (none if the table has no matching rows)
+
+    Raises:
+      InvalidRequestError if NodeManager fails the request for another
+      reason, e.g. 503, so callers never mistake a failure for an empty table
     """
     qualifiers = {
       'AUTH': str(auth)
     }
+    if imsi:
+      qualifiers['IMSI'] = str(imsi)
+    if fields is None:
+      fields = TMSI_FIELDS
     message = {
       'command': 'tmsis',
       'action': 'read',
       'match': qualifiers,
-      'fields': [
-        'IMSI', 'TMSI', 'IMEI', 'AUTH', 'CREATED', 'ACCESSED', 'TMSI_ASSIGNED'
-      ],
+      'fields': list(fields),
     }
+    access_cutoff_time = time.time() - access_period
     try:
-      result = self._send_and_receive(message)
-      tmsis = result.data
-    except InvalidRequestError:
-      return []
-    if access_period > 0:
-      access_cutoff_time = time.time() - access_period
-      tmsis = filter(
-        lambda entry: entry['ACCESSED'] > access_cutoff_time, tmsis)
-    return tmsis
+      for entry in iter_data(self._send_and_receive_raw(message)):
+        if access_period > 0 and entry['ACCESSED'] <= access_cutoff_time:
+          continue
+        if predicate and not predicate(entry):
+          continue
+        yield entry
+    except NotFoundError:
+      return
 
   def get_load(self):
     """Get the current BTS load.
@@ -101,25 +162,22 @@ class OpenBTS(BaseComponent):
       PCH: a paging channel for service notifications
       AGCH: a channel for transmitting BTS responses to channel requests
     """
-    response = envoy.run('/OpenBTS/OpenBTSCLI -c "load"')
-    if response.status_code != 0:
-      raise InvalidRequestError(
-        'CLI returned with non-zero status: %d' % response.status_code)
-    items = response.std_out.split()
-    return {
-      'sdcch_load': int(items[5].split('/')[0]),
-      'sdcch_available': int(items[5].split('/')[1]),
-      'tchf_load': int(items[8].split('/')[0]),
-      'tchf_available': int(items[8].split('/')[1]),
-      'pch_active': int(items[13].strip(',')),
-      'pch_total': int(items[14]),
-      'agch_active': int(items[19].strip(',')),
-      'agch_pending': int(items[20]),
-      'gprs_current_pdchs': int(items[26]),
-      # We convert to a float first so that this can handle numbers in
-      # scientific notation.
-      'gprs_utilization_percentage': int(float(items[28].strip('%'))),
-    }
+    load = cli.parse_load(_run_cli('load'))
+    try:
+      return {
+        'sdcch_load': load['sdcch_load'],
+        'sdcch_available': load['sdcch_available'],
+        'tchf_load': load['tchf_load'],
+        'tchf_available': load['tchf_available'],
+        'pch_active': load['pch_active'],
+        'pch_total': load['pch_total'],
+        'agch_active': load['agch_active'],
+        'agch_pending': load['agch_pending'],
+        'gprs_current_pdchs': load['gprs_current_pdchs'],
+        'gprs_utilization_percentage': int(load['gprs_utilization']),
+      }
+    except KeyError as e:
+      raise _missing_label('load', e)
 
   def get_noise(self):
     """Get the current BTS noise values from the CLI.
@@ -129,15 +187,14 @@ class OpenBTS(BaseComponent):
       'noise_ms_rssi_target_db': -50,
     }
     """
-    response = envoy.run('/OpenBTS/OpenBTSCLI -c "noise"')
-    if response.status_code != 0:
-      raise InvalidRequestError(
-        'CLI returned with non-zero status: %d' % response.status_code)
-    items = response.std_out.split()
-    return {
-      'noise_rssi_db': int(items[3]),
-      'noise_ms_rssi_target_db': int(items[12]),
-    }
+    noise = cli.parse_noise(_run_cli('noise'))
+    try:
+      return {
+        'noise_rssi_db': noise['noise_rssi_db'],
+        'noise_ms_rssi_target_db': noise['ms_rssi_target_db'],
+      }
+    except KeyError as e:
+      raise _missing_label('noise', e)
 
 
 class SIPAuthServe(BaseComponent):
@@ -145,16 +202,80 @@ class SIPAuthServe(BaseComponent):
 
   Args:
     address: tcp socket for the zmq connection
+    addresses: an ordered list of tcp sockets (primary first) to use instead
+               of a single address
   """
 
   def __init__(self, **kwargs):
     super(SIPAuthServe, self).__init__(**kwargs)
-    self.address = kwargs.pop('address', 'tcp://127.0.0.1:45064')
-    self.socket.connect(self.address)
+    self.connect(kwargs.pop('addresses', None) or
+                 kwargs.pop('address', 'tcp://127.0.0.1:45064'))
+    self.replica = None
 
   def __repr__(self):
     return 'SIPAuthServe component'
 
+  def enable_replica(self, path=':memory:', max_age=300, refresh=True):
+    """Mirrors the registry into a local SQLite read replica.
+
+    Once enabled, the mutating methods of this component write their changes
+    through to the replica.  Reads from the replica are made through its own
+    methods (e.g. self.replica.get_numbers), so callers choose between the
+    replica and the live reads of this component.
+
+    Args:
+      path: the SQLite database file (default in memory)
+      max_age: seconds after a refresh for which the replica is not stale
+      refresh: if True, fill the replica right away
+
+    Returns:
+      the replica.RegistryReplica instance
+    """
+    self.replica = RegistryReplica(self, path, max_age)
+    if refresh:
+      self.replica.refresh()
+    return self.replica
+
+  def read_table(self, command, fields):
+    """Reads every row of a registry table in one request.
+
+    Args:
+      command: the table, 'sip_buddies' or 'dialdata_table'
+      fields: the columns to read
+
+    Returns:
+      a list of row dicts, empty if the table is empty
+
+    Raises:
+      InvalidRequestError if the read fails for any other reason
+    """
+    message = {
+      'command': command,
+      'action': 'read',
+      'match': {},
+      'fields': list(fields),
+    }
+    try:
+      return self._send_and_receive(message).data
+    except NotFoundError:
+      # 404 -- the table is empty.
+      return []
+
+  def send_many(self, messages):
+    """Sends registry requests pipelined, as the bulk reads do.
+
+    The changes are not written through to the replica; callers apply the
+    successful ones themselves (see reconcile.apply_plan).
+
+    Args:
+      messages: list of message dicts, like those sent by the other methods
+
+    Returns:
+      a list with, for each message in order, a Response instance or the
+      exception raised for it
+    """
+    return self._send_and_receive_many(messages)
+
   def count_subscribers(self):
     """Counts the total number of subscribers.
 
@@ -168,11 +289,17 @@ class SIPAuthServe(BaseComponent):
       # 404 -- no subscribers found.
       return 0
 
-  def get_subscribers(self, imsi=None):
+  def get_subscribers(self, imsi=None, compact=False, fields=None):
     """Gets subscribers, optionally filtering by IMSI.
 
     Args:
       imsi: the IMSI to search by
+      compact: return subscribers.Subscriber records, which can be read like
+               the dicts but take much less memory in large result sets
+      fields: if given, only these keys of the subscriber dicts are returned
+              (e.g. ['name', 'openbts_ipaddr']).  Only the matching
+              sip_buddies columns are read, with a single request, and the
+              numbers are only looked up if asked for.
 
     Returns:
       an empty array if no subscribers match the query, or an array of
@@ -183,7 +310,14 @@ class SIPAuthServe(BaseComponent):
         'numbers': ['5551234', '5556789'],
         'account_balance': '1000',
       }
+
+    Raises:
+      ValueError if fields names an unknown key
     """
+    if fields is not None:
+      rows = list(self._iter_sip_buddies(imsi, sip_buddies_columns(fields)))
+      numbers = self._read_numbers(imsi, fields) if rows else {}
+      return self._enrich_batch(rows, fields, compact, numbers)
     qualifiers = {}
     if imsi:
       qualifiers['name'] = imsi
@@ -211,9 +345,128 @@ class SIPAuthServe(BaseComponent):
         'account_balance': self.get_account_balance(subscriber['name']),
         'caller_id': self.get_caller_id(subscriber['name']),
       }
+      if compact:
+        simplified_subscriber = Subscriber.from_dict(simplified_subscriber)
       simplified_subscribers.append(simplified_subscriber)
     return simplified_subscribers
 
+  def iter_subscribers(self, imsi=None, batch_size=500, compact=False,
+                       fields=SUBSCRIBER_FIELDS):
+    """Iterates over subscribers, optionally filtering by IMSI.
+
+    Yields the same subscribers as get_subscribers without building the
+    whole list.  The sip_buddies rows, which carry the caller ID and account
+    balance, are decoded from the reply one at a time and enriched in
+    batches of batch_size subscribers.  Only one batch is held at a time.
+    The request is sent when iteration begins.
+
+    NodeManager only matches rows on equality, so the numbers of a batch
+    cannot be read with one filtered request, and re-reading the whole
+    dialdata_table for every batch would cost far more than keeping its
+    numbers.  Instead, the numbers are read with a single dialdata_table
+    request when the first batch is enriched, and shared by every batch:
+    the registry costs two requests however many batches it spans.
+
+    Args:
+      imsi: the IMSI to search by
+      batch_size: the number of subscribers enriched together
+      compact: yield subscribers.Subscriber records instead of dicts
+      fields: the keys of the subscriber dicts to read, as in get_subscribers
+
+    Yields:
+      subscriber dicts (or records), as returned by get_subscribers
+    """
+    if batch_size < 1:
+      raise ValueError('batch_size must be positive')
+    columns = sip_buddies_columns(fields)
+    # Read with the first batch, so that no request is made for an empty
+    # result and the first subscribers are not held up.
+    numbers = None
+    batch = []
+    for row in self._iter_sip_buddies(imsi, columns):
+      batch.append(row)
+      if len(batch) == batch_size:
+        if numbers is None:
+          numbers = self._read_numbers(imsi, fields)
+        for subscriber in self._enrich_batch(batch, fields, compact, numbers):
+          yield subscriber
+        batch = []
+    if batch:
+      if numbers is None:
+        numbers = self._read_numbers(imsi, fields)
+      for subscriber in self._enrich_batch(batch, fields, compact, numbers):
+        yield subscriber
+
+  def _iter_sip_buddies(self, imsi, fields):
+    """Decodes sip_buddies rows from a single reply, one at a time."""
+    qualifiers = {}
+    if imsi:
+      qualifiers['name'] = imsi
+    message = {
+      'command': 'sip_buddies',
+      'action': 'read',
+      'match': qualifiers,
+      'fields': list(fields),
+    }
+    try:
+      for row in iter_data(self._send_and_receive_raw(message)):
+        yield row
+    except NotFoundError:
+      # 404 -- no subscribers match.
+      return
+
+  def _read_numbers(self, imsi, fields):
+    """Reads the numbers of subscribers with one dialdata_table request.
+
+    Args:
+      imsi: the IMSI whose numbers to read, or None for every number
+      fields: the subscriber fields being read; nothing is read unless they
+              include 'numbers'
+
+    Returns:
+      a dict of lists of numbers keyed by IMSI
+    """
+    numbers = {}
+    if 'numbers' not in fields:
+      return numbers
+    message = {
+      'command': 'dialdata_table',
+      'action': 'read',
+      'match': {'dial': imsi} if imsi else {},
+      'fields': ['dial', 'exten'],
+    }
+    try:
+      for row in iter_data(self._send_and_receive_raw(message)):
+        numbers.setdefault(row['dial'], []).append(row['exten'])
+    except NotFoundError:
+      # 404 -- there are no numbers.
+      pass
+    return numbers
+
+  def _enrich_batch(self, rows, fields, compact, numbers):
+    """Builds subscribers from sip_buddies rows and their numbers.
+
+    Args:
+      rows: sip_buddies rows
+      fields: the subscriber fields to build
+      compact: build subscribers.Subscriber records instead of dicts
+      numbers: lists of numbers keyed by IMSI, as read by _read_numbers
+    """
+    # The records of a batch share one tuple of their field names.
+    fields = tuple(fields)
+    subscribers = []
+    for row in rows:
+      subscriber = {}
+      for field in fields:
+        if field == 'numbers':
+          subscriber['numbers'] = numbers.get(row['name'], [])
+        else:
+          subscriber[field] = row.get(SUBSCRIBER_COLUMNS[field])
+      if compact:
+        subscriber = Subscriber.from_dict(subscriber, fields)
+      subscribers.append(subscriber)
+    return subscribers
+
   def get_openbts_ipaddr(self, imsi):
     """Get the OpenBTS IP address of a subscriber."""
     fields = ['ipaddr']
@@ -295,38 +548,48 @@ class SIPAuthServe(BaseComponent):
         'exten': str(number),
       }
     }
-    return self._send_and_receive(message)
+    response = self._send_and_receive(message)
+    if self.replica is not None:
+      self.replica.add_number(imsi, number)
+    return response
 
-  def delete_number(self, imsi, number):
-    """De-associate a number with an IMSI."""
-    # First see if the number is attached to the subscriber.
-    numbers = self.get_numbers(imsi)
-    if number not in numbers:
-      raise ValueError('number %s not attached to IMSI %s' % (number, imsi))
-    # Check if this is the only associated number.
-    if len(numbers) == 1:
-      raise ValueError('cannot delete number %s as it is the only number'
-                       ' associated with IMSI %s' % (number, imsi))
-    # See if this number is the caller ID.  If it is, promote another number
-    # to be caller ID.
-    if number == self.get_caller_id(imsi):
-      numbers.remove(number)
-      new_caller_id = numbers[-1]
-      self.update_caller_id(imsi, new_caller_id)
-    # Finally, delete the number.
-    message = {
-      'command': 'dialdata_table',
-      'action': 'delete',
-      'match': {
-        'dial': str(imsi),
-        'exten': str(number),
+  def delete_number(self, imsi, number, deadline=None):
+    """De-associate a number with an IMSI.
+
+    Args:
+      deadline: seconds within which all of the requests must complete
+    """
+    with self.deadline(deadline):
+      # First see if the number is attached to the subscriber.
+      numbers = self.get_numbers(imsi)
+      if number not in numbers:
+        raise ValueError('number %s not attached to IMSI %s' % (number, imsi))
+      # Check if this is the only associated number.
+      if len(numbers) == 1:
+        raise ValueError('cannot delete number %s as it is the only number'
+                         ' associated with IMSI %s' % (number, imsi))
+      # See if this number is the caller ID.  If it is, promote another number
+      # to be caller ID.
+      if number == self.get_caller_id(imsi):
+        numbers.remove(number)
+        new_caller_id = numbers[-1]
+        self.update_caller_id(imsi, new_caller_id)
+      # Finally, delete the number.
+      message = {
+        'command': 'dialdata_table',
+        'action': 'delete',
+        'match': {
+          'dial': str(imsi),
+          'exten': str(number),
+        }
       }
-    }
-    result = self._send_and_receive(message)
-    return result
+      result = self._send_and_receive(message)
+      if self.replica is not None:
+        self.replica.delete_number(imsi, number)
+      return result
 
   def create_subscriber(self, imsi, msisdn, openbts_ipaddr, openbts_port,
-                        ki=''):
+                        ki='', deadline=None):
     """Add a subscriber.
 
     Technically we don't need every subscriber to have a number, but we'll just
@@ -335,7 +598,8 @@ class SIPAuthServe(BaseComponent):
     however, so we have to use both when making queries and updates.
 
     In calling this method we let NodeManager automatically set the sip_buddies
-    callerid field to equal the providied msisdn.
+    callerid field to equal the providied msisdn and record the msisdn as the
+    subscriber's first number, so no separate dialdata_table request is sent.
 
     If the 'ki' argument is given, OpenBTS will use full auth.  Otherwise the
     system will use cache auth.  The values of IMSI, MSISDN and ki will all
@@ -347,32 +611,38 @@ class SIPAuthServe(BaseComponent):
       openbts_ipaddr: IP of the subscriber's OpenBTS instance
       openbts_port: port of the subscriber's OpenBTS instance
       ki: authentication key of the subscriber
+      deadline: seconds within which all of the requests must complete
 
     Returns:
       Response instance
 
     Raises:
       ValueError if the IMSI is already registered
+      TimeoutError if the deadline passes
     """
-    # First we search for this IMSI to see if it is already registered.
-    result = self.get_subscribers(imsi=imsi)
-    if result:
-      raise ValueError('IMSI %s is already registered.' % imsi)
-    message = {
-      'command': 'subscribers',
-      'action': 'create',
-      'fields': {
-        'imsi': str(imsi),
-        'msisdn': str(msisdn),
-        'ipaddr': str(openbts_ipaddr),
-        'port': str(openbts_port),
-        'name': str(imsi),
-        'ki': str(ki)
+    with self.deadline(deadline):
+      # First we search for this IMSI to see if it is already registered.
+      result = self.get_subscribers(imsi=imsi)
+      if result:
+        raise ValueError('IMSI %s is already registered.' % imsi)
+      message = {
+        'command': 'subscribers',
+        'action': 'create',
+        'fields': {
+          'imsi': str(imsi),
+          'msisdn': str(msisdn),
+          'ipaddr': str(openbts_ipaddr),
+          'port': str(openbts_port),
+          'name': str(imsi),
+          'ki': str(ki)
+        }
       }
-    }
-    response = self._send_and_receive(message)
-    self.add_number(imsi, msisdn)
-    return response
+      response = self._send_and_receive(message)
+      if self.replica is not None:
+        self.replica.create_subscriber(imsi, openbts_ipaddr, openbts_port,
+                                       msisdn)
+        self.replica.add_number(imsi, msisdn)
+      return response
 
   def delete_subscriber(self, imsi):
     """Delete a subscriber by IMSI.
@@ -391,6 +661,8 @@ class SIPAuthServe(BaseComponent):
       }
     }
     response = self._send_and_receive(message)
+    if self.replica is not None:
+      self.replica.delete_subscriber(imsi)
     return response
 
   def update_openbts_ipaddr(self, imsi, new_openbts_ipaddr):
@@ -405,7 +677,10 @@ class SIPAuthServe(BaseComponent):
         'ipaddr': new_openbts_ipaddr
       }
     }
-    return self._send_and_receive(message)
+    response = self._send_and_receive(message)
+    if self.replica is not None:
+      self.replica.update_subscriber(imsi, ipaddr=new_openbts_ipaddr)
+    return response
 
   def update_openbts_port(self, imsi, new_openbts_port):
     """Updates a subscriber's OpenBTS port."""
@@ -419,7 +694,10 @@ class SIPAuthServe(BaseComponent):
         'port': new_openbts_port,
       }
     }
-    return self._send_and_receive(message)
+    response = self._send_and_receive(message)
+    if self.replica is not None:
+      self.replica.update_subscriber(imsi, port=new_openbts_port)
+    return response
 
   def update_caller_id(self, imsi, new_caller_id):
     """Updates a subscriber's caller_id."""
@@ -436,7 +714,10 @@ class SIPAuthServe(BaseComponent):
         'callerid': new_caller_id,
       }
     }
-    return self._send_and_receive(message)
+    response = self._send_and_receive(message)
+    if self.replica is not None:
+      self.replica.update_subscriber(imsi, callerid=new_caller_id)
+    return response
 
   def get_imsi_from_number(self, number):
     """Translate a number into an IMSI.
@@ -500,7 +781,10 @@ class SIPAuthServe(BaseComponent):
         'account_balance': new_account_balance
       }
     }
-    return self._send_and_receive(message)
+    response = self._send_and_receive(message)
+    if self.replica is not None:
+      self.replica.update_subscriber(imsi, account_balance=new_account_balance)
+    return response
 
   def get_gprs_usage(self, target_imsi=None):
     """Get all available GPRS data, or that of a specific IMSI (experimental).
@@ -517,30 +801,17 @@ class SIPAuthServe(BaseComponent):
     Args:
       target_imsi: the subsciber-of-interest
     """
-    response = envoy.run('/OpenBTS/OpenBTSCLI -c "gprs list"')
-    if response.status_code != 0:
-      raise InvalidRequestError(
-        'CLI returned with non-zero status: %d' % response.status_code)
+    gprs = cli.parse_gprs_list(_run_cli('gprs list'))
     result = {}
-    for ms_block in response.std_out.split('MS#'):
-      try:
-        # Get the IMSI.
-        match = re.search(r'imsi=[\d]{15}', ms_block)
-        imsi = 'IMSI%s' % match.group(0).split('=')[1]
-        # Get the IP.
-        match = re.search(r'IPs=\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', ms_block)
-        ipaddr = match.group(0).split('=')[1]
-        # Get the uploaded and downloaded bytes.
-        match = re.search(r'Bytes:[0-9]+up\/[0-9]+down', ms_block)
-        count = match.group(0).split(':')[1]
-        uploaded_bytes = int(count.split('/')[0].strip('up'))
-        downloaded_bytes = int(count.split('/')[1].strip('down'))
-      except AttributeError:
-        # No match found.
-        continue
-      except ValueError:
-        # Casting to int failed.
+    for ms in gprs['ms']:
+      imsi = ms['gmm'].get('imsi')
+      ipaddr = ms['gmm'].get('ips')
+      if not imsi or not ipaddr or 'uploaded_bytes' not in ms:
+        # MS records without a GMM context or assigned IP have no usage.
         continue
+      imsi = 'IMSI%s' % imsi
+      uploaded_bytes = ms['uploaded_bytes']
+      downloaded_bytes = ms['downloaded_bytes']
       # See if we already have an entry for the same IMSI -- we sometimes see
       # duplicates.  If we do have an entry already, sum the byte counts across
       # entries.
@@ -571,12 +842,14 @@ class SMQueue(BaseComponent):
 
   Args:
     address: tcp socket for the zmq connection
+    addresses: an ordered list of tcp sockets (primary first) to use instead
+               of a single address
   """
 
   def __init__(self, **kwargs):
     super(SMQueue, self).__init__(**kwargs)
-    self.address = kwargs.pop('address', 'tcp://127.0.0.1:45063')
-    self.socket.connect(self.address)
+    self.connect(kwargs.pop('addresses', None) or
+                 kwargs.pop('address', 'tcp://127.0.0.1:45063'))
 
   def __repr__(self):
     return 'SMQueue component'
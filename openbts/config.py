@@ -0,0 +1,217 @@
+"""openbts.config
+client-side helpers for component config parameters
+"""
+
+import fnmatch
+import threading
+import time
+
+from openbts.exceptions import OpenBTSError
+
+
+class ConfigCache(object):
+  """Caches the config parameters read through a component.
+
+  A config read returns the parameter's value along with static metadata
+  (default value, description, type and validation info).  The metadata is
+  kept for the life of the cache, while the value is considered fresh for
+  ttl seconds; a stale value is refreshed by the next read, which replaces
+  only the value of the entry.  Updates through the component invalidate the
+  value of the updated parameters.
+
+  Args:
+    ttl: seconds for which a cached value is served without a request
+
+  Attributes:
+    hits: reads served from the cache
+    misses: reads of parameters that were not cached at all
+    refreshes: reads of cached parameters whose value was stale
+    invalidations: values invalidated by updates
+  """
+
+  def __init__(self, ttl=30):
+    self.ttl = ttl
+    # Entries are [metadata, value, fetched_at] keyed by config parameter.
+    # fetched_at is None when the value has been invalidated.
+    self.entries = {}
+    self.hits = 0
+    self.misses = 0
+    self.refreshes = 0
+    self.invalidations = 0
+    self.lock = threading.Lock()
+
+  def __len__(self):
+    return len(self.entries)
+
+  def get(self, key, now=None):
+    """Gets a config dict if its value is fresh.
+
+    Returns:
+      the config dict (metadata and 'value'), or None if the parameter must be
+      read from NodeManager
+    """
+    if now is None:
+      now = time.time()
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return None
+      metadata, value, fetched_at = entry
+      if fetched_at is None or now - fetched_at >= self.ttl:
+        self.refreshes += 1
+        return None
+      self.hits += 1
+      data = dict(metadata)
+      data['value'] = value
+      return data
+
+  def store(self, key, data, now=None):
+    """Stores a config dict read from NodeManager.
+
+    If the parameter is already cached, only its value is replaced.
+    """
+    if now is None:
+      now = time.time()
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        metadata = dict((k, v) for k, v in data.iteritems() if k != 'value')
+        self.entries[key] = [metadata, data.get('value'), now]
+      else:
+        entry[1] = data.get('value')
+        entry[2] = now
+
+  def invalidate(self, key=None):
+    """Marks the value of a parameter, or of every parameter, as stale."""
+    with self.lock:
+      keys = self.entries.keys() if key is None else [key]
+      for k in keys:
+        if k in self.entries and self.entries[k][2] is not None:
+          self.entries[k][2] = None
+          self.invalidations += 1
+
+  def hit_rate(self):
+    """Gets the fraction of reads served from the cache."""
+    reads = self.hits + self.misses + self.refreshes
+    return float(self.hits) / reads if reads else 0.0
+
+  def stats(self):
+    """Gets the cache metrics as a dict."""
+    return {
+      'entries': len(self),
+      'hits': self.hits,
+      'misses': self.misses,
+      'refreshes': self.refreshes,
+      'invalidations': self.invalidations,
+      'hit_rate': self.hit_rate(),
+    }
+
+
+class ConfigWatcher(object):
+  """Watches a component's config parameters and reports changes.
+
+  Each poll reads every parameter with a single config_snapshot request
+  and compares the values of the parameters matching the patterns with those
+  seen by the previous poll, so watching hundreds of keys costs one request
+  per poll.  The interval adapts: it drops to min_interval after a change and
+  backs off towards max_interval while nothing changes.  The first poll only
+  records the current values.
+
+  Args:
+    component: the BaseComponent to watch
+    patterns: shell-style key patterns, e.g. ['Control.*', 'GSM.*']
+    callback: called as callback(component, key, old_value, new_value) for
+              every change; old_value is None for new keys and new_value is
+              None for keys that disappeared
+    min_interval: seconds between polls after a change
+    max_interval: the most seconds between polls when nothing changes
+    backoff: the factor by which the interval grows after a quiet poll
+
+  Attributes:
+    values: the last seen values of the watched keys
+    interval: seconds until the next poll
+    polls, changes, errors: counts of polls, changes seen and failed polls
+    last_error: the exception raised by the most recent failed poll
+  """
+
+  def __init__(self, component, patterns, callback, min_interval=10,
+               max_interval=300, backoff=2):
+    if isinstance(patterns, basestring):
+      patterns = [patterns]
+    self.component = component
+    self.patterns = list(patterns)
+    self.callback = callback
+    self.min_interval = min_interval
+    self.max_interval = max_interval
+    self.backoff = backoff
+    self.interval = min_interval
+    self.values = {}
+    self.polls = 0
+    self.changes = 0
+    self.errors = 0
+    self.last_error = None
+    self._stop = threading.Event()
+    self._thread = None
+
+  def matches(self, key):
+    """Checks whether a key matches any of the watched patterns."""
+    return any(fnmatch.fnmatchcase(key, pattern) for pattern in self.patterns)
+
+  def poll(self):
+    """Reads the watched keys once and calls back for every change.
+
+    Returns:
+      a list of (key, old_value, new_value) tuples
+    """
+    try:
+      snapshot = self.component.config_snapshot()
+    except OpenBTSError as e:
+      self.errors += 1
+      self.last_error = e
+      return []
+    current = dict((key, data.get('value'))
+                   for key, data in snapshot.iteritems() if self.matches(key))
+    changes = []
+    if self.polls:
+      for key in sorted(set(current) | set(self.values)):
+        old_value, new_value = self.values.get(key), current.get(key)
+        if old_value != new_value:
+          changes.append((key, old_value, new_value))
+    self.values = current
+    self.polls += 1
+    self.changes += len(changes)
+    if changes:
+      self.interval = self.min_interval
+    else:
+      self.interval = min(self.interval * self.backoff, self.max_interval)
+    for key, old_value, new_value in changes:
+      self.callback(self.component, key, old_value, new_value)
+    return changes
+
+  def start(self):
+    """Starts polling in a daemon thread."""
+    if self._thread and self._thread.is_alive():
+      return
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self, timeout=None):
+    """Stops the background thread and waits for it to exit."""
+    self._stop.set()
+    if self._thread:
+      self._thread.join(timeout)
+      self._thread = None
+
+  def _run(self):
+    """Polls until stopped."""
+    while not self._stop.is_set():
+      try:
+        self.poll()
+      except Exception as e:  # pylint: disable=broad-except
+        # An error in a callback must not stop the watcher.
+        self.errors += 1
+        self.last_error = e
+      self._stop.wait(self.interval)
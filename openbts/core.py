@@ -2,13 +2,77 @@
 defines the base component and responses
 """
 
+import contextlib
 import json
+import re
+import threading
+import time
 
 import zmq
+from zmq.utils.monitor import recv_monitor_message
 
+from openbts.config import ConfigCache, ConfigWatcher
 from openbts.exceptions import (InvalidRequestError, InvalidResponseError,
-                                TimeoutError)
+                                NotFoundError, OpenBTSError, TimeoutError)
 from openbts.codes import (SuccessCode, ErrorCode)
+from openbts.metrics import RingBuffer
+
+
+# Socket monitor events that show a peer has connected or gone away.  With
+# heartbeats enabled, libzmq disconnects a peer that stops answering them.
+UP_EVENTS = zmq.EVENT_CONNECTED
+DOWN_EVENTS = (zmq.EVENT_DISCONNECTED | zmq.EVENT_CONNECT_RETRIED |
+               zmq.EVENT_CLOSED)
+
+# Commands whose messages only read, besides those with the 'read' action.
+READ_COMMANDS = ('version', 'monitor')
+
+# Adaptive timeouts are used once this many latencies of a command have been
+# observed on an endpoint.
+MIN_LATENCY_SAMPLES = 20
+
+
+class Endpoint(object):
+  """A NodeManager endpoint of a component and its health.
+
+  Attributes:
+    address: the endpoint's zmq address
+    socket: the REQ socket connected to the endpoint
+    healthy: False after a request to the endpoint timed out, until a request
+             to it succeeds again
+    requests: the number of requests sent to the endpoint
+    timeouts: the number of requests to the endpoint that timed out
+    last_failure: the time of the most recent timeout
+    monitor: the socket receiving the REQ socket's connection events, if
+             heartbeats are enabled
+    alive: whether the peer is connected according to the monitor, or None
+           if that is not yet known
+  """
+
+  def __init__(self, address=None, socket=None):
+    self.address = address
+    self.socket = socket
+    self.healthy = True
+    self.requests = 0
+    self.timeouts = 0
+    self.last_failure = None
+    self.monitor = None
+    self.alive = None
+
+  def __repr__(self):
+    return 'Endpoint %s' % self.address
+
+
+class _Flight(object):
+  """A request in flight that identical requests may wait on."""
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+    # Set when the leader gave up at its own deadline; the followers then
+    # send the request again rather than fail with the leader.
+    self.expired = False
 
 
 class BaseComponent(object):
@@ -16,28 +80,369 @@ class BaseComponent(object):
 
   The intent is to create other components that inherit from this base class.
 
+  A component may connect to several NodeManager endpoints (e.g. a primary
+  registry and its standby).  Writes go to the first healthy endpoint in
+  order, so to the primary while it is up; reads are spread round-robin over
+  the healthy endpoints.  When a request times out, its endpoint is marked
+  unhealthy and, if the request is a read, it is retried on the next
+  endpoint; a write may have been applied, so it is not resent.  Unhealthy
+  endpoints are tried again after retry_interval seconds.  A request that
+  only runs out of its deadline (see the deadline method) fails without
+  counting against its endpoint.
+
   kwargs:
     socket_timeout: time to poll the socket for values before raising a
                     TimeoutError
+    pipeline_window: the number of requests kept in flight by bulk operations
+                     like read_configs
+    config_cache_ttl: if given, config reads are cached and their values are
+                      served for this many seconds (see config.ConfigCache)
+    retry_interval: seconds before an unhealthy endpoint is tried again
+    adaptive_timeout: if True, the timeout of each request is derived from
+                      the latencies observed for its command on its endpoint:
+                      the 99th percentile times timeout_factor, clamped
+                      between min_timeout and max_timeout (by default
+                      socket_timeout).  socket_timeout is used until enough
+                      latencies have been observed.
+    timeout_factor, min_timeout, max_timeout: see adaptive_timeout
+    heartbeat_interval: if given, ZMTP heartbeats are sent every this many
+                        seconds and the connection of each endpoint is
+                        monitored; requests to an endpoint whose peer is known
+                        to be gone fail at once rather than wait for a timeout
+    heartbeat_timeout: seconds without a heartbeat reply before the peer is
+                       disconnected (default three heartbeat intervals)
+    scheduler: a ratelimit.RequestScheduler, possibly shared with other
+               components, that every request must get a token from
+    coalesce_reads: if True (the default), a read that is identical to one
+                    already in flight from another thread waits for and
+                    shares its reply rather than sending a duplicate; writes
+                    are never coalesced
   """
 
   def __init__(self, **kwargs):
-    self.address = None
+    self.heartbeat_interval = kwargs.pop('heartbeat_interval', None)
+    self.heartbeat_timeout = kwargs.pop('heartbeat_timeout', None)
+    if self.heartbeat_timeout is None and self.heartbeat_interval is not None:
+      self.heartbeat_timeout = 3 * self.heartbeat_interval
+    # The first endpoint is the primary; its socket and address are available
+    # as self.socket and self.address.
+    self.endpoints = [Endpoint()]
     self.setup_socket()
     # The socket will poll for this amount of time and recv if there is a
     # response available.
     self.socket_timeout = kwargs.pop('socket_timeout', 10)  # seconds
+    self.adaptive_timeout = kwargs.pop('adaptive_timeout', False)
+    self.timeout_factor = kwargs.pop('timeout_factor', 3)
+    self.min_timeout = kwargs.pop('min_timeout', 0.05)
+    self.max_timeout = kwargs.pop('max_timeout', None)
+    # Observed latencies keyed by (command, endpoint address).
+    self.latencies = {}
+    # Deadlines are per thread, see the deadline method.
+    self._deadlines = threading.local()
+    self.pipeline_window = kwargs.pop('pipeline_window', 32)
+    # Bulk operations use a separate DEALER socket, created on first use.
+    self.pipeline_socket = None
+    self.pipeline_endpoint = None
+    self.config_cache = None
+    config_cache_ttl = kwargs.pop('config_cache_ttl', None)
+    if config_cache_ttl is not None:
+      self.config_cache = ConfigCache(config_cache_ttl)
+    self.retry_interval = kwargs.pop('retry_interval', 30)
+    self.scheduler = kwargs.pop('scheduler', None)
+    self.coalesce_reads = kwargs.pop('coalesce_reads', True)
+    # Reads in flight keyed by their encoded message, and the number of reads
+    # that shared another's reply.
+    self.flights = {}
+    self.flights_lock = threading.Lock()
+    self.coalesced = 0
+    # The number of reads sent so far, used to rotate reads over endpoints.
+    self.reads = 0
+    self.reads_lock = threading.Lock()
+    # zmq sockets are not thread-safe, so requests from different threads
+    # (e.g. scheduled polls) take turns on the socket.
+    self.lock = threading.Lock()
+    # The pipeline socket and the monitor sockets have their own locks, so
+    # bulk operations and is_alive never hold up single requests.
+    self.pipeline_lock = threading.Lock()
+    self.monitor_lock = threading.Lock()
+
+  @property
+  def socket(self):
+    """The REQ socket of the primary endpoint."""
+    return self.endpoints[0].socket
+
+  @socket.setter
+  def socket(self, socket):
+    self.endpoints[0].socket = socket
+
+  @property
+  def address(self):
+    """The address of the primary endpoint."""
+    return self.endpoints[0].address
+
+  @address.setter
+  def address(self, address):
+    self.endpoints[0].address = address
 
   def setup_socket(self):
     """Sets up the ZMQ socket."""
-    context = zmq.Context()
     # The component inheriting from BaseComponent should self.socket.connect
     # with the appropriate address.
-    self.socket = context.socket(zmq.REQ)
+    self.socket = self.create_socket()
+
+  def create_socket(self):
+    """Creates a REQ socket for an endpoint."""
+    context = zmq.Context()
+    socket = context.socket(zmq.REQ)
     # LINGER sets a timeout for socket.send.
-    self.socket.setsockopt(zmq.LINGER, 0)
+    socket.setsockopt(zmq.LINGER, 0)
     # RCVTIME0 sets a timeout for socket.recv.
-    self.socket.setsockopt(zmq.RCVTIMEO, 500)  # milliseconds
+    socket.setsockopt(zmq.RCVTIMEO, 500)  # milliseconds
+    # ZMTP heartbeats need libzmq 4.2; older versions still report
+    # disconnections to the monitor.
+    if (self.heartbeat_interval is not None and
+        getattr(zmq, 'HEARTBEAT_IVL', None) is not None):
+      socket.setsockopt(zmq.HEARTBEAT_IVL,
+                        int(self.heartbeat_interval * 1000))
+      socket.setsockopt(zmq.HEARTBEAT_TIMEOUT,
+                        int(self.heartbeat_timeout * 1000))
+    return socket
+
+  def _monitor(self, endpoint):
+    """Starts monitoring the connection of an endpoint's socket.
+
+    This is a no-op unless heartbeats are enabled.  The monitor must be
+    started before the socket connects so that no event is missed.
+    """
+    if self.heartbeat_interval is None:
+      return
+    endpoint.monitor = endpoint.socket.get_monitor_socket(
+      UP_EVENTS | DOWN_EVENTS)
+    endpoint.alive = None
+
+  def _update_liveness(self, endpoint):
+    """Applies the pending monitor events of an endpoint."""
+    if endpoint.monitor is None:
+      return
+    while True:
+      try:
+        event = recv_monitor_message(endpoint.monitor, zmq.NOBLOCK)
+      except zmq.Again:
+        return
+      if event['event'] & UP_EVENTS:
+        endpoint.alive = True
+      elif event['event'] & DOWN_EVENTS:
+        endpoint.alive = False
+
+  def is_alive(self, address=None):
+    """Checks whether NodeManager is connected, without sending a request.
+
+    Only the connection events already reported by the socket monitors are
+    read.  A peer is assumed to be alive until the monitor reports otherwise,
+    and always when heartbeats are disabled.
+
+    Args:
+      address: the endpoint to check (default any endpoint)
+    """
+    with self.monitor_lock:
+      endpoints = [endpoint for endpoint in self.endpoints
+                   if address is None or endpoint.address == address]
+      for endpoint in endpoints:
+        self._update_liveness(endpoint)
+      return any(endpoint.alive is not False for endpoint in endpoints)
+
+  def connect(self, addresses):
+    """Connects to one or more NodeManager endpoints.
+
+    Args:
+      addresses: an address or an ordered list of addresses, the first of
+                 which is the primary
+    """
+    if isinstance(addresses, basestring):
+      addresses = [addresses]
+    self.address = addresses[0]
+    self._monitor(self.endpoints[0])
+    self.socket.connect(self.address)
+    for address in addresses[1:]:
+      endpoint = Endpoint(address, self.create_socket())
+      self._monitor(endpoint)
+      endpoint.socket.connect(address)
+      self.endpoints.append(endpoint)
+
+  def health(self):
+    """Gets the health of every endpoint.
+
+    Returns:
+      a list of dicts, primary first, of the form: {
+        'address': 'tcp://127.0.0.1:45064',
+        'healthy': True,
+        'requests': 1024,
+        'timeouts': 2,
+        'last_failure': 1413570000.0,
+      }
+    """
+    return [{
+      'address': endpoint.address,
+      'healthy': endpoint.healthy,
+      'requests': endpoint.requests,
+      'timeouts': endpoint.timeouts,
+      'last_failure': endpoint.last_failure,
+    } for endpoint in self.endpoints]
+
+  @contextlib.contextmanager
+  def deadline(self, seconds):
+    """Shares a time budget between every request made in a block.
+
+    Requests made in the block time out early rather than overrun the
+    deadline, and fail at once if it has passed.  Nested deadlines never
+    extend an outer one.
+
+      with component.deadline(2):
+        component.read_config('GSM.Radio.C0')
+        component.read_config('GSM.Radio.Band')
+
+    Args:
+      seconds: the budget, or None for no deadline
+    """
+    previous = getattr(self._deadlines, 'deadline', None)
+    if seconds is None:
+      yield
+      return
+    deadline = time.time() + seconds
+    if previous is not None:
+      deadline = min(deadline, previous)
+    self._deadlines.deadline = deadline
+    try:
+      yield
+    finally:
+      self._deadlines.deadline = previous
+
+  def timeout_for(self, command, address):
+    """Gets the timeout of a request in seconds.
+
+    This is the endpoint's timeout (see _endpoint_timeout), cut short if the
+    current deadline is sooner.
+
+    Args:
+      command: the command of the request, e.g. 'sip_buddies'
+      address: the address of the endpoint the request is sent to
+
+    Raises:
+      TimeoutError if the current deadline has passed
+    """
+    timeout = self._endpoint_timeout(command, address)
+    remaining = self._remaining()
+    if remaining is not None:
+      timeout = min(timeout, remaining)
+      if timeout <= 0:
+        raise TimeoutError('deadline exceeded')
+    return timeout
+
+  def _endpoint_timeout(self, command, address):
+    """Gets the timeout of a request regardless of any deadline.
+
+    An endpoint is only penalised for a poll that waited this long.
+    """
+    timeout = self.socket_timeout
+    latencies = self.latencies.get((command, address))
+    if (self.adaptive_timeout and latencies is not None and
+        len(latencies) >= MIN_LATENCY_SAMPLES):
+      max_timeout = self.max_timeout
+      if max_timeout is None:
+        max_timeout = self.socket_timeout
+      timeout = latencies.percentile(99) * self.timeout_factor
+      timeout = min(max(timeout, self.min_timeout), max_timeout)
+    return timeout
+
+  def _remaining(self):
+    """Gets the seconds left before the current deadline, or None."""
+    deadline = getattr(self._deadlines, 'deadline', None)
+    if deadline is None:
+      return None
+    return deadline - time.time()
+
+  def _record_latency(self, command, address, latency):
+    """Records the latency of a request for adaptive timeouts."""
+    if not self.adaptive_timeout:
+      return
+    key = (command, address)
+    if key not in self.latencies:
+      self.latencies[key] = RingBuffer(256)
+    self.latencies[key].append(latency)
+
+  def _candidates(self, message):
+    """Orders the endpoints to try for a message.
+
+    Healthy endpoints, and unhealthy ones due for a retry, are tried in
+    order for writes and in rotation for reads.  If none qualify, every
+    endpoint is tried rather than failing outright.  Endpoints whose peer
+    the monitor knows to be gone are never tried.
+
+    Raises:
+      TimeoutError if the peer of every endpoint is known to be gone
+    """
+    now = time.time()
+    candidates = [endpoint for endpoint in self.endpoints
+                  if endpoint.healthy or
+                  now - endpoint.last_failure >= self.retry_interval]
+    if not candidates:
+      candidates = list(self.endpoints)
+    if self.heartbeat_interval is not None:
+      with self.monitor_lock:
+        for endpoint in candidates:
+          self._update_liveness(endpoint)
+      candidates = [endpoint for endpoint in candidates
+                    if endpoint.alive is not False]
+      if not candidates:
+        raise TimeoutError('NodeManager is not connected')
+    if message.get('action') in ('read', '') and len(candidates) > 1:
+      with self.reads_lock:
+        start = self.reads % len(candidates)
+        self.reads += 1
+      candidates = candidates[start:] + candidates[:start]
+    return candidates
+
+  def _reset_endpoint(self, endpoint):
+    """Marks an endpoint unhealthy and replaces its socket.
+
+    A REQ socket that is still waiting for a reply is in a bad state, so it
+    is closed and a new one is connected.
+    """
+    endpoint.healthy = False
+    endpoint.timeouts += 1
+    endpoint.last_failure = time.time()
+    self._replace_socket(endpoint)
+
+  def _replace_socket(self, endpoint):
+    """Closes the socket of an endpoint and connects a new one."""
+    if endpoint.monitor is not None:
+      with self.monitor_lock:
+        endpoint.socket.disable_monitor()
+        endpoint.monitor.close()
+        endpoint.monitor = None
+    endpoint.socket.close()
+    endpoint.socket = self.create_socket()
+    self._monitor(endpoint)
+    endpoint.socket.connect(endpoint.address)
+
+  def setup_pipeline_socket(self, endpoint=None):
+    """Sets up the DEALER socket used to pipeline requests.
+
+    A REQ socket must receive each reply before sending the next request.  A
+    DEALER socket may have many requests in flight, and NodeManager's REP
+    socket answers them in order.
+
+    Args:
+      endpoint: the endpoint to connect to (default the one writes would go
+                to)
+    """
+    context = zmq.Context()
+    if endpoint is None:
+      endpoint = self._candidates({'action': 'update'})[0]
+    self.pipeline_endpoint = endpoint
+    self.pipeline_socket = context.socket(zmq.DEALER)
+    self.pipeline_socket.setsockopt(zmq.LINGER, 0)
+    self.pipeline_socket.connect(self.pipeline_endpoint.address)
 
   def create_config(self, key, value):
     """Create a config parameter and initialize it.
@@ -55,11 +460,13 @@ class BaseComponent(object):
     """
     raise InvalidRequestError('create config not implemented')
 
-  def read_config(self, key):
+  def read_config(self, key, use_cache=True):
     """Reads a config value.
 
     Args:
       key: the config parameter to inspect
+      use_cache: if False, always read from NodeManager even if the config
+                 cache is enabled
 
     Returns:
       Response instance
@@ -67,13 +474,19 @@ class BaseComponent(object):
     Raises:
       InvalidRequestError if the key does not exist
     """
+    if self.config_cache is not None and use_cache:
+      data = self.config_cache.get(key)
+      if data is not None:
+        return Response.from_data(data)
     message = {
       'command': 'config',
       'action': 'read',
       'key': key,
       'value': ''
     }
-    return self._send_and_receive(message)
+    response = self._send_and_receive(message)
+    self._cache_config(key, response)
+    return response
 
   def update_config(self, key, value):
     """Updates a config value.
@@ -94,8 +507,159 @@ class BaseComponent(object):
       'key': key,
       'value': str(value)
     }
-    response = self._send_and_receive(message)
-    return response
+    # A read cached while the update is in flight may hold the old value, so
+    # the key is invalidated again once the update has been answered (or has
+    # failed, since it may still have been applied).
+    if self.config_cache is not None:
+      self.config_cache.invalidate(key)
+    try:
+      return self._send_and_receive(message)
+    finally:
+      if self.config_cache is not None:
+        self.config_cache.invalidate(key)
+
+  def read_configs(self, keys, use_cache=True):
+    """Reads many config values, pipelining the requests.
+
+    Args:
+      keys: the config parameters to inspect
+      use_cache: if False, always read from NodeManager even if the config
+                 cache is enabled
+
+    Returns:
+      a (results, errors) tuple of dicts keyed by config parameter, holding
+      Response instances for the keys that were read and exceptions for those
+      that failed
+    """
+    cached = {}
+    if self.config_cache is not None and use_cache:
+      for key in keys:
+        data = self.config_cache.get(key)
+        if data is not None:
+          cached[key] = Response.from_data(data)
+      keys = [key for key in keys if key not in cached]
+    messages = [{
+      'command': 'config',
+      'action': 'read',
+      'key': key,
+      'value': ''
+    } for key in keys]
+    results, errors = _split_results(
+      keys, self._send_and_receive_many(messages))
+    for key, response in results.iteritems():
+      self._cache_config(key, response)
+    results.update(cached)
+    return results, errors
+
+  def update_configs(self, mapping):
+    """Updates many config values, pipelining the requests.
+
+    Args:
+      mapping: dict of new values keyed by config parameter
+
+    Returns:
+      a (results, errors) tuple of dicts keyed by config parameter, holding
+      Response instances for the keys that were updated and exceptions for
+      those that failed
+    """
+    keys = list(mapping)
+    if self.config_cache is not None:
+      for key in keys:
+        self.config_cache.invalidate(key)
+    messages = [{
+      'command': 'config',
+      'action': 'update',
+      'key': key,
+      'value': str(mapping[key])
+    } for key in keys]
+    results = self._send_and_receive_many(messages)
+    # As in update_config, reads cached during the batch are dropped too.
+    if self.config_cache is not None:
+      for key in keys:
+        self.config_cache.invalidate(key)
+    return _split_results(keys, results)
+
+  def apply_config(self, desired):
+    """Brings config values to a desired state, updating only what differs.
+
+    The current values are read in bulk and compared as strings (as they are
+    sent), and only the keys whose value differs are updated, also in bulk.
+    Applying a profile to a component that is already in sync costs a single
+    pipelined read.
+
+    Args:
+      desired: dict of desired values keyed by config parameter
+
+    Returns:
+      a dict of the form: {
+        'unchanged': ['GSM.Radio.C0'],
+        'live': ['Control.NumSQLTries'],
+        'dirty': ['GSM.Identity.MCC'],
+        'errors': {'Bad.Key': InvalidRequestError('not found')},
+      }
+      where 'live' changes are already in effect and 'dirty' changes take
+      effect when the component is restarted
+    """
+    report = {'unchanged': [], 'live': [], 'dirty': [], 'errors': {}}
+    current, report['errors'] = self.read_configs(list(desired),
+                                                  use_cache=False)
+    changes = {}
+    for key, response in current.iteritems():
+      if str(response.data['value']) == str(desired[key]):
+        report['unchanged'].append(key)
+      else:
+        changes[key] = desired[key]
+    if changes:
+      updated, errors = self.update_configs(changes)
+      report['errors'].update(errors)
+      for key, response in updated.iteritems():
+        if response.code == SuccessCode.NotModified:
+          report['unchanged'].append(key)
+        elif response.dirty:
+          report['dirty'].append(key)
+        else:
+          report['live'].append(key)
+    for keys in (report['unchanged'], report['live'], report['dirty']):
+      keys.sort()
+    return report
+
+  def config_snapshot(self):
+    """Reads every config parameter in a single request.
+
+    NodeManager replies to a read of the empty key with every parameter.
+
+    Returns:
+      a dict of config dicts (value, default value, description, etc.) keyed
+      by config parameter
+    """
+    response = self.read_config('', use_cache=False)
+    if isinstance(response.data, list):
+      snapshot = dict((item['key'], item) for item in response.data)
+    else:
+      snapshot = response.data
+    if self.config_cache is not None:
+      for key, data in snapshot.iteritems():
+        self.config_cache.store(key, data)
+    return snapshot
+
+  def watch_config(self, patterns, callback, **kwargs):
+    """Watches config parameters for changes made by anyone.
+
+    Args:
+      patterns: shell-style key patterns, e.g. ['Control.*', 'GSM.*']
+      callback: called as callback(component, key, old_value, new_value)
+      kwargs: passed to config.ConfigWatcher (e.g. min_interval)
+
+    Returns:
+      a ConfigWatcher; call its start method to poll in the background
+    """
+    return ConfigWatcher(self, patterns, callback, **kwargs)
+
+  def _cache_config(self, key, response):
+    """Stores a config read in the config cache, if it is enabled."""
+    if (self.config_cache is not None and key and
+        isinstance(response.data, dict)):
+      self.config_cache.store(key, response.data)
 
   def delete_config(self, key):
     """Deletes a config value.
@@ -143,22 +707,353 @@ class BaseComponent(object):
     Raises:
       TimeoutError: if nothing is received for the timeout
     """
-    # Send the message and poll for responses.
-    self.socket.send(json.dumps(message))
-    responses = self.socket.poll(timeout=self.socket_timeout * 1000)
-    if responses:
-      try:
-        raw_response_data = self.socket.recv()
-        return Response(raw_response_data)
-      except zmq.Again:
-        pass
-    # If polling fails or recv failes, we reset the socket or
-    # it will be left in a bad state, waiting for a response.
-    self.socket.close()
-    self.setup_socket()
-    self.socket.connect(self.address)
+    return Response(self._send_and_receive_raw(message))
+
+  def _send_and_receive_raw(self, message):
+    """Sends a payload to NM and returns the raw, undecoded reply.
+
+    A read identical to one already in flight shares its reply (see
+    coalesce_reads).  If the thread that sent it gives up at its own
+    deadline, the waiting threads send the read again instead of failing.
+
+    Args:
+      message: dict of a message to send to NM
+
+    Returns:
+      the json-encoded text received by zmq
+
+    Raises:
+      TimeoutError: if no endpoint replies within the timeout, or the current
+                    deadline has passed
+    """
+    if not (self.coalesce_reads and _is_read(message)):
+      return self._request(message)
+    key = json.dumps(message, sort_keys=True)
+    while True:
+      with self.flights_lock:
+        flight = self.flights.get(key)
+        leader = flight is None
+        if leader:
+          flight = self.flights[key] = _Flight()
+        else:
+          self.coalesced += 1
+      if leader:
+        break
+      if not flight.done.wait(self._remaining()):
+        raise TimeoutError('deadline exceeded')
+      if flight.expired:
+        continue
+      if flight.error is not None:
+        raise flight.error
+      return flight.result
+    try:
+      flight.result = self._request(message)
+      return flight.result
+    except Exception as e:
+      remaining = self._remaining()
+      if (isinstance(e, TimeoutError) and remaining is not None and
+          remaining <= 0):
+        flight.expired = True
+      else:
+        flight.error = e
+      raise
+    finally:
+      with self.flights_lock:
+        del self.flights[key]
+      flight.done.set()
+
+  def _request(self, message):
+    """Sends a payload to NM, failing over between endpoints.
+
+    See _send_and_receive_raw.
+    """
+    command = message.get('command')
+    for endpoint in self._candidates(message):
+      if self.scheduler is not None:
+        # Every endpoint tried takes a token of its own.  The token is taken
+        # before the lock, so that an urgent request from another thread is
+        # not stuck behind a rate-limited one.
+        self.scheduler.acquire(endpoint.address, self._remaining())
+      with self.lock:
+        full_timeout = self._endpoint_timeout(command, endpoint.address)
+        timeout = self.timeout_for(command, endpoint.address)
+        # Send the message and poll for responses.
+        endpoint.requests += 1
+        start = time.time()
+        endpoint.socket.send(json.dumps(message))
+        responses = endpoint.socket.poll(timeout=timeout * 1000)
+        if responses:
+          try:
+            raw_response_data = endpoint.socket.recv()
+            endpoint.healthy = True
+            self._record_latency(command, endpoint.address,
+                                 time.time() - start)
+            return raw_response_data
+          except zmq.Again:
+            pass
+        # If polling fails or recv failes, we reset the socket or
+        # it will be left in a bad state, waiting for a response.
+        if timeout < full_timeout:
+          # The poll was cut short by the deadline, which says nothing
+          # about the health of the endpoint.
+          self._replace_socket(endpoint)
+          raise TimeoutError('deadline exceeded')
+        self._reset_endpoint(endpoint)
+      # A write may have been delivered and applied even though no reply
+      # came back, so only reads fail over to the next endpoint.
+      if not _is_read(message):
+        break
     raise TimeoutError('did not receive a response')
 
+  def _send_and_receive_many(self, messages):
+    """Pipelines payloads to NM and returns a result per payload.
+
+    Up to pipeline_window requests are kept in flight, so a batch costs
+    about one round trip per window rather than one per message.  An error
+    for one message does not stop the others.  The batch goes to the endpoint
+    _request would pick: the next one in rotation if every message is a
+    read, else the one writes go to.  The pipeline socket is reconnected when
+    that endpoint changes.  If no reply arrives for the timeout, the pipeline
+    socket is reset and the remaining messages fail with a TimeoutError,
+    which only marks the endpoint unhealthy if the deadline was not the
+    cause; a reply marks it healthy again.  With a scheduler, each message
+    takes a token before it is sent.
+
+    Args:
+      messages: list of message dicts to send to NM
+
+    Returns:
+      a list with, for each message in order, a Response instance or the
+      exception raised for it
+    """
+    results = []
+    if all(_is_read(message) for message in messages):
+      route = messages[0] if messages else {'action': 'read'}
+    else:
+      route = {'action': 'update'}
+    with self.pipeline_lock:
+      # A socket set up by the caller (pipeline_endpoint is None) is used as
+      # it is.
+      if self.pipeline_socket is None or self.pipeline_endpoint is not None:
+        try:
+          endpoint = self._candidates(route)[0]
+        except TimeoutError as e:
+          return [TimeoutError(*e.args) for _ in messages]
+        if (self.pipeline_socket is not None and
+            endpoint is not self.pipeline_endpoint):
+          self.pipeline_socket.close()
+          self.pipeline_socket = None
+        if self.pipeline_socket is None:
+          self.setup_pipeline_socket(endpoint)
+      address = self.address
+      if self.pipeline_endpoint is not None:
+        address = self.pipeline_endpoint.address
+      if self.heartbeat_interval is not None and not self.is_alive(address):
+        return [TimeoutError('NodeManager is not connected')
+                for _ in messages]
+      sent = 0
+      # Set if the scheduler gives up on the deadline; nothing more is sent.
+      error = None
+      while len(results) < len(messages):
+        while (error is None and sent < len(messages) and
+               sent - len(results) < self.pipeline_window):
+          if self.scheduler is not None:
+            try:
+              self.scheduler.acquire(address, self._remaining())
+            except TimeoutError as e:
+              error = e
+              break
+          # DEALER sockets must add the empty delimiter frame that REQ
+          # sockets add for us.
+          self.pipeline_socket.send_multipart(
+            ['', json.dumps(messages[sent])])
+          if self.pipeline_endpoint is not None:
+            self.pipeline_endpoint.requests += 1
+          sent += 1
+        if len(results) == sent:
+          results.extend(error for _ in xrange(len(messages) - sent))
+          break
+        command = messages[len(results)].get('command')
+        full_timeout = self._endpoint_timeout(command, address)
+        try:
+          timeout = self.timeout_for(command, address)
+        except TimeoutError:
+          timeout = None
+        if (timeout is None or
+            not self.pipeline_socket.poll(timeout=timeout * 1000)):
+          # Replies that arrive late would be matched with the wrong
+          # requests, so the socket is discarded.
+          self.pipeline_socket.close()
+          self.pipeline_socket = None
+          if timeout is None or timeout < full_timeout:
+            # Running out of budget says nothing about the endpoint.
+            reason = 'deadline exceeded'
+          else:
+            # The next batch goes to the next healthy endpoint.
+            reason = 'did not receive a response'
+            if self.pipeline_endpoint is not None:
+              self.pipeline_endpoint.healthy = False
+              self.pipeline_endpoint.timeouts += 1
+              self.pipeline_endpoint.last_failure = time.time()
+          while len(results) < len(messages):
+            results.append(TimeoutError(reason))
+          break
+        raw_response_data = self.pipeline_socket.recv_multipart()[-1]
+        if self.pipeline_endpoint is not None:
+          self.pipeline_endpoint.healthy = True
+        try:
+          results.append(Response(raw_response_data))
+        except (OpenBTSError, ValueError) as e:
+          results.append(e)
+    return results
+
+
+def _is_read(message):
+  """Checks whether a message only reads data."""
+  return (message.get('action') == 'read' or
+          message.get('command') in READ_COMMANDS)
+
+
+def _split_results(keys, results):
+  """Splits the results of pipelined requests into responses and errors."""
+  responses, errors = {}, {}
+  for key, result in zip(keys, results):
+    if isinstance(result, Exception):
+      errors[key] = result
+    else:
+      responses[key] = result
+  return responses, errors
+
+
+def check_code(data, raw_response_data):
+  """Checks the code of a decoded NM reply.
+
+  Args:
+    data: dict of the decoded reply (at least its 'code' and, for errors,
+          'data' members)
+    raw_response_data: the json-encoded reply, used in error messages
+
+  Returns:
+    the SuccessCode of the reply
+
+  Raises:
+    InvalidRequestError if the reply carries an error code (NotFoundError,
+    a subclass, for 404)
+    InvalidResponseError if the reply has no code or an unknown one
+  """
+  if 'code' not in data.keys():
+    raise InvalidResponseError('key "code" not in raw response: "%s"' %
+                               raw_response_data)
+  if data['code'] in list(SuccessCode):
+    return SuccessCode(data['code'])
+  # If the request failed for some reason, raise an error.
+  if data['code'] in list(ErrorCode):
+    if data['code'] == ErrorCode.NotFound:
+      raise NotFoundError('not found')
+    elif data['code'] == ErrorCode.InvalidRequest:
+      msg = data['data'] if 'data' in data else 'invalid value'
+      raise InvalidRequestError(msg)
+    elif data['code'] == ErrorCode.ConflictingValue:
+      # TODO(matt): if creating config values isn't possible, will we ever
+      #             see the 409 code?
+      raise InvalidRequestError('conflicting value')
+    elif data['code'] == ErrorCode.StoreFailed:
+      raise InvalidRequestError('storing new value failed')
+    elif data['code'] == ErrorCode.ServiceUnavailable:
+      raise InvalidRequestError('service unavailable')
+    elif data['code'] == ErrorCode.UnknownAction:
+      raise InvalidRequestError('unknown action')
+  # Handle unknown response codes.
+  raise InvalidResponseError('code "%s" not known' % data['code'])
+
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def _skip(raw, index):
+  """Skips whitespace in raw json text."""
+  return _WHITESPACE.match(raw, index).end()
+
+
+def _expect(raw, index, character):
+  """Skips whitespace and an expected delimiter in raw json text."""
+  index = _skip(raw, index)
+  if raw[index:index + 1] != character:
+    raise InvalidResponseError('expected "%s" at position %d of raw response'
+                               % (character, index))
+  return _skip(raw, index + 1)
+
+
+def _iter_array(raw, index):
+  """Decodes the items of a json array one at a time.
+
+  Yields:
+    (item, index) tuples, where index is the position after the item
+  """
+  index = _expect(raw, index, '[')
+  if raw[index:index + 1] == ']':
+    return
+  while True:
+    item, index = _DECODER.raw_decode(raw, index)
+    index = _skip(raw, index)
+    yield item, index
+    if raw[index:index + 1] == ']':
+      return
+    index = _expect(raw, index, ',')
+
+
+def _skip_array(raw, index):
+  """Skips over a json array, returning the position after it."""
+  end = _expect(raw, index, '[')
+  for _, end in _iter_array(raw, index):
+    pass
+  return _expect(raw, end, ']')
+
+
+def iter_data(raw_response_data):
+  """Decodes the 'data' list of a NM reply incrementally.
+
+  Only one item of the list is decoded at a time, so large replies (e.g. the
+  whole TMSI table) are never held in memory as a list of dicts.  The code of
+  the reply is checked before any item is yielded.
+
+  Args:
+    raw_response_data: json-encoded text received by zmq
+
+  Yields:
+    the items of the reply's 'data' list
+
+  Raises:
+    InvalidRequestError or InvalidResponseError, as Response does
+  """
+  raw = raw_response_data
+  header = {}
+  data_index = None
+  index = _expect(raw, 0, '{')
+  while raw[index:index + 1] != '}':
+    key, index = _DECODER.raw_decode(raw, index)
+    index = _expect(raw, index, ':')
+    if key == 'data' and raw[index:index + 1] == '[':
+      data_index = index
+      if 'code' in header:
+        break
+      # The code comes after the data, so skip over the data to check it.
+      index = _skip_array(raw, index)
+    else:
+      header[key], index = _DECODER.raw_decode(raw, index)
+      index = _skip(raw, index)
+    if raw[index:index + 1] == ',':
+      index = _skip(raw, index + 1)
+  check_code(header, raw)
+  if data_index is None:
+    data = header.get('data')
+    for item in data if isinstance(data, list) else []:
+      yield item
+    return
+  for item, _ in _iter_array(raw, data_index):
+    yield item
+
 
 class Response(object):
   """Provides access to the response data.
@@ -179,32 +1074,15 @@ class Response(object):
   """
   def __init__(self, raw_response_data):
     data = json.loads(raw_response_data)
-    if 'code' not in data.keys():
-      raise InvalidResponseError('key "code" not in raw response: "%s"' %
-                                 raw_response_data)
-    # If the request was successful, create a response object and exit.
-    if data['code'] in list(SuccessCode):
-      self.code = SuccessCode(data['code'])
-      self.data = data.get('data', None)
-      self.dirty = data.get('dirty', None)
-      return
-    # If the request failed for some reason, raise an error.
-    if data['code'] in list(ErrorCode):
-      if data['code'] == ErrorCode.NotFound:
-        raise InvalidRequestError('not found')
-      elif data['code'] == ErrorCode.InvalidRequest:
-        msg = data['data'] if 'data' in data else 'invalid value'
-        raise InvalidRequestError(msg)
-      elif data['code'] == ErrorCode.ConflictingValue:
-        # TODO(matt): if creating config values isn't possible, will we ever
-        #             see the 409 code?
-        raise InvalidRequestError('conflicting value')
-      elif data['code'] == ErrorCode.StoreFailed:
-        raise InvalidRequestError('storing new value failed')
-      elif data['code'] == ErrorCode.ServiceUnavailable:
-        raise InvalidRequestError('service unavailable')
-      elif data['code'] == ErrorCode.UnknownAction:
-        raise InvalidRequestError('unknown action')
-    # Handle unknown response codes.
-    else:
-      raise InvalidResponseError('code "%s" not known' % data['code'])
+    self.code = check_code(data, raw_response_data)
+    self.data = data.get('data', None)
+    self.dirty = data.get('dirty', None)
+
+  @classmethod
+  def from_data(cls, data, code=SuccessCode.OK, dirty=None):
+    """Creates a Response from already-decoded data (e.g. a cached read)."""
+    response = cls.__new__(cls)
+    response.code = code
+    response.data = data
+    response.dirty = dirty
+    return response
@@ -10,6 +10,10 @@ class InvalidRequestError(OpenBTSError):
   """Raised upon invalid requests to Node Manager."""
   pass
 
+class NotFoundError(InvalidRequestError):
+  """Raised when Node Manager finds nothing matching a request (404)."""
+  pass
+
 class InvalidResponseError(OpenBTSError):
   """Invalid zmq response."""
   pass
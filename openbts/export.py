@@ -0,0 +1,196 @@
+"""openbts.export
+streaming exports of the subscriber registry to files
+"""
+
+import csv
+import gzip
+import json
+import os
+import time
+
+from openbts.subscribers import SUBSCRIBER_FIELDS, sip_buddies_columns
+
+
+# Export formats, by file extension.
+FORMATS = ('jsonl', 'csv', 'columns')
+
+# Separates the numbers of a subscriber in a CSV cell.
+CSV_NUMBER_SEPARATOR = ';'
+
+
+def _format_for(path):
+  """Infers the export format from a file name (e.g. 'registry.csv.gz')."""
+  name = path[:-3] if path.endswith('.gz') else path
+  extension = os.path.splitext(name)[1].lstrip('.')
+  if extension not in FORMATS:
+    raise ValueError('cannot infer the export format of "%s"' % path)
+  return extension
+
+
+def _encode(value):
+  """Encodes a value for the csv module, which only handles byte strings."""
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  return value
+
+
+class JSONLinesWriter(object):
+  """Writes one JSON object per subscriber per line."""
+
+  def __init__(self, output, fields):
+    self.output = output
+    self.fields = fields
+
+  def write(self, subscriber):
+    """Writes a subscriber."""
+    self.output.write(json.dumps(
+      dict((field, subscriber[field]) for field in self.fields)))
+    self.output.write('\n')
+
+  def close(self):
+    """Flushes any buffered rows."""
+    pass
+
+
+class CSVWriter(object):
+  """Writes a header line and then one line per subscriber.
+
+  A subscriber's numbers share one cell, separated by CSV_NUMBER_SEPARATOR.
+  """
+
+  def __init__(self, output, fields):
+    self.writer = csv.writer(output)
+    self.fields = fields
+    self.writer.writerow(fields)
+
+  def write(self, subscriber):
+    """Writes a subscriber."""
+    row = []
+    for field in self.fields:
+      value = subscriber[field]
+      if field == 'numbers':
+        value = CSV_NUMBER_SEPARATOR.join(value)
+      row.append(_encode(value))
+    self.writer.writerow(row)
+
+  def close(self):
+    """Flushes any buffered rows."""
+    pass
+
+
+class ColumnWriter(object):
+  """Writes subscribers in row groups, each stored column by column.
+
+  Every line is a JSON object of the form: {
+    'rows': 10000,
+    'columns': {'name': [...], 'openbts_ipaddr': [...], ...},
+  }
+  so a reader can load one column of a row group, and repeated values in a
+  column (e.g. BTS addresses) compress well.
+  """
+
+  def __init__(self, output, fields, row_group_size=10000):
+    self.output = output
+    self.fields = fields
+    self.row_group_size = row_group_size
+    self._reset()
+
+  def _reset(self):
+    """Starts a new row group."""
+    self.rows = 0
+    self.columns = dict((field, []) for field in self.fields)
+
+  def write(self, subscriber):
+    """Adds a subscriber to the current row group."""
+    for field in self.fields:
+      value = subscriber[field]
+      if field == 'numbers':
+        value = list(value)
+      self.columns[field].append(value)
+    self.rows += 1
+    if self.rows == self.row_group_size:
+      self.close()
+
+  def close(self):
+    """Writes the current row group, if it has any rows."""
+    if self.rows:
+      self.output.write(json.dumps({'rows': self.rows,
+                                    'columns': self.columns}))
+      self.output.write('\n')
+    self._reset()
+
+
+def export_subscribers(sipauthserve, path, export_format=None, compress=None,
+                       fields=SUBSCRIBER_FIELDS, batch_size=500,
+                       row_group_size=10000):
+  """Streams the subscriber registry to a file.
+
+  Subscribers are read with SIPAuthServe.iter_subscribers: one sip_buddies
+  request for the exported columns, whose rows are decoded one at a time,
+  and, if numbers are exported, one dialdata_table request.  Subscribers
+  are written batch by batch as they are decoded, so besides the raw
+  replies only one batch and the map of numbers are held in memory,
+  however many subscribers are exported.  The file is written under a
+  temporary name and renamed when complete.
+
+  Args:
+    sipauthserve: a components.SIPAuthServe instance
+    path: the file to write
+    export_format: 'jsonl', 'csv' or 'columns' (default from the extension
+                   of path, ignoring any '.gz')
+    compress: if True, gzip the file (default if path ends with '.gz')
+    fields: the subscriber fields to export
+    batch_size: the number of subscribers built and written together
+    row_group_size: the number of subscribers per row group in the 'columns'
+                    format
+
+  Returns:
+    a dict of the form: {
+      'rows': 50000,
+      'bytes': 3145728,
+      'elapsed': 4.2,
+      'rows_per_second': 11904.8,
+    }
+
+  Raises:
+    ValueError if the format or a field is unknown
+  """
+  if export_format is None:
+    export_format = _format_for(path)
+  if export_format not in FORMATS:
+    raise ValueError('unknown export format "%s"' % export_format)
+  if compress is None:
+    compress = path.endswith('.gz')
+  fields = list(fields)
+  # Unknown fields are rejected before the file is created.
+  sip_buddies_columns(fields)
+  temporary_path = '%s.%d.tmp' % (path, os.getpid())
+  start = time.time()
+  rows = 0
+  output = (gzip.open if compress else open)(temporary_path, 'wb')
+  complete = False
+  try:
+    if export_format == 'jsonl':
+      writer = JSONLinesWriter(output, fields)
+    elif export_format == 'csv':
+      writer = CSVWriter(output, fields)
+    else:
+      writer = ColumnWriter(output, fields, row_group_size)
+    for subscriber in sipauthserve.iter_subscribers(
+        batch_size=batch_size, fields=fields, compact=True):
+      writer.write(subscriber)
+      rows += 1
+    writer.close()
+    complete = True
+  finally:
+    output.close()
+    if not complete:
+      os.remove(temporary_path)
+  os.rename(temporary_path, path)
+  elapsed = time.time() - start
+  return {
+    'rows': rows,
+    'bytes': os.path.getsize(path),
+    'elapsed': elapsed,
+    'rows_per_second': rows / elapsed if elapsed else None,
+  }
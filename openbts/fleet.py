@@ -0,0 +1,494 @@
+"""openbts.fleet
+concurrent requests to the NodeManagers of many sites from a single thread
+"""
+
+import array
+import heapq
+import json
+import time
+
+import zmq
+
+from openbts.codes import SuccessCode
+from openbts.core import Response
+from openbts.exceptions import (InvalidResponseError, OpenBTSError,
+                                TimeoutError)
+
+
+# The NodeManager port of each component.
+PORTS = {
+  'openbts': 45060,
+  'smqueue': 45063,
+  'sipauthserve': 45064,
+}
+
+
+def node_address(host, component='openbts'):
+  """Builds the NodeManager address of a component on some host.
+
+  Args:
+    host: the site's hostname or IP address
+    component: 'openbts', 'smqueue' or 'sipauthserve'
+  """
+  return 'tcp://%s:%d' % (host, PORTS[component])
+
+
+class NodeResult(object):
+  """The outcome of the requests sent to one node.
+
+  Attributes:
+    address: the node's NodeManager address
+    results: for each message sent, in order, a Response instance or the
+             exception raised for it
+    elapsed: seconds from the first request to the last reply or timeout
+  """
+
+  def __init__(self, address, results=None, elapsed=None):
+    self.address = address
+    self.results = results if results is not None else []
+    self.elapsed = elapsed
+
+  def __repr__(self):
+    return 'NodeResult %s' % self.address
+
+  @property
+  def ok(self):
+    """True if every request to the node succeeded."""
+    return self.error is None
+
+  @property
+  def error(self):
+    """The first exception raised for the node, or None."""
+    for result in self.results:
+      if isinstance(result, Exception):
+        return result
+    return None
+
+  @property
+  def response(self):
+    """The Response to the first request, or None if it failed."""
+    if self.results and not isinstance(self.results[0], Exception):
+      return self.results[0]
+    return None
+
+
+class Fleet(object):
+  """Sends requests to the NodeManagers of many nodes from a single thread.
+
+  Each node has its own DEALER socket, kept open between calls, and every
+  socket with requests outstanding is registered with one zmq.Poller, so
+  replies are handled in the order they arrive rather than the order the
+  nodes were listed.  At most max_in_flight nodes have requests outstanding at
+  once; the others wait for a slot.  A node that does not reply within
+  timeout seconds fails with a TimeoutError and its socket is discarded, so a
+  late reply cannot be mistaken for the answer to a later request.
+
+  Args:
+    addresses: the NodeManager addresses of the nodes, e.g.
+               'tcp://10.0.0.1:45060' (see node_address)
+    max_in_flight: the number of nodes queried at the same time
+    timeout: seconds to wait for each reply from a node
+  """
+
+  def __init__(self, addresses, max_in_flight=64, timeout=10):
+    if max_in_flight < 1:
+      raise ValueError('max_in_flight must be positive')
+    self.addresses = list(addresses)
+    self.max_in_flight = max_in_flight
+    self.timeout = timeout
+    self.context = zmq.Context()
+    self.sockets = {}
+
+  def __len__(self):
+    return len(self.addresses)
+
+  def _socket(self, address):
+    """Gets the DEALER socket of a node, connecting it if necessary."""
+    if address not in self.sockets:
+      socket = self.context.socket(zmq.DEALER)
+      socket.setsockopt(zmq.LINGER, 0)
+      socket.connect(address)
+      self.sockets[address] = socket
+    return self.sockets[address]
+
+  def _discard(self, address):
+    """Closes a node's socket, dropping any replies still on their way."""
+    socket = self.sockets.pop(address, None)
+    if socket is not None:
+      socket.close()
+
+  def close(self):
+    """Closes every socket."""
+    for address in list(self.sockets):
+      self._discard(address)
+
+  def iter_requests(self, requests):
+    """Sends a list of messages to each of several nodes.
+
+    The messages for one node are pipelined on its socket.  Results are
+    yielded as soon as each node has answered all of its messages, or has
+    timed out.
+
+    Args:
+      requests: an iterable of (address, messages) tuples, where messages is
+                a list of message dicts; each address may appear only once
+
+    Yields:
+      a NodeResult per node, in the order the nodes finish
+    """
+    pending = list(requests)
+    addresses = [address for address, _ in pending]
+    if len(set(addresses)) != len(addresses):
+      raise ValueError('each node may appear only once')
+    pending.reverse()
+    poller = zmq.Poller()
+    # Sockets with requests outstanding, mapped to
+    # [result, expected reply count, started, deadline].
+    in_flight = {}
+    try:
+      while pending or in_flight:
+        while pending and len(in_flight) < self.max_in_flight:
+          address, messages = pending.pop()
+          now = time.time()
+          result = NodeResult(address)
+          if not messages:
+            result.elapsed = 0.0
+            yield result
+            continue
+          socket = self._socket(address)
+          for message in messages:
+            # DEALER sockets must add the empty delimiter frame that REQ
+            # sockets add for us.
+            socket.send_multipart(['', json.dumps(message)])
+          in_flight[socket] = [result, len(messages), now, now + self.timeout]
+          poller.register(socket, zmq.POLLIN)
+        if not in_flight:
+          continue
+        deadline = min(state[3] for state in in_flight.itervalues())
+        wait = max(0, deadline - time.time())
+        for socket, _ in poller.poll(wait * 1000):
+          state = in_flight[socket]
+          raw_response_data = socket.recv_multipart()[-1]
+          try:
+            state[0].results.append(Response(raw_response_data))
+          except (OpenBTSError, ValueError) as e:
+            state[0].results.append(e)
+          now = time.time()
+          state[3] = now + self.timeout
+          if len(state[0].results) == state[1]:
+            poller.unregister(socket)
+            del in_flight[socket]
+            state[0].elapsed = now - state[2]
+            yield state[0]
+        now = time.time()
+        for socket, state in in_flight.items():
+          if state[3] > now:
+            continue
+          poller.unregister(socket)
+          del in_flight[socket]
+          self._discard(state[0].address)
+          missing = state[1] - len(state[0].results)
+          state[0].results.extend(TimeoutError('did not receive a response')
+                                  for _ in xrange(missing))
+          state[0].elapsed = now - state[2]
+          yield state[0]
+    finally:
+      # If the caller stops early, the replies still outstanding would be
+      # read as answers to the next requests.
+      for state in in_flight.itervalues():
+        self._discard(state[0].address)
+
+  def iter_request(self, message, addresses=None):
+    """Sends the same message to every node.
+
+    Args:
+      message: the message dict to send
+      addresses: the nodes to query (default all of them)
+
+    Yields:
+      a NodeResult per node, in the order the nodes answer
+    """
+    if addresses is None:
+      addresses = self.addresses
+    return self.iter_requests((address, [message]) for address in addresses)
+
+  def request(self, message, addresses=None):
+    """Sends the same message to every node and waits for all of them.
+
+    Returns:
+      a dict of NodeResults keyed by address
+    """
+    return dict((result.address, result)
+                for result in self.iter_request(message, addresses))
+
+  def monitor(self, addresses=None):
+    """Queries the channel loads, queue sizes and noise of OpenBTS nodes.
+
+    Yields:
+      a NodeResult per node, in the order the nodes answer
+    """
+    message = {
+      'command': 'monitor',
+      'action': '',
+      'key': '',
+      'value': ''
+    }
+    return self.iter_request(message, addresses)
+
+  def get_version(self, addresses=None):
+    """Queries the version of every node.
+
+    Yields:
+      a NodeResult per node, in the order the nodes answer
+    """
+    message = {
+      'command': 'version',
+      'action': '',
+      'key': '',
+      'value': ''
+    }
+    return self.iter_request(message, addresses)
+
+  def rollout_config(self, config, waves=(1, 10, 50), max_failure_rate=0.1,
+                     addresses=None):
+    """Pushes config values to many nodes in waves.
+
+    Each node's updates are pipelined together with a read-back of every key,
+    and the node is checked against what it read back.  Nodes in a wave are
+    updated concurrently, up to max_in_flight at a time.  After each wave, if
+    the fraction of failed nodes so far exceeds max_failure_rate, the rollout
+    stops and the remaining nodes are left untouched.
+
+    Args:
+      config: dict of new values keyed by config parameter
+      waves: the number of nodes in each wave; the last size is repeated
+             until every node has been updated
+      max_failure_rate: the fraction of failed nodes that stops the rollout
+      addresses: the nodes to update (default all of them)
+
+    Returns:
+      a dict of the form: {
+        'stopped': False,
+        'waves': 3,
+        'failure_rate': 0.0,
+        'nodes': {
+          'tcp://10.0.0.1:45060': {
+            'status': 'ok',
+            'dirty': ['GSM.Identity.MCC'],
+            'errors': {},
+            'elapsed': 0.031,
+          },
+        },
+      }
+      where a node's status is 'ok', 'failed' (an update or read failed),
+      'mismatch' (a value read back differs) or 'skipped' (not attempted
+      because the rollout stopped), and 'dirty' lists the keys that take
+      effect when the node is restarted
+    """
+    if addresses is None:
+      addresses = self.addresses
+    if not waves or min(waves) < 1:
+      raise ValueError('wave sizes must be positive')
+    keys = sorted(config)
+    messages = [{
+      'command': 'config',
+      'action': 'update',
+      'key': key,
+      'value': str(config[key])
+    } for key in keys] + [{
+      'command': 'config',
+      'action': 'read',
+      'key': key,
+      'value': ''
+    } for key in keys]
+    report = {'stopped': False, 'waves': 0, 'failure_rate': 0.0, 'nodes': {}}
+    remaining = list(addresses)
+    attempted = failed = 0
+    while remaining:
+      if report['waves'] and report['failure_rate'] > max_failure_rate:
+        report['stopped'] = True
+        break
+      size = waves[min(report['waves'], len(waves) - 1)]
+      wave, remaining = remaining[:size], remaining[size:]
+      report['waves'] += 1
+      for result in self.iter_requests(
+          (address, messages) for address in wave):
+        node = _check_rollout(keys, config, result)
+        report['nodes'][result.address] = node
+        attempted += 1
+        if node['status'] != 'ok':
+          failed += 1
+      report['failure_rate'] = float(failed) / attempted
+    for address in remaining:
+      report['nodes'][address] = {
+        'status': 'skipped', 'dirty': [], 'errors': {}, 'elapsed': None,
+      }
+    return report
+
+
+def _check_rollout(keys, config, result):
+  """Summarizes the updates and read-backs sent to one node."""
+  node = {'status': 'ok', 'dirty': [], 'errors': {},
+          'elapsed': result.elapsed}
+  updates, reads = result.results[:len(keys)], result.results[len(keys):]
+  for key, update, read in zip(keys, updates, reads):
+    if isinstance(update, Exception) or isinstance(read, Exception):
+      node['errors'][key] = update if isinstance(update, Exception) else read
+      node['status'] = 'failed'
+    elif str(read.data['value']) != str(config[key]):
+      node['errors'][key] = ValueError(
+        'read back "%s", expected "%s"' % (read.data['value'], config[key]))
+      if node['status'] == 'ok':
+        node['status'] = 'mismatch'
+    elif update.dirty and update.code != SuccessCode.NotModified:
+      node['dirty'].append(key)
+  return node
+
+
+_NAN = float('nan')
+
+
+def _is_number(value):
+  """Checks whether a monitor value is a number (and not a bool)."""
+  return (isinstance(value, (int, long, float)) and
+          not isinstance(value, bool))
+
+
+class MonitorTable(object):
+  """A columnar table of the monitor data of many OpenBTS nodes.
+
+  Every numeric monitor field (e.g. 'noiseRSSI', 'gsmTCHActive') becomes an
+  array of floats with one entry per node, so aggregates and rankings run
+  over compact arrays rather than a dict per site.  A field missing from a
+  node's reply is NaN and is ignored by the aggregates.  Nodes that could
+  not be read are kept apart, in errors.
+
+  Args:
+    results: an iterable of NodeResults of monitor requests
+
+  Attributes:
+    addresses: the addresses of the nodes that answered, one per row
+    columns: dict of array('d') columns keyed by monitor field
+    errors: dict of exceptions keyed by the address of nodes that failed
+  """
+
+  def __init__(self, results):
+    self.addresses = []
+    self.columns = {}
+    self.errors = {}
+    rows = []
+    for result in results:
+      data = result.response.data if result.ok else None
+      if not isinstance(data, dict):
+        self.errors[result.address] = result.error or InvalidResponseError(
+          'monitor data is not a dict')
+        continue
+      self.addresses.append(result.address)
+      rows.append(data)
+    names = set(name for data in rows for name, value in data.iteritems()
+                if _is_number(value))
+    for name in names:
+      self.columns[name] = array.array('d', (
+        float(data[name]) if _is_number(data.get(name)) else _NAN
+        for data in rows))
+
+  def __len__(self):
+    return len(self.addresses)
+
+  def column(self, name):
+    """Gets a column, or a column of NaNs if no node reported the field."""
+    if name not in self.columns:
+      return array.array('d', [_NAN]) * len(self)
+    return self.columns[name]
+
+  def row(self, address):
+    """Gets the monitor fields of one node as a dict."""
+    index = self.addresses.index(address)
+    return dict((name, column[index])
+                for name, column in self.columns.iteritems()
+                if column[index] == column[index])
+
+  def add_ratio(self, name, numerator, denominator):
+    """Adds a column dividing one column by another, e.g. TCH utilization.
+
+    Rows where the denominator is zero or missing are NaN.
+    """
+    self.columns[name] = array.array('d', (
+      n / d if d else _NAN
+      for n, d in zip(self.column(numerator), self.column(denominator))))
+    return self.columns[name]
+
+  def total(self, name):
+    """Sums a column over every node."""
+    return sum(v for v in self.column(name) if v == v)
+
+  def mean(self, name):
+    """Averages a column, or returns None if no node reported it."""
+    values = [v for v in self.column(name) if v == v]
+    return sum(values) / len(values) if values else None
+
+  def top(self, name, n=10, largest=True):
+    """Ranks the nodes by a column.
+
+    Args:
+      name: the column to rank by, e.g. 'noiseRSSI'
+      n: the number of nodes to return
+      largest: rank the largest values first (else the smallest)
+
+    Returns:
+      a list of (address, value) tuples
+    """
+    column = self.column(name)
+    indexes = [i for i in xrange(len(self)) if column[i] == column[i]]
+    pick = heapq.nlargest if largest else heapq.nsmallest
+    return [(self.addresses[i], column[i])
+            for i in pick(n, indexes, key=column.__getitem__)]
+
+  def over(self, name, threshold):
+    """Gets the nodes whose value of a column exceeds a threshold.
+
+    Returns:
+      a list of (address, value) tuples, largest first
+    """
+    column = self.column(name)
+    matches = [(self.addresses[i], column[i]) for i in xrange(len(self))
+               if column[i] > threshold]
+    matches.sort(key=lambda match: -match[1])
+    return matches
+
+
+class FleetMonitor(object):
+  """Gathers the monitor data of many OpenBTS nodes into a MonitorTable.
+
+  Every node is queried at once by default, so a refresh takes at most one
+  timeout however many nodes are down.
+
+  Args:
+    addresses: the OpenBTS NodeManager addresses of the nodes
+    timeout: seconds to wait for each node
+    max_in_flight: the number of nodes queried at the same time (default all
+                   of them)
+
+  Attributes:
+    table: the MonitorTable of the latest refresh, or None
+    refreshed: the time of the latest refresh
+  """
+
+  def __init__(self, addresses, timeout=10, max_in_flight=None):
+    addresses = list(addresses)
+    if max_in_flight is None:
+      max_in_flight = max(1, len(addresses))
+    self.fleet = Fleet(addresses, max_in_flight=max_in_flight,
+                       timeout=timeout)
+    self.table = None
+    self.refreshed = None
+
+  def refresh(self):
+    """Queries every node and replaces the table.
+
+    Returns:
+      the new MonitorTable
+    """
+    self.table = MonitorTable(self.fleet.monitor())
+    self.refreshed = time.time()
+    return self.table
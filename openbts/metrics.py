@@ -0,0 +1,290 @@
+"""openbts.metrics
+background sampling of OpenBTS monitoring data into fixed-size time series
+"""
+
+import array
+import logging
+import threading
+import time
+
+from openbts.exceptions import OpenBTSError
+
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer(object):
+  """A fixed-size time series of floats.
+
+  Timestamps and values are kept in arrays that are allocated once, so memory
+  use does not grow no matter how many samples are appended.  Once the buffer
+  is full, each new sample overwrites the oldest one.
+
+  Args:
+    capacity: the number of samples to retain
+  """
+
+  def __init__(self, capacity):
+    if capacity < 1:
+      raise ValueError('capacity must be positive')
+    self.capacity = capacity
+    self.timestamps = array.array('d', [0.0]) * capacity
+    self.values = array.array('d', [0.0]) * capacity
+    # The total number of samples ever appended; the next write goes to
+    # index appended % capacity.
+    self.appended = 0
+    self.lock = threading.Lock()
+
+  def __len__(self):
+    return min(self.appended, self.capacity)
+
+  def append(self, value, timestamp=None):
+    """Adds a sample, overwriting the oldest one if the buffer is full."""
+    if timestamp is None:
+      timestamp = time.time()
+    with self.lock:
+      index = self.appended % self.capacity
+      self.timestamps[index] = timestamp
+      self.values[index] = value
+      self.appended += 1
+
+  def last(self, n=None):
+    """Gets the most recent samples.
+
+    Args:
+      n: the number of samples to return (default all retained samples)
+
+    Returns:
+      a list of (timestamp, value) tuples, oldest first
+    """
+    with self.lock:
+      size = len(self)
+      if n is None or n > size:
+        n = size
+      start = self.appended - n
+      return [(self.timestamps[i % self.capacity],
+               self.values[i % self.capacity])
+              for i in xrange(start, self.appended)]
+
+  def window(self, seconds=None, now=None):
+    """Gets the samples taken within the last few seconds.
+
+    Args:
+      seconds: the width of the window (default all retained samples)
+      now: the end of the window (default the current time)
+
+    Returns:
+      a list of (timestamp, value) tuples, oldest first
+    """
+    samples = self.last()
+    if seconds is None:
+      return samples
+    if now is None:
+      now = time.time()
+    cutoff = now - seconds
+    return [(t, v) for t, v in samples if t >= cutoff]
+
+  def stats(self, seconds=None, now=None):
+    """Summarizes a window of samples.
+
+    Returns:
+      None if there are no samples in the window, or a dict of the form: {
+        'count': 12,
+        'min': -71.0,
+        'mean': -68.5,
+        'max': -66.0,
+      }
+    """
+    values = [v for _, v in self.window(seconds, now)]
+    if not values:
+      return None
+    return {
+      'count': len(values),
+      'min': min(values),
+      'mean': sum(values) / len(values),
+      'max': max(values),
+    }
+
+  def percentile(self, percent, seconds=None, now=None):
+    """Computes a percentile of a window of samples.
+
+    Values between samples are linearly interpolated.
+
+    Args:
+      percent: the percentile to compute, from 0 to 100
+
+    Returns:
+      the percentile, or None if there are no samples in the window
+    """
+    if not 0 <= percent <= 100:
+      raise ValueError('percent must be between 0 and 100')
+    values = sorted(v for _, v in self.window(seconds, now))
+    if not values:
+      return None
+    rank = (len(values) - 1) * percent / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+  def downsample(self, bucket_seconds, seconds=None, now=None):
+    """Averages samples into fixed-width time buckets.
+
+    Args:
+      bucket_seconds: the width of each bucket
+      seconds: the width of the window to downsample (default all samples)
+
+    Returns:
+      a list of (bucket_start, mean_value) tuples, oldest first, omitting
+      buckets without samples
+    """
+    if bucket_seconds <= 0:
+      raise ValueError('bucket_seconds must be positive')
+    buckets = []
+    for timestamp, value in self.window(seconds, now):
+      start = timestamp - timestamp % bucket_seconds
+      if buckets and buckets[-1][0] == start:
+        buckets[-1][1] += value
+        buckets[-1][2] += 1
+      else:
+        buckets.append([start, value, 1])
+    return [(start, total / count) for start, total, count in buckets]
+
+
+def _numeric_items(data, prefix):
+  """Yields (name, value) for every number in a possibly nested dict."""
+  if not isinstance(data, dict):
+    return
+  for key, value in data.iteritems():
+    name = '%s.%s' % (prefix, key)
+    if isinstance(value, bool):
+      continue
+    elif isinstance(value, (int, long, float)):
+      yield name, float(value)
+    elif isinstance(value, dict):
+      for item in _numeric_items(value, name):
+        yield item
+
+
+class MetricsSampler(object):
+  """Periodically samples an OpenBTS component into ring buffers.
+
+  Every numeric value returned by the sources is recorded under a name like
+  'monitor.noiseRSSI', 'load.sdcch_load' or 'noise.noise_rssi_db'.  Sampling
+  errors are counted per source rather than raised, so a single timeout does
+  not stop the sampler.  Any other error in the background thread is logged
+  and counted in failures, and sampling carries on.
+
+  Args:
+    openbts: an openbts.components.OpenBTS instance
+    interval: seconds between samples
+    capacity: the number of samples retained per metric
+    sources: which of 'monitor', 'load' and 'noise' to sample
+  """
+
+  def __init__(self, openbts, interval=10, capacity=360,
+               sources=('monitor', 'load', 'noise')):
+    self.openbts = openbts
+    self.interval = interval
+    self.capacity = capacity
+    self.sources = tuple(sources)
+    self.buffers = {}
+    self.errors = dict((source, 0) for source in self.sources)
+    self.failures = 0
+    self.last_error = None
+    self.lock = threading.Lock()
+    self._stop = threading.Event()
+    self._thread = None
+
+  def _read_source(self, source):
+    """Reads the raw data of a source."""
+    if source == 'monitor':
+      return self.openbts.monitor().data
+    elif source == 'load':
+      return self.openbts.get_load()
+    elif source == 'noise':
+      return self.openbts.get_noise()
+    raise ValueError('unknown source "%s"' % source)
+
+  def sample(self):
+    """Samples every source once.
+
+    This is what the background thread runs, but it can also be registered
+    with a scheduler or called directly.
+    """
+    now = time.time()
+    for source in self.sources:
+      try:
+        data = self._read_source(source)
+      except (OpenBTSError, KeyError, ValueError):
+        # KeyError and ValueError come from CLI output the parsers do not
+        # recognise.
+        self.errors[source] += 1
+        continue
+      for name, value in _numeric_items(data, source):
+        with self.lock:
+          if name not in self.buffers:
+            self.buffers[name] = RingBuffer(self.capacity)
+          buffer = self.buffers[name]
+        buffer.append(value, now)
+
+  def series(self, name):
+    """Gets the ring buffer of a metric (empty if it was never sampled)."""
+    with self.lock:
+      buffer = self.buffers.get(name)
+    if buffer is None:
+      return RingBuffer(self.capacity)
+    return buffer
+
+  def metrics(self):
+    """Gets the names of all sampled metrics."""
+    with self.lock:
+      return sorted(self.buffers.keys())
+
+  def last(self, name, n=None):
+    """Gets the last n samples of a metric."""
+    return self.series(name).last(n)
+
+  def stats(self, name, seconds=None):
+    """Gets the min/mean/max of a metric over the last few seconds."""
+    return self.series(name).stats(seconds)
+
+  def percentile(self, name, percent, seconds=None):
+    """Gets a percentile of a metric over the last few seconds."""
+    return self.series(name).percentile(percent, seconds)
+
+  def downsample(self, name, bucket_seconds, seconds=None):
+    """Gets a metric averaged into buckets of bucket_seconds."""
+    return self.series(name).downsample(bucket_seconds, seconds)
+
+  def start(self):
+    """Starts sampling in a daemon thread."""
+    if self._thread and self._thread.is_alive():
+      return
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self, timeout=None):
+    """Stops the background thread and waits for it to exit."""
+    self._stop.set()
+    if self._thread:
+      self._thread.join(timeout)
+      self._thread = None
+
+  def _run(self):
+    """Samples until stopped, keeping to a fixed interval."""
+    next_sample = time.time()
+    while not self._stop.is_set():
+      try:
+        self.sample()
+      except Exception as e:  # pylint: disable=broad-except
+        # An unexpected error must not stop the sampler.
+        logger.exception('sampling failed')
+        self.failures += 1
+        self.last_error = e
+      # A sample that overran the interval delays the next one rather than
+      # being followed by a burst of catch-up samples.
+      now = time.time()
+      next_sample = max(next_sample + self.interval, now)
+      self._stop.wait(next_sample - now)
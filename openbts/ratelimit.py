@@ -0,0 +1,177 @@
+"""openbts.ratelimit
+client-side rate limiting and prioritization of NodeManager requests
+"""
+
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+from openbts.exceptions import TimeoutError
+from openbts.metrics import RingBuffer
+
+
+# Priority classes, most urgent first.
+PRIORITIES = ('interactive', 'background')
+
+
+class TokenBucket(object):
+  """A token bucket: rate tokens per second, holding at most burst tokens.
+
+  Not thread-safe on its own; RequestScheduler guards its buckets.
+  """
+
+  def __init__(self, rate, burst):
+    if rate <= 0:
+      raise ValueError('rate must be positive')
+    self.rate = float(rate)
+    self.burst = float(burst)
+    self.tokens = float(burst)
+    self.updated = time.time()
+
+  def refill(self, now):
+    """Adds the tokens earned since the last refill."""
+    self.tokens = min(self.burst,
+                      self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+  def wait_time(self, now):
+    """Gets the seconds until a token is available."""
+    self.refill(now)
+    if self.tokens >= 1:
+      return 0.0
+    return (1 - self.tokens) / self.rate
+
+
+class RequestScheduler(object):
+  """Rate-limits requests per endpoint and lets urgent requests go first.
+
+  Each endpoint has a token bucket; a request takes one token and waits if
+  there is none.  Waiting requests are granted tokens in priority order and
+  first come, first served within a priority class, so an interactive request
+  (e.g. get_imsi_from_number during call setup) never queues behind a backlog
+  of background requests.  One scheduler can be shared by any number of
+  components and threads.
+
+  The priority of the requests a thread makes is set with the priority
+  context manager and defaults to 'interactive':
+
+    with scheduler.priority('background'):
+      sipauthserve.get_subscribers()
+
+  Args:
+    rate: requests per second allowed to each endpoint
+    burst: the number of requests an idle endpoint may take at once (default
+           one second's worth)
+    capacity: the number of wait times retained per priority for metrics
+  """
+
+  def __init__(self, rate, burst=None, capacity=1024):
+    self.rate = rate
+    self.burst = burst if burst is not None else max(1, rate)
+    self.buckets = {}
+    # Waiting requests per endpoint, as a heap of (priority rank, sequence).
+    self.queues = {}
+    self.sequence = itertools.count()
+    self.condition = threading.Condition()
+    self.granted = dict((priority, 0) for priority in PRIORITIES)
+    self.wait_times = dict((priority, RingBuffer(capacity))
+                           for priority in PRIORITIES)
+    self._priorities = threading.local()
+
+  @contextlib.contextmanager
+  def priority(self, priority):
+    """Sets the priority of the requests this thread makes in a block."""
+    if priority not in PRIORITIES:
+      raise ValueError('unknown priority "%s"' % priority)
+    previous = self.current_priority()
+    self._priorities.priority = priority
+    try:
+      yield
+    finally:
+      self._priorities.priority = previous
+
+  def current_priority(self):
+    """Gets the priority of this thread's requests."""
+    return getattr(self._priorities, 'priority', PRIORITIES[0])
+
+  def acquire(self, address, timeout=None):
+    """Waits for this thread's turn to send a request to an endpoint.
+
+    Args:
+      address: the endpoint's address
+      timeout: the most seconds to wait (default no limit)
+
+    Raises:
+      TimeoutError if no token is granted within the timeout
+    """
+    priority = self.current_priority()
+    start = time.time()
+    with self.condition:
+      bucket = self.buckets.get(address)
+      if bucket is None:
+        bucket = self.buckets[address] = TokenBucket(self.rate, self.burst)
+      queue = self.queues.setdefault(address, [])
+      ticket = (PRIORITIES.index(priority), next(self.sequence))
+      heapq.heappush(queue, ticket)
+      try:
+        while True:
+          now = time.time()
+          wait = bucket.wait_time(now)
+          if queue[0] == ticket and wait == 0:
+            heapq.heappop(queue)
+            bucket.tokens -= 1
+            break
+          if timeout is not None:
+            remaining = start + timeout - now
+            if remaining <= 0:
+              queue.remove(ticket)
+              heapq.heapify(queue)
+              raise TimeoutError('rate limit wait exceeded the timeout')
+            wait = min(wait, remaining) if wait else remaining
+          # We are woken early when another request is granted or gives up.
+          self.condition.wait(wait or None)
+      finally:
+        self.condition.notify_all()
+      self.granted[priority] += 1
+    self.wait_times[priority].append(time.time() - start)
+
+  def queue_depths(self):
+    """Counts the waiting requests per priority."""
+    depths = dict((priority, 0) for priority in PRIORITIES)
+    with self.condition:
+      for queue in self.queues.itervalues():
+        for rank, _ in queue:
+          depths[PRIORITIES[rank]] += 1
+    return depths
+
+  def stats(self):
+    """Gets the scheduler metrics.
+
+    Returns:
+      a dict keyed by priority, of the form: {
+        'interactive': {
+          'queued': 0,
+          'granted': 5123,
+          'wait_mean': 0.0004,
+          'wait_p99': 0.012,
+          'wait_max': 0.031,
+        },
+        'background': {...},
+      }
+      where the wait times, in seconds, cover the most recent requests
+    """
+    depths = self.queue_depths()
+    stats = {}
+    for priority in PRIORITIES:
+      waits = self.wait_times[priority]
+      summary = waits.stats()
+      stats[priority] = {
+        'queued': depths[priority],
+        'granted': self.granted[priority],
+        'wait_mean': summary['mean'] if summary else None,
+        'wait_p99': waits.percentile(99),
+        'wait_max': summary['max'] if summary else None,
+      }
+    return stats
@@ -0,0 +1,265 @@
+"""openbts.reconcile
+brings the subscriber registry to a desired state with minimal changes
+"""
+
+import collections
+
+from openbts.snapshot import fetch_registry
+from openbts.subscribers import SUBSCRIBER_COLUMNS
+
+
+# A change to the registry.  kind is one of:
+#   'create' -- value is a dict of the new subscriber's msisdn, ipaddr, port
+#               and ki; NodeManager also adds the msisdn to its numbers
+#   'delete' -- value is None
+#   'remove_number', 'add_number' -- value is the number
+#   'update' -- value is a dict of new sip_buddies column values
+Operation = collections.namedtuple('Operation', ['kind', 'imsi', 'value'])
+
+# Operations are applied in two pipelined rounds: numbers can only be added
+# and sip_buddies rows updated once new subscribers exist.
+FIRST_ROUND = ('delete', 'create', 'remove_number')
+SECOND_ROUND = ('add_number', 'update')
+
+# The subscriber fields kept in sync when present in the desired state.
+UPDATABLE_FIELDS = ('openbts_ipaddr', 'openbts_port', 'caller_id',
+                    'account_balance')
+
+
+def _differs(desired, current):
+  """Compares a desired value with a registry value, as strings."""
+  return current is None or unicode(desired) != unicode(current)
+
+
+def _check_desired(desired):
+  """Indexes the desired subscribers by IMSI.
+
+  Raises:
+    ValueError if an IMSI or a number is listed more than once, if a
+    subscriber has no number, or if its caller ID is not one of its numbers
+  """
+  subscribers = collections.OrderedDict()
+  owners = {}
+  for subscriber in desired:
+    imsi = subscriber['name']
+    if imsi in subscribers:
+      raise ValueError('IMSI %s is listed more than once' % imsi)
+    if not subscriber.get('numbers'):
+      raise ValueError('IMSI %s has no numbers' % imsi)
+    for number in subscriber['numbers']:
+      if number in owners:
+        raise ValueError('number %s is listed for both %s and %s' %
+                         (number, owners[number], imsi))
+      owners[number] = imsi
+    caller_id = subscriber.get('caller_id')
+    if caller_id is not None and caller_id not in subscriber['numbers']:
+      raise ValueError('the caller ID %s of IMSI %s is not one of its numbers'
+                       % (caller_id, imsi))
+    subscribers[imsi] = subscriber
+  return subscribers
+
+
+def _plan_create(subscriber):
+  """Plans the operations that create a subscriber."""
+  imsi = subscriber['name']
+  # NodeManager adds the msisdn the subscriber is created with to its
+  # numbers and makes it the caller ID, so the desired caller ID is used.
+  msisdn = subscriber.get('caller_id')
+  if msisdn is None:
+    msisdn = subscriber['numbers'][0]
+  operations = [Operation('create', imsi, {
+    'msisdn': msisdn,
+    'ipaddr': subscriber['openbts_ipaddr'],
+    'port': subscriber['openbts_port'],
+    'ki': subscriber.get('ki', ''),
+  })]
+  operations.extend(Operation('add_number', imsi, number)
+                    for number in subscriber['numbers'] if number != msisdn)
+  if subscriber.get('account_balance') is not None:
+    operations.append(Operation('update', imsi, {
+      'account_balance': subscriber['account_balance']}))
+  return operations
+
+
+def _plan_change(subscriber, current):
+  """Plans the operations that bring a subscriber to its desired state."""
+  imsi = subscriber['name']
+  numbers = list(subscriber['numbers'])
+  current_numbers = set(current['numbers'])
+  operations = [Operation('remove_number', imsi, number)
+                for number in current['numbers'] if number not in numbers]
+  operations.extend(Operation('add_number', imsi, number)
+                    for number in numbers if number not in current_numbers)
+  columns = {}
+  for field in UPDATABLE_FIELDS:
+    value = subscriber.get(field)
+    if value is not None and _differs(value, current[field]):
+      columns[SUBSCRIBER_COLUMNS[field]] = value
+  # As delete_number does, another number becomes the caller ID when the
+  # caller ID is removed.
+  if (subscriber.get('caller_id') is None and
+      current['caller_id'] not in numbers):
+    columns['callerid'] = numbers[-1]
+  if columns:
+    operations.append(Operation('update', imsi, columns))
+  return operations
+
+
+def plan(desired, current, prune=False):
+  """Computes the fewest operations that turn one registry into another.
+
+  Args:
+    desired: subscriber dicts, as returned by SIPAuthServe.get_subscribers,
+             with at least 'name' and 'numbers' (and, for new subscribers,
+             'openbts_ipaddr' and 'openbts_port').  Of the other fields, only
+             those present and not None are kept in sync.  New subscribers
+             may also have a 'ki'.
+    current: subscriber dicts read from the registry
+    prune: if True, also delete the subscribers that are not in desired
+
+  Returns:
+    a list of Operations
+
+  Raises:
+    ValueError if desired is inconsistent (see _check_desired)
+  """
+  desired = _check_desired(desired)
+  current = dict((subscriber['name'], subscriber) for subscriber in current)
+  operations = []
+  if prune:
+    operations.extend(Operation('delete', imsi, None)
+                      for imsi in sorted(current) if imsi not in desired)
+  for imsi, subscriber in desired.iteritems():
+    if imsi in current:
+      operations.extend(_plan_change(subscriber, current[imsi]))
+    else:
+      operations.extend(_plan_create(subscriber))
+  return operations
+
+
+def summarize(operations):
+  """Counts operations by kind."""
+  counts = dict((kind, 0) for kind in FIRST_ROUND + SECOND_ROUND)
+  for operation in operations:
+    counts[operation.kind] += 1
+  return counts
+
+
+def _message(operation):
+  """Builds the NodeManager message of an operation.
+
+  The messages are those sent by the equivalent SIPAuthServe methods.
+  """
+  imsi = str(operation.imsi)
+  if operation.kind == 'create':
+    fields = dict((key, str(value))
+                  for key, value in operation.value.iteritems())
+    fields.update({'imsi': imsi, 'name': imsi})
+    return {'command': 'subscribers', 'action': 'create', 'fields': fields}
+  if operation.kind == 'delete':
+    return {'command': 'subscribers', 'action': 'delete',
+            'match': {'imsi': imsi}}
+  if operation.kind == 'add_number':
+    return {'command': 'dialdata_table', 'action': 'create',
+            'fields': {'dial': imsi, 'exten': str(operation.value)}}
+  if operation.kind == 'remove_number':
+    return {'command': 'dialdata_table', 'action': 'delete',
+            'match': {'dial': imsi, 'exten': str(operation.value)}}
+  return {'command': 'sip_buddies', 'action': 'update',
+          'match': {'name': imsi},
+          'fields': dict((column, str(value))
+                         for column, value in operation.value.iteritems())}
+
+
+def _write_through(replica, operation):
+  """Applies a successful operation to a RegistryReplica."""
+  if operation.kind == 'create':
+    replica.create_subscriber(operation.imsi, operation.value['ipaddr'],
+                              operation.value['port'],
+                              operation.value['msisdn'])
+    replica.add_number(operation.imsi, operation.value['msisdn'])
+  elif operation.kind == 'delete':
+    replica.delete_subscriber(operation.imsi)
+  elif operation.kind == 'add_number':
+    replica.add_number(operation.imsi, operation.value)
+  elif operation.kind == 'remove_number':
+    replica.delete_number(operation.imsi, operation.value)
+  else:
+    replica.update_subscriber(operation.imsi, **operation.value)
+
+
+def apply_plan(sipauthserve, operations):
+  """Applies operations with two rounds of pipelined requests.
+
+  The operations of a subscriber whose creation failed are skipped.
+
+  Args:
+    sipauthserve: a components.SIPAuthServe instance
+    operations: Operations, as returned by plan
+
+  Returns:
+    a dict of the form: {
+      'applied': [Operation(...), ...],
+      'errors': [(Operation(...), InvalidRequestError(...)), ...],
+      'skipped': [Operation(...), ...],
+    }
+  """
+  report = {'applied': [], 'errors': [], 'skipped': []}
+  failed_creates = set()
+  for kinds in (FIRST_ROUND, SECOND_ROUND):
+    batch = []
+    for operation in operations:
+      if operation.kind not in kinds:
+        continue
+      if operation.imsi in failed_creates:
+        report['skipped'].append(operation)
+      else:
+        batch.append(operation)
+    if not batch:
+      continue
+    results = sipauthserve.send_many(
+      [_message(operation) for operation in batch])
+    for operation, result in zip(batch, results):
+      if isinstance(result, Exception):
+        report['errors'].append((operation, result))
+        if operation.kind == 'create':
+          failed_creates.add(operation.imsi)
+        continue
+      report['applied'].append(operation)
+      if sipauthserve.replica is not None:
+        _write_through(sipauthserve.replica, operation)
+  return report
+
+
+def reconcile(sipauthserve, desired, prune=False, dry_run=False):
+  """Brings the subscriber registry to a desired state.
+
+  The registry is read with two bulk requests (see snapshot.fetch_registry)
+  and compared with the desired state, and only the differences are sent,
+  pipelined.  Reconciling a registry that is already in sync costs the two
+  reads.
+
+  Args:
+    sipauthserve: a components.SIPAuthServe instance
+    desired: subscriber dicts (see plan)
+    prune: if True, also delete the subscribers that are not in desired
+    dry_run: if True, only plan the operations
+
+  Returns:
+    a dict of the form: {
+      'plan': [Operation('add_number', 'IMSI001010000000001', '5551234')],
+      'summary': {'create': 0, 'delete': 0, 'add_number': 1, ...},
+      'applied': [...],
+      'errors': [...],
+      'skipped': [...],
+    }
+    where 'applied', 'errors' and 'skipped' are as returned by apply_plan
+    and are empty in a dry run
+  """
+  operations = plan(desired, fetch_registry(sipauthserve), prune)
+  report = {'applied': [], 'errors': [], 'skipped': []}
+  if operations and not dry_run:
+    report = apply_plan(sipauthserve, operations)
+  report['plan'] = operations
+  report['summary'] = summarize(operations)
+  return report
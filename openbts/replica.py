@@ -0,0 +1,272 @@
+"""openbts.replica
+a local SQLite read replica of the SIPAuthServe subscriber registry
+"""
+
+import sqlite3
+import threading
+import time
+
+from openbts.exceptions import InvalidRequestError
+
+
+# The sip_buddies columns mirrored by the replica.
+SIP_BUDDIES_FIELDS = ('name', 'ipaddr', 'port', 'callerid', 'account_balance')
+
+# The account balance NodeManager gives new subscribers.
+DEFAULT_ACCOUNT_BALANCE = '0'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sip_buddies (
+  name TEXT PRIMARY KEY,
+  ipaddr TEXT,
+  port TEXT,
+  callerid TEXT,
+  account_balance TEXT
+);
+CREATE TABLE IF NOT EXISTS dialdata_table (
+  id INTEGER PRIMARY KEY,
+  dial TEXT NOT NULL,
+  exten TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dialdata_dial ON dialdata_table (dial);
+CREATE INDEX IF NOT EXISTS dialdata_exten ON dialdata_table (exten);
+CREATE TABLE IF NOT EXISTS replica_meta (
+  key TEXT PRIMARY KEY,
+  value REAL
+);
+'''
+
+
+class RegistryReplica(object):
+  """Mirrors sip_buddies and dialdata_table into a local SQLite database.
+
+  refresh replaces the local tables with two bulk reads, and the mutating
+  methods of the SIPAuthServe component write their changes through to the
+  replica once NodeManager has accepted them (see
+  SIPAuthServe.enable_replica).  Reads are answered locally, from indexes on
+  the subscriber name (IMSI) and on the dial and exten columns, and return
+  the same values as the equivalent SIPAuthServe methods.
+
+  Changes made to the registry by other clients only reach the replica with
+  the next refresh, so callers should check staleness and fall back to the
+  component's live reads when the replica is too old for their purpose.
+
+  Args:
+    sipauthserve: the components.SIPAuthServe instance to mirror
+    path: the SQLite database file (default in memory)
+    max_age: seconds after a refresh for which the replica is not stale
+  """
+
+  def __init__(self, sipauthserve, path=':memory:', max_age=300):
+    self.sipauthserve = sipauthserve
+    self.path = path
+    self.max_age = max_age
+    self.connection = sqlite3.connect(path, check_same_thread=False)
+    self.connection.executescript(SCHEMA)
+    self.lock = threading.Lock()
+
+  def close(self):
+    """Closes the database."""
+    self.connection.close()
+
+  def refresh(self):
+    """Replaces the local tables with the current registry.
+
+    Returns:
+      a dict of the form: {'subscribers': 50000, 'numbers': 50210}
+    """
+    buddies = self.sipauthserve.read_table('sip_buddies', SIP_BUDDIES_FIELDS)
+    numbers = self.sipauthserve.read_table('dialdata_table',
+                                           ['dial', 'exten'])
+    with self.lock:
+      with self.connection:
+        self.connection.execute('DELETE FROM sip_buddies')
+        self.connection.execute('DELETE FROM dialdata_table')
+        self.connection.executemany(
+          'INSERT OR REPLACE INTO sip_buddies VALUES (?, ?, ?, ?, ?)',
+          (tuple(row.get(field) for field in SIP_BUDDIES_FIELDS)
+           for row in buddies))
+        self.connection.executemany(
+          'INSERT INTO dialdata_table (dial, exten) VALUES (?, ?)',
+          ((row['dial'], row['exten']) for row in numbers))
+        self.connection.execute(
+          'INSERT OR REPLACE INTO replica_meta VALUES (?, ?)',
+          ('refreshed', time.time()))
+    return {'subscribers': len(buddies), 'numbers': len(numbers)}
+
+  def _query(self, sql, parameters=()):
+    """Runs a query and fetches every row."""
+    with self.lock:
+      return self.connection.execute(sql, parameters).fetchall()
+
+  def refreshed(self):
+    """Gets the time of the last refresh, or None if there has been none."""
+    rows = self._query(
+      "SELECT value FROM replica_meta WHERE key = 'refreshed'")
+    return rows[0][0] if rows else None
+
+  def staleness(self, now=None):
+    """Gets the seconds since the last refresh, or None if never refreshed."""
+    refreshed = self.refreshed()
+    if refreshed is None:
+      return None
+    if now is None:
+      now = time.time()
+    return now - refreshed
+
+  def is_stale(self, now=None):
+    """Checks whether the replica is older than max_age (or empty)."""
+    staleness = self.staleness(now)
+    return staleness is None or staleness > self.max_age
+
+  def status(self):
+    """Gets the size and staleness of the replica.
+
+    Returns:
+      a dict of the form: {
+        'subscribers': 50000,
+        'numbers': 50210,
+        'staleness': 12.5,
+        'stale': False,
+      }
+    """
+    staleness = self.staleness()
+    return {
+      'subscribers': self._query('SELECT COUNT(*) FROM sip_buddies')[0][0],
+      'numbers': self._query('SELECT COUNT(*) FROM dialdata_table')[0][0],
+      'staleness': staleness,
+      'stale': staleness is None or staleness > self.max_age,
+    }
+
+  def get_subscribers(self, imsi=None):
+    """Gets subscribers as SIPAuthServe.get_subscribers does, locally."""
+    sql = ('SELECT name, ipaddr, port, callerid, account_balance'
+           ' FROM sip_buddies')
+    parameters = ()
+    if imsi:
+      sql += ' WHERE name = ?'
+      parameters = (imsi,)
+    subscribers = []
+    numbers = self._numbers_by_imsi(imsi)
+    for name, ipaddr, port, callerid, balance in self._query(sql, parameters):
+      subscribers.append({
+        'name': name,
+        'openbts_ipaddr': ipaddr,
+        'openbts_port': port,
+        'numbers': numbers.get(name, []),
+        'account_balance': balance,
+        'caller_id': callerid,
+      })
+    return subscribers
+
+  def _numbers_by_imsi(self, imsi=None):
+    """Gets lists of numbers keyed by IMSI."""
+    sql = 'SELECT dial, exten FROM dialdata_table'
+    parameters = ()
+    if imsi:
+      sql += ' WHERE dial = ?'
+      parameters = (imsi,)
+    numbers = {}
+    for dial, exten in self._query(sql + ' ORDER BY id', parameters):
+      numbers.setdefault(dial, []).append(exten)
+    return numbers
+
+  def get_numbers(self, imsi=None):
+    """Gets the numbers of an IMSI, or every number if imsi is None."""
+    sql = 'SELECT exten FROM dialdata_table'
+    parameters = ()
+    if imsi:
+      sql += ' WHERE dial = ?'
+      parameters = (imsi,)
+    return [exten for exten, in self._query(sql + ' ORDER BY id', parameters)]
+
+  def get_imsi_from_number(self, number):
+    """Translates a number into an IMSI.
+
+    Raises:
+      InvalidRequestError if the number does not exist
+    """
+    rows = self._query(
+      'SELECT dial FROM dialdata_table WHERE exten = ? ORDER BY id LIMIT 1',
+      (number,))
+    if not rows:
+      raise InvalidRequestError('not found')
+    return rows[0][0]
+
+  def _subscriber_field(self, imsi, column):
+    """Gets one sip_buddies column of a subscriber.
+
+    Raises:
+      InvalidRequestError if the subscriber does not exist
+    """
+    rows = self._query('SELECT %s FROM sip_buddies WHERE name = ?' % column,
+                       (imsi,))
+    if not rows:
+      raise InvalidRequestError('not found')
+    return rows[0][0]
+
+  def get_account_balance(self, imsi):
+    """Gets the account balance of a subscriber."""
+    return self._subscriber_field(imsi, 'account_balance')
+
+  def get_caller_id(self, imsi):
+    """Gets the caller ID of a subscriber."""
+    return self._subscriber_field(imsi, 'callerid')
+
+  def get_openbts_ipaddr(self, imsi):
+    """Gets the OpenBTS IP address of a subscriber."""
+    return self._subscriber_field(imsi, 'ipaddr')
+
+  def get_openbts_port(self, imsi):
+    """Gets the OpenBTS port of a subscriber."""
+    return self._subscriber_field(imsi, 'port')
+
+  # The methods below apply writes already accepted by NodeManager.
+
+  def _execute(self, sql, parameters):
+    """Runs a write in its own transaction."""
+    with self.lock:
+      with self.connection:
+        self.connection.execute(sql, parameters)
+
+  def create_subscriber(self, imsi, openbts_ipaddr, openbts_port, caller_id):
+    """Records a new subscriber, with NodeManager's default balance."""
+    self._execute(
+      'INSERT OR REPLACE INTO sip_buddies'
+      ' (name, ipaddr, port, callerid, account_balance)'
+      ' VALUES (?, ?, ?, ?, ?)',
+      (str(imsi), str(openbts_ipaddr), str(openbts_port), str(caller_id),
+       DEFAULT_ACCOUNT_BALANCE))
+
+  def delete_subscriber(self, imsi):
+    """Forgets a subscriber and its numbers."""
+    with self.lock:
+      with self.connection:
+        self.connection.execute('DELETE FROM sip_buddies WHERE name = ?',
+                                (str(imsi),))
+        self.connection.execute('DELETE FROM dialdata_table WHERE dial = ?',
+                                (str(imsi),))
+
+  def update_subscriber(self, imsi, **fields):
+    """Updates sip_buddies columns (ipaddr, port, callerid, ...)."""
+    columns = sorted(fields)
+    for column in columns:
+      if column not in SIP_BUDDIES_FIELDS[1:]:
+        raise ValueError('unknown sip_buddies column "%s"' % column)
+    self._execute(
+      'UPDATE sip_buddies SET %s WHERE name = ?' %
+      ', '.join('%s = ?' % column for column in columns),
+      tuple(str(fields[column]) for column in columns) + (str(imsi),))
+
+  def add_number(self, imsi, number):
+    """Records a number of a subscriber, unless it is already recorded."""
+    self._execute(
+      'INSERT INTO dialdata_table (dial, exten) SELECT ?, ?'
+      ' WHERE NOT EXISTS (SELECT 1 FROM dialdata_table'
+      ' WHERE dial = ? AND exten = ?)',
+      (str(imsi), str(number), str(imsi), str(number)))
+
+  def delete_number(self, imsi, number):
+    """Forgets a number of a subscriber."""
+    self._execute('DELETE FROM dialdata_table WHERE dial = ? AND exten = ?',
+                  (str(imsi), str(number)))
@@ -0,0 +1,202 @@
+"""openbts.scheduler
+coordinated polling of components with jitter, staggering and a concurrency cap
+"""
+
+import random
+import threading
+import time
+
+
+class PollJob(object):
+  """A periodic job registered with a PollScheduler.
+
+  Attributes:
+    name: the job's unique name
+    interval: seconds between runs
+    priority: jobs with a higher priority are started first when several are
+              due at once
+    runs: the number of completed runs
+    skips: the number of ticks skipped because the job was still running or
+           could not get a slot in time
+    errors: the number of runs that raised
+    last_error: the exception raised by the most recent failed run
+    last_duration: the duration in seconds of the most recent run
+  """
+
+  def __init__(self, name, func, interval, priority, jitter):
+    self.name = name
+    self.func = func
+    self.interval = interval
+    self.priority = priority
+    self.jitter = jitter
+    self.running = False
+    self.runs = 0
+    self.skips = 0
+    self.errors = 0
+    self.last_error = None
+    self.last_duration = None
+    # The nominal time of the next tick, and that time with jitter applied.
+    self.scheduled = None
+    self.due = None
+
+  def __repr__(self):
+    return 'PollJob %s' % self.name
+
+
+class PollScheduler(object):
+  """Runs periodic poll jobs without letting them pile up.
+
+  The first run of each job is staggered randomly across its interval and
+  every later run is jittered around its nominal tick, so jobs with the same
+  interval do not fire in the same second.  If a job is still running when
+  its next tick comes around, that tick is skipped rather than queued.  At
+  most max_concurrency jobs run at once, whether they talk to NodeManager or
+  invoke the CLI.
+
+  Args:
+    max_concurrency: the number of jobs that may run at the same time
+    jitter: the default jitter, as a fraction of a job's interval
+  """
+
+  def __init__(self, max_concurrency=1, jitter=0.1):
+    if max_concurrency < 1:
+      raise ValueError('max_concurrency must be positive')
+    self.max_concurrency = max_concurrency
+    self.jitter = jitter
+    self.jobs = {}
+    self.active = 0
+    self.condition = threading.Condition()
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def register(self, name, func, interval, priority=0, jitter=None):
+    """Registers a job.
+
+    Args:
+      name: a unique name for the job
+      func: a callable taking no arguments
+      interval: seconds between runs
+      priority: higher priority jobs start first when several are due
+      jitter: jitter as a fraction of the interval (default self.jitter)
+
+    Returns:
+      the PollJob instance
+
+    Raises:
+      ValueError if a job with this name is already registered
+    """
+    if interval <= 0:
+      raise ValueError('interval must be positive')
+    if jitter is None:
+      jitter = self.jitter
+    with self.condition:
+      if name in self.jobs:
+        raise ValueError('job %s is already registered' % name)
+      job = PollJob(name, func, interval, priority, jitter)
+      job.scheduled = time.time() + random.uniform(0, interval)
+      job.due = job.scheduled
+      self.jobs[name] = job
+      self.condition.notify_all()
+    return job
+
+  def unregister(self, name):
+    """Removes a job.  A run that is in progress is allowed to finish."""
+    with self.condition:
+      del self.jobs[name]
+
+  def _advance(self, job, now):
+    """Moves a job to its next tick after now.
+
+    Returns:
+      the number of ticks that were passed over
+    """
+    ticks = 0
+    while job.scheduled <= now:
+      job.scheduled += job.interval
+      ticks += 1
+    offset = random.uniform(-job.jitter, job.jitter) * job.interval
+    job.due = max(now, job.scheduled + offset)
+    return ticks
+
+  def run_pending(self, now=None):
+    """Starts every job that is due, as far as the concurrency cap allows.
+
+    Due jobs that cannot get a slot stay due and are started, highest priority
+    first, as soon as a running job finishes.
+
+    Returns:
+      a list of the names of the jobs that were started
+    """
+    if now is None:
+      now = time.time()
+    started = []
+    with self.condition:
+      due = [job for job in self.jobs.itervalues() if job.due <= now]
+      due.sort(key=lambda job: (-job.priority, job.due))
+      for job in due:
+        if job.running:
+          job.skips += self._advance(job, now)
+          continue
+        if self.active >= self.max_concurrency:
+          continue
+        job.skips += self._advance(job, now) - 1
+        job.running = True
+        self.active += 1
+        thread = threading.Thread(target=self._execute, args=(job,))
+        thread.daemon = True
+        thread.start()
+        started.append(job.name)
+    return started
+
+  def _execute(self, job):
+    """Runs a job once and releases its slot."""
+    start = time.time()
+    error = None
+    try:
+      job.func()
+    except Exception as e:  # pylint: disable=broad-except
+      # A failing poll must not take the scheduler down with it.
+      error = e
+    with self.condition:
+      job.running = False
+      job.runs += 1
+      job.last_duration = time.time() - start
+      if error is not None:
+        job.errors += 1
+        job.last_error = error
+      self.active -= 1
+      self.condition.notify_all()
+
+  def start(self):
+    """Starts dispatching jobs in a daemon thread."""
+    if self._thread and self._thread.is_alive():
+      return
+    self._stopped.clear()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self, timeout=None):
+    """Stops dispatching.  Runs that are in progress are allowed to finish."""
+    self._stopped.set()
+    with self.condition:
+      self.condition.notify_all()
+    if self._thread:
+      self._thread.join(timeout)
+      self._thread = None
+
+  def _run(self):
+    """Dispatches jobs until stopped."""
+    while not self._stopped.is_set():
+      self.run_pending()
+      with self.condition:
+        if self._stopped.is_set():
+          break
+        waiting = [job.due for job in self.jobs.itervalues()
+                   if not job.running]
+        if waiting and self.active < self.max_concurrency:
+          timeout = max(0, min(waiting) - time.time())
+        else:
+          timeout = None
+        # We are woken early when a job finishes or one is registered.
+        self.condition.wait(timeout)
@@ -0,0 +1,361 @@
+"""openbts.snapshot
+memory-mapped binary snapshots of the subscriber registry for warm starts
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from openbts.exceptions import OpenBTSError
+from openbts.replica import SIP_BUDDIES_FIELDS
+
+
+# A snapshot file is laid out as:
+#   the header
+#   a SUBSCRIBER record per subscriber, sorted by name (IMSI)
+#   a NUMBER record per number, grouped by subscriber
+#   an index of the NUMBER records sorted by number, as 32-bit positions
+#   the string table, in which every distinct string is stored once
+# Strings are referenced by (offset in the string table, length); a length of
+# NULL_LENGTH stands for None.
+MAGIC = 'OBRS'
+VERSION = 1
+HEADER = struct.Struct('<4sHIId20s')
+SUBSCRIBER = struct.Struct('<IHIHIHIHIHIH')
+NUMBER = struct.Struct('<IHI')
+INDEX = struct.Struct('<I')
+NULL_LENGTH = 0xffff
+
+# The subscriber fields stored in a snapshot, in record order, along with the
+# sip_buddies columns they come from.
+FIELDS = ('name', 'openbts_ipaddr', 'openbts_port', 'caller_id',
+          'account_balance')
+COLUMNS = dict(zip(FIELDS, ('name', 'ipaddr', 'port', 'callerid',
+                            'account_balance')))
+
+
+def fetch_registry(sipauthserve):
+  """Reads the joined sip_buddies and dialdata_table view with two requests.
+
+  Returns:
+    a list of subscriber dicts as returned by SIPAuthServe.get_subscribers
+  """
+  numbers = {}
+  for row in sipauthserve.read_table('dialdata_table', ['dial', 'exten']):
+    numbers.setdefault(row['dial'], []).append(row['exten'])
+  subscribers = []
+  for row in sipauthserve.read_table('sip_buddies', SIP_BUDDIES_FIELDS):
+    subscriber = dict((field, row.get(COLUMNS[field])) for field in FIELDS)
+    subscriber['numbers'] = numbers.get(row['name'], [])
+    subscribers.append(subscriber)
+  return subscribers
+
+
+def _encode(value):
+  """Encodes a field value for the string table."""
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  return str(value)
+
+
+def _body(subscribers):
+  """Encodes the sections of a snapshot that follow the header.
+
+  Returns:
+    (number count, body) -- the body is deterministic, so equal registries
+    have equal digests
+  """
+  strings = {}
+  table = []
+  size = [0]
+
+  def reference(value):
+    """Adds a value to the string table and gets its (offset, length)."""
+    if value is None:
+      return 0, NULL_LENGTH
+    value = _encode(value)
+    if value not in strings:
+      if len(value) >= NULL_LENGTH:
+        raise ValueError('string too long for a snapshot: %r' % value[:32])
+      strings[value] = size[0]
+      table.append(value)
+      size[0] += len(value)
+    return strings[value], len(value)
+
+  subscribers = sorted(subscribers, key=lambda s: _encode(s['name']))
+  records, numbers, extens = [], [], []
+  for index, subscriber in enumerate(subscribers):
+    fields = []
+    for field in FIELDS:
+      fields.extend(reference(subscriber.get(field)))
+    fields.extend((len(numbers), len(subscriber['numbers'])))
+    records.append(SUBSCRIBER.pack(*fields))
+    for number in subscriber['numbers']:
+      extens.append((_encode(number), len(numbers)))
+      numbers.append(NUMBER.pack(*(reference(number) + (index,))))
+  extens.sort()
+  index = [INDEX.pack(position) for _, position in extens]
+  body = ''.join(records + numbers + index + table)
+  return len(numbers), body
+
+
+def write_snapshot(path, subscribers, created=None):
+  """Writes a registry snapshot, atomically replacing any existing file.
+
+  Args:
+    path: the snapshot file
+    subscribers: subscriber dicts as returned by SIPAuthServe.get_subscribers
+    created: the time the registry was read (default now)
+
+  Returns:
+    the digest of the snapshot's contents
+  """
+  if created is None:
+    created = time.time()
+  subscribers = list(subscribers)
+  number_count, body = _body(subscribers)
+  digest = hashlib.sha1(body).digest()
+  temporary_path = '%s.%d.tmp' % (path, os.getpid())
+  with open(temporary_path, 'wb') as snapshot_file:
+    snapshot_file.write(HEADER.pack(MAGIC, VERSION, len(subscribers),
+                                    number_count, created, digest))
+    snapshot_file.write(body)
+  os.rename(temporary_path, path)
+  return digest
+
+
+class RegistrySnapshot(object):
+  """A read-only, memory-mapped registry snapshot.
+
+  Opening a snapshot only maps the file and reads its header, so it takes
+  the same time whatever the size of the registry, and the pages are shared
+  between processes that map the same file.  Lookups by IMSI and by number
+  are binary searches over the mapped records.
+
+  Args:
+    path: the snapshot file, as written by write_snapshot
+
+  Attributes:
+    created: the time the registry was read from NodeManager
+    digest: the SHA-1 digest of the snapshot's contents
+
+  Raises:
+    ValueError if the file is not a snapshot of this version
+  """
+
+  def __init__(self, path):
+    self.path = path
+    with open(path, 'rb') as snapshot_file:
+      self.map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(self.map) < HEADER.size:
+      raise ValueError('%s is not a registry snapshot' % path)
+    (magic, version, self.count, self.number_count, self.created,
+     self.digest) = HEADER.unpack_from(self.map, 0)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError('%s is not a version %d registry snapshot' %
+                       (path, VERSION))
+    self.numbers_offset = HEADER.size + self.count * SUBSCRIBER.size
+    self.index_offset = self.numbers_offset + self.number_count * NUMBER.size
+    self.strings_offset = self.index_offset + self.number_count * INDEX.size
+
+  def __len__(self):
+    return self.count
+
+  def __iter__(self):
+    for index in xrange(self.count):
+      yield self._subscriber(index)
+
+  def _string(self, offset, length):
+    """Reads a string from the string table."""
+    if length == NULL_LENGTH:
+      return None
+    start = self.strings_offset + offset
+    return self.map[start:start + length]
+
+  def _record(self, index):
+    """Unpacks a SUBSCRIBER record."""
+    return SUBSCRIBER.unpack_from(self.map,
+                                  HEADER.size + index * SUBSCRIBER.size)
+
+  def _name(self, index):
+    """Reads the name (IMSI) of the subscriber at some index."""
+    offset, length = SUBSCRIBER.unpack_from(
+      self.map, HEADER.size + index * SUBSCRIBER.size)[:2]
+    return self._string(offset, length)
+
+  def _number(self, position):
+    """Unpacks a NUMBER record into (number, subscriber index)."""
+    offset, length, index = NUMBER.unpack_from(
+      self.map, self.numbers_offset + position * NUMBER.size)
+    return self._string(offset, length), index
+
+  def _subscriber(self, index):
+    """Rebuilds the subscriber dict at some index."""
+    record = self._record(index)
+    subscriber = {}
+    for i, field in enumerate(FIELDS):
+      subscriber[field] = self._string(record[2 * i], record[2 * i + 1])
+    first, count = record[-2:]
+    subscriber['numbers'] = [self._number(position)[0]
+                             for position in xrange(first, first + count)]
+    return subscriber
+
+  def _find(self, imsi):
+    """Binary searches for the index of an IMSI, or returns None."""
+    imsi = _encode(imsi)
+    low, high = 0, self.count
+    while low < high:
+      middle = (low + high) // 2
+      if self._name(middle) < imsi:
+        low = middle + 1
+      else:
+        high = middle
+    if low < self.count and self._name(low) == imsi:
+      return low
+    return None
+
+  def get(self, imsi):
+    """Gets a subscriber dict by IMSI, or None if it is unknown."""
+    index = self._find(imsi)
+    return None if index is None else self._subscriber(index)
+
+  def lookup_number(self, number):
+    """Gets the IMSI a number belongs to, or None if it is unknown."""
+    number = _encode(number)
+    low, high = 0, self.number_count
+    while low < high:
+      middle = (low + high) // 2
+      position, = INDEX.unpack_from(self.map,
+                                    self.index_offset + middle * INDEX.size)
+      if self._number(position)[0] < number:
+        low = middle + 1
+      else:
+        high = middle
+    if low == self.number_count:
+      return None
+    position, = INDEX.unpack_from(self.map,
+                                  self.index_offset + low * INDEX.size)
+    exten, index = self._number(position)
+    return self._name(index) if exten == number else None
+
+  def close(self):
+    """Unmaps the file."""
+    self.map.close()
+
+
+class SnapshotRegistry(object):
+  """Serves registry lookups from a snapshot and keeps it up to date.
+
+  start opens the existing snapshot, if there is a valid one, so lookups
+  can be served right away, and then revalidates it against NodeManager in a
+  background thread: the registry is read with two bulk requests and, if it
+  differs from the snapshot, a new snapshot is written and swapped in.
+  Without a snapshot to start from, start reads the registry before
+  returning and the background thread only runs if an interval is given.
+
+  Args:
+    sipauthserve: a components.SIPAuthServe instance
+    path: the snapshot file
+    interval: if given, revalidate every interval seconds rather than once
+
+  Attributes:
+    snapshot: the current RegistrySnapshot, or None
+    revalidations, updates, errors: counts of revalidations, of those that
+                                    replaced the snapshot and of those that
+                                    failed
+    last_error: the exception raised by the most recent failed revalidation
+    validated: the time the snapshot was last confirmed against NodeManager,
+               or None
+  """
+
+  def __init__(self, sipauthserve, path, interval=None):
+    self.sipauthserve = sipauthserve
+    self.path = path
+    self.interval = interval
+    self.snapshot = None
+    self.revalidations = 0
+    self.updates = 0
+    self.errors = 0
+    self.last_error = None
+    self.validated = None
+    self._stop = threading.Event()
+    self._thread = None
+
+  def start(self):
+    """Opens the snapshot and starts revalidating it in the background."""
+    try:
+      self.snapshot = RegistrySnapshot(self.path)
+      self.validated = self.snapshot.created
+      warm = True
+    except (IOError, ValueError):
+      self.revalidate()
+      warm = False
+    if warm or self.interval is not None:
+      self._stop.clear()
+      self._thread = threading.Thread(target=self._run, args=(warm,))
+      self._thread.daemon = True
+      self._thread.start()
+
+  def stop(self, timeout=None):
+    """Stops the background thread and waits for it to exit."""
+    self._stop.set()
+    if self._thread:
+      self._thread.join(timeout)
+      self._thread = None
+
+  def _run(self, revalidate_now):
+    """Revalidates once, or every interval seconds until stopped."""
+    if not revalidate_now:
+      self._stop.wait(self.interval)
+    while not self._stop.is_set():
+      try:
+        self.revalidate()
+      except (OpenBTSError, EnvironmentError) as e:
+        self.errors += 1
+        self.last_error = e
+      if self.interval is None:
+        return
+      self._stop.wait(self.interval)
+
+  def revalidate(self):
+    """Reads the registry and replaces the snapshot if it has changed.
+
+    Returns:
+      True if the snapshot was replaced
+    """
+    subscribers = fetch_registry(self.sipauthserve)
+    self.revalidations += 1
+    _, body = _body(subscribers)
+    current = self.snapshot
+    if current is not None and hashlib.sha1(body).digest() == current.digest:
+      self.validated = time.time()
+      return False
+    write_snapshot(self.path, subscribers)
+    # Readers holding the old snapshot keep using it; its map is released
+    # when the last of them lets go.
+    self.snapshot = RegistrySnapshot(self.path)
+    self.validated = time.time()
+    self.updates += 1
+    return True
+
+  def staleness(self, now=None):
+    """Gets the seconds since the snapshot was last validated."""
+    if self.validated is None:
+      return None
+    if now is None:
+      now = time.time()
+    return now - self.validated
+
+  def get(self, imsi):
+    """Gets a subscriber dict by IMSI, or None if it is unknown."""
+    return self.snapshot.get(imsi)
+
+  def lookup_number(self, number):
+    """Gets the IMSI a number belongs to, or None if it is unknown."""
+    return self.snapshot.lookup_number(number)
+
+  def __len__(self):
+    return len(self.snapshot) if self.snapshot is not None else 0
@@ -0,0 +1,155 @@
+"""openbts.subscribers
+compact records for large lists of subscribers
+"""
+
+
+# The keys of the subscriber dicts returned by SIPAuthServe.get_subscribers.
+SUBSCRIBER_FIELDS = ('name', 'openbts_ipaddr', 'openbts_port', 'numbers',
+                     'account_balance', 'caller_id')
+
+# The sip_buddies column each subscriber field is read from ('numbers' come
+# from dialdata_table).
+SUBSCRIBER_COLUMNS = {
+  'name': 'name',
+  'openbts_ipaddr': 'ipaddr',
+  'openbts_port': 'port',
+  'account_balance': 'account_balance',
+  'caller_id': 'callerid',
+}
+
+
+def sip_buddies_columns(fields):
+  """Gets the sip_buddies columns needed to build some subscriber fields.
+
+  Raises:
+    ValueError if a field is unknown
+  """
+  columns = []
+  for field in fields:
+    if field not in SUBSCRIBER_FIELDS:
+      raise ValueError('unknown subscriber field "%s"' % field)
+    # The name is needed to look the numbers up.
+    column = SUBSCRIBER_COLUMNS.get(field, 'name')
+    if column not in columns:
+      columns.append(column)
+  return columns
+
+
+def _intern(value):
+  """Interns a string so equal values share one object."""
+  if value is None:
+    return None
+  return intern(str(value))
+
+
+class Subscriber(object):
+  """A subscriber record that takes a fraction of the memory of a dict.
+
+  The record has no per-instance __dict__, the OpenBTS IP address and port,
+  which are shared by every subscriber camped on the same BTS, are interned,
+  and the numbers are kept in a tuple.  Subscribers can still be read like
+  the dicts returned by SIPAuthServe.get_subscribers (subscriber['numbers'],
+  subscriber.get('caller_id'), dict(subscriber), ...) and compare equal to
+  the equivalent dict, but they are read-only through that interface.
+
+  A record built from a projection (see SIPAuthServe.get_subscribers) only
+  has the projected fields as keys, like the equivalent dict.  The
+  attributes of the other fields are None, or an empty tuple for numbers.
+
+  Args:
+    name: the IMSI
+    openbts_ipaddr: the IP address of the subscriber's BTS
+    openbts_port: the port of the subscriber's BTS
+    numbers: the subscriber's numbers
+    account_balance: the subscriber's account balance
+    caller_id: the subscriber's caller ID
+    fields: the fields the record has as keys (default all of them)
+  """
+
+  __slots__ = SUBSCRIBER_FIELDS + ('_fields',)
+
+  def __init__(self, name=None, openbts_ipaddr=None, openbts_port=None,
+               numbers=(), account_balance=None, caller_id=None,
+               fields=SUBSCRIBER_FIELDS):
+    self.name = name
+    self.openbts_ipaddr = _intern(openbts_ipaddr)
+    self.openbts_port = _intern(openbts_port)
+    self.numbers = tuple(numbers)
+    self.account_balance = account_balance
+    self.caller_id = caller_id
+    self._fields = fields
+
+  @classmethod
+  def from_dict(cls, subscriber, fields=None):
+    """Builds a record from a subscriber dict.
+
+    Args:
+      subscriber: a subscriber dict, possibly projected
+      fields: the keys of the dict, in order (default the known fields it
+              has); pass one tuple for a whole result set so that the
+              records share it
+    """
+    if fields is None:
+      fields = tuple(field for field in SUBSCRIBER_FIELDS
+                     if field in subscriber)
+      if fields == SUBSCRIBER_FIELDS:
+        fields = SUBSCRIBER_FIELDS
+    return cls(fields=fields, **subscriber)
+
+  def __getitem__(self, key):
+    if key not in self._fields:
+      raise KeyError(key)
+    return getattr(self, key)
+
+  def get(self, key, default=None):
+    """Gets a field as dict.get does."""
+    if key not in self._fields:
+      return default
+    return getattr(self, key)
+
+  def __contains__(self, key):
+    return key in self._fields
+
+  def __iter__(self):
+    return iter(self._fields)
+
+  def __len__(self):
+    return len(self._fields)
+
+  def keys(self):
+    """Gets the field names."""
+    return list(self._fields)
+
+  def values(self):
+    """Gets the field values."""
+    return [getattr(self, key) for key in self._fields]
+
+  def items(self):
+    """Gets (field name, value) pairs."""
+    return [(key, getattr(self, key)) for key in self._fields]
+
+  def to_dict(self):
+    """Converts the record into a subscriber dict with a list of numbers."""
+    subscriber = dict(self.items())
+    if 'numbers' in subscriber:
+      subscriber['numbers'] = list(self.numbers)
+    return subscriber
+
+  def __eq__(self, other):
+    if not isinstance(other, (Subscriber, dict)):
+      return NotImplemented
+    other = dict(other.items())
+    if 'numbers' in other:
+      other['numbers'] = list(other['numbers'])
+    return self.to_dict() == other
+
+  def __ne__(self, other):
+    equal = self.__eq__(other)
+    return equal if equal is NotImplemented else not equal
+
+  # Like dicts, records are mutable and so unhashable.
+  __hash__ = None
+
+  def __repr__(self):
+    return 'Subscriber(%s)' % ', '.join(
+      '%s=%r' % (key, getattr(self, key)) for key in self._fields)
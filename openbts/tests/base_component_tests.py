@@ -4,13 +4,16 @@ tests for the base component class
 
 import json
 from multiprocessing import Process
+import threading
 import time
 import unittest
 
+import mock
 import zmq
 
-from openbts.core import BaseComponent
-from openbts.exceptions import TimeoutError
+from openbts.core import BaseComponent, MIN_LATENCY_SAMPLES, iter_data
+from openbts.exceptions import (InvalidRequestError, InvalidResponseError,
+                                TimeoutError)
 from openbts.codes import (SuccessCode, ErrorCode)
 
 
@@ -56,3 +59,439 @@ class BaseComponentTestCase(unittest.TestCase):
     component.socket.connect(self.DEMO_ADDRESS)
     with self.assertRaises(TimeoutError):
       component.read_config('sample-key')
+
+
+class IterDataTestCase(unittest.TestCase):
+  """Testing the incremental decoding of replies with core.iter_data."""
+
+  def test_code_before_data(self):
+    raw = json.dumps({'code': 200, 'data': [{'a': 1}, {'a': 2}]})
+    self.assertEqual([{'a': 1}, {'a': 2}], list(iter_data(raw)))
+
+  def test_code_after_data(self):
+    """The code is checked even when it follows the data."""
+    raw = '{"data": [1, [2, 3], {"b": "]"}], "code": 200}'
+    self.assertEqual([1, [2, 3], {'b': ']'}], list(iter_data(raw)))
+    raw = '{"data": [], "code": 404}'
+    with self.assertRaises(InvalidRequestError):
+      list(iter_data(raw))
+
+  def test_empty_and_missing_data(self):
+    self.assertEqual([], list(iter_data('{"code": 200, "data": []}')))
+    self.assertEqual([], list(iter_data('{"code": 204}')))
+
+  def test_error_codes(self):
+    with self.assertRaises(InvalidRequestError):
+      list(iter_data('{"code": 404, "data": "not found"}'))
+    with self.assertRaises(InvalidResponseError):
+      list(iter_data('{"data": [1]}'))
+
+  def test_lazy(self):
+    """Items are decoded one at a time."""
+    items = iter_data('{"code": 200, "data": [1, 2, oops]}')
+    self.assertEqual(1, next(items))
+    self.assertEqual(2, next(items))
+    with self.assertRaises(ValueError):
+      next(items)
+
+
+class PipelineTestCase(unittest.TestCase):
+  """Testing pipelined bulk requests against a real zmq REP server."""
+
+  DEMO_ADDRESS = 'tcp://127.0.0.1:7891'
+  REQUEST_COUNT = 5
+
+  def zmq_demo_server(self):
+    """Reply to a few config requests, echoing their key."""
+    context = zmq.Context()
+    server_socket = context.socket(zmq.REP)
+    server_socket.bind(self.DEMO_ADDRESS)
+    for _ in range(self.REQUEST_COUNT):
+      message = json.loads(server_socket.recv())
+      if message['key'] == 'missing-key':
+        server_socket.send(json.dumps({'code': 404}))
+      else:
+        server_socket.send(json.dumps({
+          'code': 200,
+          'data': {'key': message['key'], 'value': message['value']},
+          'dirty': 0,
+        }))
+
+  def setUp(self):
+    self.demo_server_process = Process(target=self.zmq_demo_server)
+    self.demo_server_process.start()
+    self.component = BaseComponent(socket_timeout=1, pipeline_window=2)
+    self.component.address = self.DEMO_ADDRESS
+
+  def tearDown(self):
+    self.demo_server_process.terminate()
+    self.demo_server_process.join()
+
+  def test_read_configs(self):
+    """Replies are matched to their keys and errors are collected."""
+    keys = ['a', 'b', 'missing-key', 'c', 'd']
+    results, errors = self.component.read_configs(keys)
+    self.assertEqual(['a', 'b', 'c', 'd'], sorted(results))
+    self.assertEqual('c', results['c'].data['key'])
+    self.assertEqual(['missing-key'], errors.keys())
+    self.assertTrue(isinstance(errors['missing-key'], InvalidRequestError))
+
+  def test_timeout(self):
+    """Requests left unanswered fail with a TimeoutError."""
+    self.component.socket_timeout = 0.5
+    keys = ['k%d' % i for i in range(self.REQUEST_COUNT + 2)]
+    results, errors = self.component.update_configs(
+      dict((key, 1) for key in keys))
+    self.assertEqual(self.REQUEST_COUNT, len(results))
+    self.assertEqual(2, len(errors))
+    for error in errors.values():
+      self.assertTrue(isinstance(error, TimeoutError))
+    self.assertEqual(None, self.component.pipeline_socket)
+
+
+class ApplyConfigTestCase(unittest.TestCase):
+  """Testing BaseComponent.apply_config with a mocked pipeline socket."""
+
+  def setUp(self):
+    self.component = BaseComponent()
+    self.component.pipeline_socket = mock.Mock()
+    self.sent = []
+    self.component.pipeline_socket.send_multipart.side_effect = (
+      lambda frames: self.sent.append(json.loads(frames[1])))
+    self.replies = []
+    self.component.pipeline_socket.recv_multipart.side_effect = (
+      lambda: ['', json.dumps(self.replies.pop(0))])
+
+  def test_in_sync(self):
+    """Nothing is updated when every value already matches."""
+    desired = {'GSM.Radio.C0': 51, 'Control.NumSQLTries': '3'}
+    self.replies = [{'code': 200, 'data': {'value': str(desired[key])}}
+                    for key in desired]
+    report = self.component.apply_config(desired)
+    self.assertEqual(['Control.NumSQLTries', 'GSM.Radio.C0'],
+                     report['unchanged'])
+    self.assertEqual(['read', 'read'], [m['action'] for m in self.sent])
+
+  def test_only_differences_are_sent(self):
+    """Differing keys are updated and sorted into live and dirty changes."""
+    desired = {'a': 1, 'b': 2, 'c': 3, 'missing': 4}
+    keys = list(desired)
+    current = {'a': '1', 'b': '0', 'c': '0'}
+    self.replies = [
+      {'code': 200, 'data': {'value': current[key]}} if key in current
+      else {'code': 404} for key in keys]
+    changed = [key for key in keys if key in ('b', 'c')]
+    self.replies.extend(
+      {'code': 204, 'dirty': key == 'c'} for key in changed)
+    report = self.component.apply_config(desired)
+    updates = [m for m in self.sent if m['action'] == 'update']
+    self.assertEqual(set(['b', 'c']), set(m['key'] for m in updates))
+    self.assertEqual(['a'], report['unchanged'])
+    self.assertEqual(['b'], report['live'])
+    self.assertEqual(['c'], report['dirty'])
+    self.assertEqual(['missing'], report['errors'].keys())
+
+
+class FailoverTestCase(unittest.TestCase):
+  """Testing endpoint failover and read balancing with mocked sockets."""
+
+  def setUp(self):
+    self.component = BaseComponent(socket_timeout=0.1)
+    self.component.connect(['tcp://127.0.0.1:7895', 'tcp://127.0.0.1:7896'])
+    self.primary, self.standby = self.component.endpoints
+    for endpoint in self.component.endpoints:
+      endpoint.socket.close()
+      endpoint.socket = mock.Mock()
+      endpoint.socket.recv.return_value = json.dumps({
+        'code': 200, 'data': endpoint.address})
+
+  def test_primary_attributes(self):
+    """self.socket and self.address belong to the primary endpoint."""
+    self.assertTrue(self.component.socket is self.primary.socket)
+    self.assertEqual('tcp://127.0.0.1:7895', self.component.address)
+
+  def test_reads_are_balanced(self):
+    """Reads rotate over the endpoints while writes go to the primary."""
+    reads = [self.component.read_config('k').data for _ in range(4)]
+    self.assertEqual([self.primary.address, self.standby.address] * 2, reads)
+    for _ in range(2):
+      response = self.component.update_config('k', 'v')
+      self.assertEqual(self.primary.address, response.data)
+
+  def test_failover(self):
+    """A timed-out read is retried on the next endpoint."""
+    self.primary.socket.poll.return_value = 0
+    response = self.component.read_config('k')
+    self.assertEqual(self.standby.address, response.data)
+    health = self.component.health()
+    self.assertEqual([False, True], [e['healthy'] for e in health])
+    self.assertEqual([1, 0], [e['timeouts'] for e in health])
+    # The unhealthy primary is skipped until retry_interval has passed.
+    self.assertEqual(self.standby.address,
+                     self.component.update_config('k', 'v').data)
+    self.component.retry_interval = 0
+    self.primary.socket = mock.Mock()
+    self.primary.socket.recv.return_value = json.dumps({'code': 204})
+    self.component.update_config('k', 'v')
+    self.assertTrue(self.primary.healthy)
+
+  def test_writes_do_not_fail_over(self):
+    """A timed-out write may have been applied, so it is not resent."""
+    self.primary.socket.poll.return_value = 0
+    with self.assertRaises(TimeoutError):
+      self.component.update_config('k', 'v')
+    self.assertFalse(self.standby.socket.send.called)
+    self.assertFalse(self.primary.healthy)
+    # Later writes go to the standby.
+    self.assertEqual(self.standby.address,
+                     self.component.update_config('k', 'v').data)
+
+  def test_deadline_does_not_penalise(self):
+    """Running out of a deadline does not mark the endpoint unhealthy."""
+    def poll(timeout):
+      """Waits out the deadline."""
+      time.sleep(timeout / 1000.0)
+      return 0
+    self.primary.socket.poll.side_effect = poll
+    with self.component.deadline(0.01):
+      with self.assertRaises(TimeoutError) as context:
+        self.component.read_config('k')
+    self.assertEqual('deadline exceeded', str(context.exception))
+    self.assertFalse(self.standby.socket.send.called)
+    self.assertEqual([True, True],
+                     [e['healthy'] for e in self.component.health()])
+    self.assertEqual([0, 0], [e['timeouts'] for e in self.component.health()])
+
+  def test_shortened_poll_does_not_penalise(self):
+    """A poll cut short by the deadline is not held against the endpoint.
+
+    Polls may return a little early, before the deadline has passed.
+    """
+    def poll(timeout):
+      """Returns before the shortened timeout is up."""
+      time.sleep(timeout / 2000.0)
+      return 0
+    self.primary.socket.poll.side_effect = poll
+    with self.component.deadline(0.05):
+      with self.assertRaises(TimeoutError) as context:
+        self.component.read_config('k')
+    self.assertEqual('deadline exceeded', str(context.exception))
+    self.assertFalse(self.standby.socket.send.called)
+    self.assertEqual([0, 0], [e['timeouts'] for e in self.component.health()])
+
+  def test_pipeline_deadline_does_not_penalise(self):
+    """Pipelined requests cut short by a deadline fail on their own."""
+    self.component.pipeline_socket = mock.Mock()
+    self.component.pipeline_endpoint = self.primary
+    with self.component.deadline(-1):
+      results = self.component.read_configs(['a', 'b'])[1]
+    self.assertEqual(['deadline exceeded'] * 2,
+                     [str(results[key]) for key in ('a', 'b')])
+    self.assertEqual(None, self.component.pipeline_socket)
+    self.assertTrue(self.primary.healthy)
+    self.assertEqual(0, self.primary.timeouts)
+
+  def test_pipeline_endpoint_selection(self):
+    """Pipelined reads rotate like other reads and replies mark health."""
+    sockets = {}
+
+    def setup_pipeline_socket(endpoint):
+      """Connects a mocked DEALER socket to an endpoint."""
+      socket = sockets[endpoint.address] = mock.Mock()
+      socket.recv_multipart.return_value = [
+        '', json.dumps({'code': 200, 'data': endpoint.address})]
+      self.component.pipeline_socket = socket
+      self.component.pipeline_endpoint = endpoint
+    self.component.setup_pipeline_socket = setup_pipeline_socket
+    self.primary.healthy = False
+    self.primary.last_failure = 0
+    addresses = []
+    for _ in range(2):
+      responses = self.component.read_configs(['a'], use_cache=False)[0]
+      addresses.append(responses['a'].data)
+    self.assertEqual([self.primary.address, self.standby.address], addresses)
+    self.assertTrue(sockets[self.primary.address].close.called)
+    self.assertTrue(self.primary.healthy)
+    self.assertEqual([1, 1], [e['requests'] for e in self.component.health()])
+    # Writes go to the primary.
+    responses = self.component.update_configs({'a': 1})[0]
+    self.assertEqual(self.primary.address, responses['a'].data)
+
+  def test_every_endpoint_times_out(self):
+    for endpoint in self.component.endpoints:
+      endpoint.socket.poll.return_value = 0
+    with self.assertRaises(TimeoutError):
+      self.component.get_version()
+    self.assertEqual([False, False],
+                     [e['healthy'] for e in self.component.health()])
+
+
+class AdaptiveTimeoutTestCase(unittest.TestCase):
+  """Testing adaptive timeouts and deadlines with a mocked socket."""
+
+  def setUp(self):
+    self.component = BaseComponent(adaptive_timeout=True, min_timeout=0.01,
+                                   timeout_factor=2)
+    self.component.address = 'tcp://127.0.0.1:7897'
+    self.component.socket = mock.Mock()
+    self.component.socket.recv.return_value = json.dumps({'code': 200})
+
+  def test_timeout_follows_latency(self):
+    """The timeout is derived from the p99 latency once enough are seen."""
+    self.assertEqual(10, self.component.timeout_for('version',
+                                                    self.component.address))
+    for _ in range(MIN_LATENCY_SAMPLES):
+      self.component.get_version()
+    timeout = self.component.timeout_for('version', self.component.address)
+    self.assertTrue(0.01 <= timeout < 1)
+    # Other commands and endpoints are tracked separately.
+    self.assertEqual(10, self.component.timeout_for('config',
+                                                    self.component.address))
+    latencies = self.component.latencies[('version', self.component.address)]
+    latencies.append(30)
+    self.assertEqual(10, self.component.timeout_for('version',
+                                                    self.component.address))
+
+  def test_deadline(self):
+    """Requests in a deadline block share its budget."""
+    with self.component.deadline(1):
+      timeout = self.component.timeout_for('version', None)
+      self.assertTrue(0.9 < timeout <= 1)
+      with self.component.deadline(5):
+        self.assertTrue(self.component.timeout_for('version', None) <= 1)
+    self.assertEqual(10, self.component.timeout_for('version', None))
+    with self.component.deadline(-1):
+      with self.assertRaises(TimeoutError):
+        self.component.get_version()
+    self.assertFalse(self.component.socket.send.called)
+
+
+class HeartbeatTestCase(unittest.TestCase):
+  """Testing liveness detection against a real zmq REP server."""
+
+  DEMO_ADDRESS = 'tcp://127.0.0.1:7898'
+
+  def zmq_demo_server(self):
+    """Answer requests until terminated."""
+    context = zmq.Context()
+    server_socket = context.socket(zmq.REP)
+    server_socket.bind(self.DEMO_ADDRESS)
+    while True:
+      server_socket.recv()
+      server_socket.send(json.dumps({'code': 200, 'data': 'testing'}))
+
+  def setUp(self):
+    self.demo_server_process = Process(target=self.zmq_demo_server)
+    self.demo_server_process.start()
+    self.component = BaseComponent(socket_timeout=5, heartbeat_interval=0.1)
+    self.component.connect(self.DEMO_ADDRESS)
+
+  def tearDown(self):
+    self.demo_server_process.terminate()
+    self.demo_server_process.join()
+
+  def wait_for(self, alive):
+    """Waits up to two seconds for the monitor to report a peer state."""
+    for _ in range(200):
+      if self.component.is_alive() is alive:
+        if self.component.endpoints[0].alive is alive:
+          return
+      time.sleep(0.01)
+    self.fail('is_alive never became %s' % alive)
+
+  def test_dead_peer_fails_fast(self):
+    """Requests fail at once once the peer is known to be gone."""
+    self.wait_for(True)
+    self.assertEqual('testing', self.component.get_version().data)
+    self.demo_server_process.terminate()
+    self.demo_server_process.join()
+    self.wait_for(False)
+    start = time.time()
+    with self.assertRaises(TimeoutError):
+      self.component.get_version()
+    self.assertTrue(time.time() - start < 1)
+    # Bulk operations report the failure per key rather than raising.
+    errors = self.component.read_configs(['a', 'b'])[1]
+    self.assertEqual(['a', 'b'], sorted(errors))
+    for error in errors.values():
+      self.assertTrue(isinstance(error, TimeoutError))
+
+
+class CoalesceTestCase(unittest.TestCase):
+  """Testing the coalescing of identical concurrent reads."""
+
+  def setUp(self):
+    self.component = BaseComponent()
+    self.component.address = 'tcp://127.0.0.1:7899'
+    self.component.socket = mock.Mock()
+
+    def slow_recv():
+      time.sleep(0.1)
+      return json.dumps({'code': 200, 'data': {'value': '51'}})
+    self.component.socket.recv.side_effect = slow_recv
+
+  def run_threads(self, func, count=5):
+    """Runs a function in several threads at once, collecting errors."""
+    errors = []
+
+    def target():
+      try:
+        func()
+      except Exception as e:  # pylint: disable=broad-except
+        errors.append(e)
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return errors
+
+  def test_identical_reads_are_coalesced(self):
+    errors = self.run_threads(
+      lambda: self.component.read_config('GSM.Radio.C0'))
+    self.assertEqual([], errors)
+    self.assertEqual(1, self.component.socket.send.call_count)
+    self.assertEqual(4, self.component.coalesced)
+    self.assertEqual({}, self.component.flights)
+
+  def test_writes_are_not_coalesced(self):
+    self.run_threads(lambda: self.component.update_config('GSM.Radio.C0', 51),
+                     count=3)
+    self.assertEqual(3, self.component.socket.send.call_count)
+    self.assertEqual(0, self.component.coalesced)
+
+  def test_errors_are_shared(self):
+    """A failed read fails every caller that shared it."""
+    self.component.socket.poll.side_effect = lambda timeout: time.sleep(0.1)
+    with mock.patch.object(self.component, '_reset_endpoint'):
+      errors = self.run_threads(self.component.get_version, count=3)
+    self.assertEqual(1, self.component.socket.send.call_count)
+    self.assertEqual(3, len(errors))
+    self.assertTrue(all(isinstance(e, TimeoutError) for e in errors))
+
+  def test_deadlines_are_not_shared(self):
+    """A caller without a deadline retries a read whose sender gave up."""
+    # Polls only succeed when they may wait the full 0.1 seconds.
+    self.component.socket.poll.side_effect = lambda timeout: (
+      time.sleep(min(timeout, 100) / 1000.0) or timeout >= 100)
+    self.component.socket.recv.side_effect = None
+    self.component.socket.recv.return_value = json.dumps({
+      'code': 200, 'data': {'value': '51'}})
+    results = []
+
+    def leader():
+      with self.component.deadline(0.05):
+        self.component.read_config('GSM.Radio.C0')
+
+    def follower():
+      time.sleep(0.01)
+      results.append(self.component.read_config('GSM.Radio.C0'))
+    threads = [threading.Thread(target=follower)]
+    with mock.patch.object(self.component, '_replace_socket'):
+      threads[0].start()
+      with self.assertRaises(TimeoutError):
+        leader()
+      threads[0].join()
+    self.assertEqual('51', results[0].data['value'])
+    self.assertEqual(2, self.component.socket.send.call_count)
+    self.assertEqual({}, self.component.flights)
@@ -0,0 +1,142 @@
+"""openbts.tests.cli_tests
+tests for the OpenBTSCLI output parsers
+"""
+
+import unittest
+
+from openbts import cli
+
+
+def read_fixture(name):
+  """Reads a recorded CLI output."""
+  with open('openbts/tests/fixtures/%s.txt' % name) as output:
+    return output.read()
+
+
+class LoadParserTest(unittest.TestCase):
+  """Parsing the output of 'load'."""
+
+  def test_all_fields(self):
+    """Every labelled value is returned."""
+    expected = {
+      'sdcch_load': 2,
+      'sdcch_available': 4,
+      'tchf_load': 1,
+      'tchf_available': 3,
+      'pch_active': 3,
+      'pch_total': 7,
+      'agch_active': 5,
+      'agch_pending': 9,
+      'gprs_current_pdchs': 4,
+      'gprs_utilization': 41.0,
+    }
+    self.assertEqual(expected, cli.parse_load(read_fixture('load')))
+
+  def test_scientific_notation(self):
+    """Utilization in scientific notation is parsed as a float."""
+    result = cli.parse_load(read_fixture('load_low_gprs'))
+    self.assertAlmostEqual(5.0933e-07, result['gprs_utilization'])
+
+  def test_reordered_and_new_lines(self):
+    """Values are found by label, not position."""
+    text = '\n'.join([
+      '== GPRS ==',
+      'utilization: 12%',
+      'current PDCHs: 2',
+      '== GSM ==',
+      'TCH/H load/available: 0/6',
+      'TCH/F load/available: 1/3',
+    ])
+    result = cli.parse_load(text)
+    self.assertEqual(12.0, result['gprs_utilization'])
+    self.assertEqual(2, result['gprs_current_pdchs'])
+    self.assertEqual(6, result['tchh_available'])
+    self.assertEqual(1, result['tchf_load'])
+
+  def test_values_with_colons(self):
+    """Only the first colon of a line ends its label."""
+    result = cli.parse_key_values('foo: 12:30\nbar baz: 1:2, 3')
+    self.assertEqual('12:30', result['foo'])
+    self.assertEqual('1:2, 3', result['bar_baz'])
+
+
+class NoiseParserTest(unittest.TestCase):
+  """Parsing the output of 'noise'."""
+
+  def test_all_fields(self):
+    """The noise levels and the status line are returned."""
+    expected = {
+      'noise_rssi_db': -72,
+      'ms_rssi_target_db': -55,
+      'info': 'the current noise level is acceptable.',
+    }
+    self.assertEqual(expected, cli.parse_noise(read_fixture('noise')))
+
+  def test_warning(self):
+    """Status lines are keyed by their level."""
+    text = ('noise RSSI is -40 dB wrt full scale\n'
+            'WARNING: the current noise level is too high.\n')
+    result = cli.parse_noise(text)
+    self.assertEqual(-40, result['noise_rssi_db'])
+    self.assertEqual('the current noise level is too high.', result['warning'])
+
+
+class GPRSListParserTest(unittest.TestCase):
+  """Parsing the output of 'gprs list'."""
+
+  def test_ms_records(self):
+    """MS records carry their byte counts, GMM context and radio stats."""
+    result = cli.parse_gprs_list(read_fixture('gprs_list'))
+    self.assertEqual(4, len(result['ms']))
+    ms = result['ms'][0]
+    self.assertEqual(1, ms['ms'])
+    self.assertEqual('PacketIdle', ms['rrmode'])
+    self.assertEqual(53495, ms['uploaded_bytes'])
+    self.assertEqual(139441, ms['downloaded_bytes'])
+    self.assertEqual('901550000000022', ms['gmm']['imsi'])
+    self.assertEqual('192.168.99.4', ms['gmm']['ips'])
+    self.assertEqual('0xc001f001', ms['gmm']['tlli'])
+    self.assertEqual('c001f001,78428eca', ms['tlli'])
+    self.assertEqual(-12, ms['rssi']['value'])
+    self.assertEqual(4550, ms['rssi']['n'])
+    self.assertEqual({'percentage': 0.2, 'count': 5928,
+                      'recent': {'percentage': 0.0, 'count': 0}},
+                     ms['data_er'])
+
+  def test_pdch_records(self):
+    """PDCH lines are returned separately."""
+    result = cli.parse_gprs_list(read_fixture('gprs_list'))
+    self.assertEqual([{'arfcn': 51, 'tn': 1, 'fer': 21},
+                      {'arfcn': 51, 'tn': 2, 'fer': 22}], result['pdchs'])
+
+  def test_tbf_records(self):
+    """TBF records do not start new MS records."""
+    result = cli.parse_gprs_list(read_fixture('gprs_list_duplicate_imsis'))
+    self.assertEqual([1, 2, 3, 5, 7], [ms['ms'] for ms in result['ms']])
+    self.assertEqual(6, len(result['tbfs']))
+    tbf = result['tbfs'][0]
+    self.assertEqual(853, tbf['tbf'])
+    self.assertEqual(1, tbf['ms'])
+    self.assertEqual('Up', tbf['mt_dir'])
+    self.assertEqual('DataTransmit', tbf['mt_state'])
+    self.assertEqual(['1:2,usf=3'], tbf['channels']['up'])
+    self.assertEqual(9, len(result['pdchs']))
+
+  def test_empty_output(self):
+    """Output without records parses to empty lists."""
+    self.assertEqual({'ms': [], 'tbfs': [], 'pdchs': []},
+                     cli.parse_gprs_list('\n'))
+
+
+class ParseTest(unittest.TestCase):
+  """Dispatching to the parsers by command."""
+
+  def test_known_command(self):
+    self.assertEqual(cli.parse_noise(read_fixture('noise')),
+                     cli.parse('noise', read_fixture('noise')))
+
+  def test_unknown_command(self):
+    """Other commands fall back to the generic label parser."""
+    text = 'Uptime: 3600\nARFCN/BSIC: 51/3\n'
+    self.assertEqual({'uptime': 3600, 'arfcn': 51, 'bsic': 3},
+                     cli.parse('uptime', text))
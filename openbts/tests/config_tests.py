@@ -0,0 +1,150 @@
+"""openbts.tests.config_tests
+tests for the client-side config helpers
+"""
+
+import json
+import unittest
+
+import mock
+
+from openbts.components import SMQueue
+from openbts.config import ConfigCache, ConfigWatcher
+from openbts.exceptions import TimeoutError
+
+
+class ConfigCacheTest(unittest.TestCase):
+  """Testing the config.ConfigCache class."""
+
+  def setUp(self):
+    self.cache = ConfigCache(ttl=10)
+    self.cache.store('Bounce.Code', {
+      'key': 'Bounce.Code',
+      'value': '101',
+      'defaultValue': '101',
+      'description': 'bounce code',
+    }, now=100)
+
+  def test_fresh_value_is_served(self):
+    data = self.cache.get('Bounce.Code', now=105)
+    self.assertEqual('101', data['value'])
+    self.assertEqual('bounce code', data['description'])
+    self.assertEqual(1, self.cache.hits)
+
+  def test_stale_value_is_refreshed(self):
+    """Refreshing a stale entry replaces only its value."""
+    self.assertEqual(None, self.cache.get('Bounce.Code', now=110))
+    self.assertEqual(1, self.cache.refreshes)
+    metadata = self.cache.entries['Bounce.Code'][0]
+    self.cache.store('Bounce.Code', {'key': 'Bounce.Code', 'value': '102'},
+                     now=110)
+    self.assertTrue(metadata is self.cache.entries['Bounce.Code'][0])
+    data = self.cache.get('Bounce.Code', now=111)
+    self.assertEqual('102', data['value'])
+    self.assertEqual('bounce code', data['description'])
+
+  def test_invalidate(self):
+    self.cache.invalidate('Bounce.Code')
+    self.assertEqual(None, self.cache.get('Bounce.Code', now=101))
+    self.assertEqual(1, self.cache.invalidations)
+
+  def test_stats(self):
+    self.cache.get('Bounce.Code', now=101)
+    self.cache.get('Unknown.Key', now=101)
+    stats = self.cache.stats()
+    self.assertEqual(1, stats['hits'])
+    self.assertEqual(1, stats['misses'])
+    self.assertEqual(0.5, stats['hit_rate'])
+
+
+class ComponentConfigCacheTest(unittest.TestCase):
+  """Testing config caching through a component."""
+
+  def setUp(self):
+    self.smqueue_connection = SMQueue(config_cache_ttl=60)
+    self.smqueue_connection.socket = mock.Mock()
+    self.smqueue_connection.socket.recv.return_value = json.dumps({
+      'code': 200,
+      'data': {'key': 'Bounce.Code', 'value': '101', 'defaultValue': '101'},
+    })
+
+  def test_reads_are_cached(self):
+    """Repeated reads are served without a request."""
+    self.smqueue_connection.read_config('Bounce.Code')
+    response = self.smqueue_connection.read_config('Bounce.Code')
+    self.assertEqual('101', response.data['value'])
+    self.assertEqual(1, self.smqueue_connection.socket.send.call_count)
+    self.assertEqual(1, self.smqueue_connection.config_cache.hits)
+
+  def test_updates_invalidate(self):
+    """Updating a key makes the next read go to NodeManager."""
+    self.smqueue_connection.read_config('Bounce.Code')
+    self.smqueue_connection.update_config('Bounce.Code', 102)
+    self.smqueue_connection.read_config('Bounce.Code')
+    self.assertEqual(3, self.smqueue_connection.socket.send.call_count)
+
+  def test_reads_during_an_update_are_dropped(self):
+    """A value cached while an update is in flight is not served after it."""
+    cache = self.smqueue_connection.config_cache
+    def send(payload):
+      """Caches the old value as a concurrent read would."""
+      if json.loads(payload)['action'] == 'update':
+        cache.store('Bounce.Code', {'key': 'Bounce.Code', 'value': '101'})
+    self.smqueue_connection.socket.send.side_effect = send
+    self.smqueue_connection.update_config('Bounce.Code', 102)
+    self.assertEqual(None, cache.get('Bounce.Code'))
+
+  def test_bypass(self):
+    self.smqueue_connection.read_config('Bounce.Code')
+    self.smqueue_connection.read_config('Bounce.Code', use_cache=False)
+    self.assertEqual(2, self.smqueue_connection.socket.send.call_count)
+
+
+class ConfigWatcherTest(unittest.TestCase):
+  """Testing the config.ConfigWatcher class."""
+
+  def setUp(self):
+    self.component = mock.Mock()
+    self.snapshot = {
+      'Control.NumSQLTries': {'value': '3'},
+      'GSM.Radio.C0': {'value': '51'},
+      'Log.Level': {'value': 'NOTICE'},
+    }
+    self.component.config_snapshot.side_effect = (
+      lambda: dict((k, dict(v)) for k, v in self.snapshot.items()))
+    self.seen = []
+    self.watcher = ConfigWatcher(
+      self.component, ['Control.*', 'GSM.*'],
+      lambda component, *change: self.seen.append(change),
+      min_interval=10, max_interval=40)
+
+  def test_changes_are_reported(self):
+    """Only changes to matching keys are reported, after the first poll."""
+    self.assertEqual([], self.watcher.poll())
+    self.snapshot['GSM.Radio.C0']['value'] = '52'
+    self.snapshot['Log.Level']['value'] = 'DEBUG'
+    self.snapshot['GSM.Radio.Band'] = {'value': '900'}
+    self.watcher.poll()
+    self.assertEqual([('GSM.Radio.Band', None, '900'),
+                      ('GSM.Radio.C0', '51', '52')], self.seen)
+    self.assertEqual(2, self.component.config_snapshot.call_count)
+
+  def test_adaptive_interval(self):
+    """The interval backs off while quiet and resets after a change."""
+    self.watcher.poll()
+    self.watcher.poll()
+    self.assertEqual(40, self.watcher.interval)
+    self.snapshot['Control.NumSQLTries']['value'] = '4'
+    self.watcher.poll()
+    self.assertEqual(10, self.watcher.interval)
+
+  def test_errors_are_counted(self):
+    self.component.config_snapshot.side_effect = TimeoutError
+    self.assertEqual([], self.watcher.poll())
+    self.assertEqual(1, self.watcher.errors)
+
+  def test_watch_config(self):
+    """Components create watchers for themselves."""
+    smqueue_connection = SMQueue()
+    watcher = smqueue_connection.watch_config('Bounce.*', self.seen.append)
+    self.assertTrue(watcher.component is smqueue_connection)
+    self.assertEqual(['Bounce.*'], watcher.patterns)
@@ -0,0 +1,137 @@
+"""openbts.tests.export_tests
+tests for streaming registry exports
+"""
+
+import csv
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import openbts.components
+from openbts.components import SIPAuthServe
+from openbts.exceptions import InvalidResponseError
+from openbts.export import JSONLinesWriter, export_subscribers
+
+
+class ExportTestCase(unittest.TestCase):
+  """Testing export.export_subscribers with mocked sockets."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.sipauthserve_connection = SIPAuthServe()
+    self.sipauthserve_connection.socket = mock.Mock()
+    self.replies = {
+      'sip_buddies': json.dumps({'code': 200, 'data': [{
+        'name': 'IMSI00101000000000%d' % index,
+        'ipaddr': '127.0.0.1',
+        'port': '5062',
+        'callerid': '555000%d' % index,
+        'account_balance': str(index * 100),
+      } for index in range(3)]}),
+      'dialdata_table': json.dumps({'code': 200, 'data': [
+        {'dial': 'IMSI00101000000000%d' % index, 'exten': '555000%d' % index}
+        for index in range(3)
+      ] + [{'dial': 'IMSI001010000000001', 'exten': '5559999'}]}),
+    }
+    self.sent = []
+
+    def reply():
+      """Answers the last request with the table it reads."""
+      message = json.loads(
+        self.sipauthserve_connection.socket.send.call_args[0][0])
+      self.sent.append(message)
+      return self.replies[message['command']]
+
+    self.sipauthserve_connection.socket.recv.side_effect = reply
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_jsonl(self):
+    path = os.path.join(self.directory, 'registry.jsonl')
+    stats = export_subscribers(self.sipauthserve_connection, path)
+    self.assertEqual(3, stats['rows'])
+    self.assertEqual(os.path.getsize(path), stats['bytes'])
+    with open(path) as export_file:
+      rows = [json.loads(line) for line in export_file]
+    self.assertEqual({
+      'name': 'IMSI001010000000001',
+      'openbts_ipaddr': '127.0.0.1',
+      'openbts_port': '5062',
+      'numbers': ['5550001', '5559999'],
+      'account_balance': '100',
+      'caller_id': '5550001',
+    }, rows[1])
+    # One read per table, each of the whole table.
+    self.assertEqual(['sip_buddies', 'dialdata_table'],
+                     [message['command'] for message in self.sent])
+    self.assertEqual([{}, {}], [message['match'] for message in self.sent])
+
+  def test_rows_are_streamed(self):
+    """Subscribers are written before the sip_buddies reply is decoded."""
+    path = os.path.join(self.directory, 'registry.jsonl')
+    events = []
+    decode = openbts.components.iter_data
+
+    def iter_data(raw_response_data):
+      """Logs each sip_buddies row as it is decoded."""
+      for row in decode(raw_response_data):
+        if 'name' in row:
+          events.append('decode')
+        yield row
+
+    write = JSONLinesWriter.write
+
+    def log_write(writer, subscriber):
+      """Logs each written subscriber."""
+      events.append('write')
+      write(writer, subscriber)
+
+    with mock.patch('openbts.components.iter_data', iter_data), \
+        mock.patch.object(JSONLinesWriter, 'write', log_write):
+      export_subscribers(self.sipauthserve_connection, path, batch_size=1)
+    self.assertEqual(['decode', 'write'] * 3, events)
+
+  def test_gzipped_csv(self):
+    path = os.path.join(self.directory, 'registry.csv.gz')
+    export_subscribers(self.sipauthserve_connection, path,
+                       fields=['name', 'numbers'])
+    rows = list(csv.reader(gzip.open(path)))
+    self.assertEqual(['name', 'numbers'], rows[0])
+    self.assertEqual(['IMSI001010000000001', '5550001;5559999'], rows[2])
+    self.assertEqual(4, len(rows))
+
+  def test_columns(self):
+    path = os.path.join(self.directory, 'registry.columns')
+    export_subscribers(self.sipauthserve_connection, path,
+                       fields=['name', 'account_balance'], row_group_size=2)
+    with open(path) as export_file:
+      groups = [json.loads(line) for line in export_file]
+    self.assertEqual([2, 1], [group['rows'] for group in groups])
+    self.assertEqual(['0', '100'], groups[0]['columns']['account_balance'])
+    # Numbers are not read when they are not exported.
+    self.assertEqual(['sip_buddies'],
+                     [message['command'] for message in self.sent])
+    self.assertEqual(['name', 'account_balance'], self.sent[0]['fields'])
+
+  def test_failed_export_leaves_no_file(self):
+    path = os.path.join(self.directory, 'registry.jsonl')
+    self.replies['sip_buddies'] = '{}'
+    with self.assertRaises(InvalidResponseError):
+      export_subscribers(self.sipauthserve_connection, path)
+    self.assertEqual([], os.listdir(self.directory))
+
+  def test_unknown_format_or_field(self):
+    with self.assertRaises(ValueError):
+      export_subscribers(self.sipauthserve_connection,
+                         os.path.join(self.directory, 'registry.xml'))
+    with self.assertRaises(ValueError):
+      export_subscribers(self.sipauthserve_connection,
+                         os.path.join(self.directory, 'registry.jsonl'),
+                         fields=['ki'])
+    self.assertEqual([], os.listdir(self.directory))
@@ -0,0 +1,209 @@
+"""openbts.tests.fleet_tests
+tests for concurrent requests to many nodes
+"""
+
+import json
+from multiprocessing import Process
+import time
+import unittest
+
+import zmq
+
+from openbts.codes import SuccessCode
+from openbts.core import Response
+from openbts.exceptions import InvalidRequestError, TimeoutError
+from openbts.fleet import (Fleet, FleetMonitor, MonitorTable, NodeResult,
+                           node_address)
+
+
+def zmq_node(address, delay, replies):
+  """Answers a few requests after a delay, echoing their command."""
+  context = zmq.Context()
+  server_socket = context.socket(zmq.REP)
+  server_socket.bind(address)
+  for _ in range(replies):
+    message = json.loads(server_socket.recv())
+    time.sleep(delay)
+    if message['key'] == 'missing-key':
+      server_socket.send(json.dumps({'code': 404}))
+    else:
+      server_socket.send(json.dumps({
+        'code': 200,
+        'data': {'command': message['command'], 'key': message['key']},
+      }))
+
+
+class FleetTestCase(unittest.TestCase):
+  """Testing the fleet.Fleet class against real zmq REP servers."""
+
+  SLOW = 'tcp://127.0.0.1:7892'
+  FAST = 'tcp://127.0.0.1:7893'
+  # Nothing listens here, so requests to it time out.
+  DEAD = 'tcp://127.0.0.1:7894'
+
+  def setUp(self):
+    self.servers = [
+      Process(target=zmq_node, args=(self.SLOW, 0.3, 2)),
+      Process(target=zmq_node, args=(self.FAST, 0, 2)),
+    ]
+    for server in self.servers:
+      server.start()
+    self.fleet = Fleet([self.SLOW, self.FAST, self.DEAD], timeout=1)
+
+  def tearDown(self):
+    self.fleet.close()
+    for server in self.servers:
+      server.terminate()
+      server.join()
+
+  def test_results_stream_as_they_arrive(self):
+    """Fast nodes are reported first and dead nodes time out."""
+    results = list(self.fleet.get_version())
+    self.assertEqual([self.FAST, self.SLOW, self.DEAD],
+                     [result.address for result in results])
+    self.assertEqual('version', results[0].response.data['command'])
+    self.assertTrue(isinstance(results[2].error, TimeoutError))
+    self.assertFalse(self.DEAD in self.fleet.sockets)
+
+  def test_requests_are_pipelined_per_node(self):
+    """Several messages to a node are answered in order."""
+    messages = [{'command': 'config', 'action': 'read', 'key': key,
+                 'value': ''} for key in ('a', 'missing-key')]
+    results = list(self.fleet.iter_requests([(self.FAST, messages)]))
+    self.assertEqual('a', results[0].results[0].data['key'])
+    self.assertTrue(isinstance(results[0].error, InvalidRequestError))
+    self.assertFalse(results[0].ok)
+
+  def test_concurrency_cap(self):
+    """Nodes wait for a slot when max_in_flight nodes are busy."""
+    self.fleet.max_in_flight = 1
+    results = self.fleet.request({'command': 'monitor', 'action': '',
+                                  'key': '', 'value': ''},
+                                 addresses=[self.SLOW, self.FAST])
+    self.assertTrue(results[self.SLOW].ok)
+    self.assertTrue(results[self.FAST].ok)
+
+  def test_duplicate_addresses(self):
+    requests = [(self.FAST, []), (self.FAST, [])]
+    self.assertRaises(ValueError, list, self.fleet.iter_requests(requests))
+
+
+class RolloutTestCase(unittest.TestCase):
+  """Testing Fleet.rollout_config with canned node results."""
+
+  def setUp(self):
+    self.addresses = [node_address('10.0.0.%d' % i) for i in range(1, 8)]
+    self.fleet = Fleet(self.addresses)
+    # Nodes hold these values after the update, keyed by address.
+    self.stored = {}
+    self.broken = set()
+    self.waves = []
+    self.fleet.iter_requests = self.fake_requests
+
+  def fake_requests(self, requests):
+    """Answers updates and read-backs the way a node would."""
+    requests = list(requests)
+    self.waves.append([address for address, _ in requests])
+    for address, messages in requests:
+      results = []
+      for message in messages:
+        if address in self.broken:
+          results.append(TimeoutError('did not receive a response'))
+        elif message['action'] == 'update':
+          results.append(Response.from_data(
+            None, SuccessCode.NoContent, dirty=message['key'] == 'GSM.MCC'))
+        else:
+          value = self.stored.get(address, {}).get(message['key'], '0')
+          results.append(Response.from_data({'value': value}))
+      yield NodeResult(address, results, 0.01)
+
+  def test_rollout(self):
+    """Nodes are updated in waves and checked with a read-back."""
+    for address in self.addresses:
+      self.stored[address] = {'GSM.MCC': '001', 'Control.Tries': '3'}
+    self.stored[self.addresses[4]]['Control.Tries'] = '2'
+    report = self.fleet.rollout_config(
+      {'GSM.MCC': '001', 'Control.Tries': 3}, waves=(1, 2),
+      max_failure_rate=0.25)
+    self.assertEqual([1, 2, 2, 2], [len(wave) for wave in self.waves])
+    self.assertFalse(report['stopped'])
+    node = report['nodes'][self.addresses[0]]
+    self.assertEqual('ok', node['status'])
+    self.assertEqual(['GSM.MCC'], node['dirty'])
+    self.assertEqual('mismatch', report['nodes'][self.addresses[4]]['status'])
+    self.assertAlmostEqual(1 / 7.0, report['failure_rate'])
+
+  def test_rollout_stops_on_failures(self):
+    """Remaining nodes are skipped once too many nodes fail."""
+    self.broken.add(self.addresses[0])
+    report = self.fleet.rollout_config({'Control.Tries': 0}, waves=(1, 3))
+    self.assertTrue(report['stopped'])
+    self.assertEqual(1, report['waves'])
+    self.assertEqual('failed', report['nodes'][self.addresses[0]]['status'])
+    self.assertTrue(isinstance(
+      report['nodes'][self.addresses[0]]['errors']['Control.Tries'],
+      TimeoutError))
+    self.assertEqual(['skipped'] * 6, [report['nodes'][a]['status']
+                                       for a in self.addresses[1:]])
+
+
+class MonitorTableTestCase(unittest.TestCase):
+  """Testing the fleet.MonitorTable class."""
+
+  def setUp(self):
+    monitors = {
+      'a': {'noiseRSSI': -68, 'gsmTCHActive': 3, 'gsmTCHTotal': 6},
+      'b': {'noiseRSSI': -52, 'gsmTCHActive': 6, 'gsmTCHTotal': 6},
+      'c': {'noiseRSSI': -75, 'gsmTCHActive': 1, 'gsmTCHTotal': 0},
+      'd': {'gsmTCHActive': 0, 'gsmTCHTotal': 6, 'version': 'x'},
+    }
+    results = [NodeResult(address, [Response.from_data(data)])
+               for address, data in sorted(monitors.items())]
+    results.append(NodeResult('e', [TimeoutError()]))
+    self.table = MonitorTable(results)
+
+  def test_columns(self):
+    self.assertEqual(['a', 'b', 'c', 'd'], self.table.addresses)
+    self.assertEqual(['gsmTCHActive', 'gsmTCHTotal', 'noiseRSSI'],
+                     sorted(self.table.columns))
+    self.assertTrue(isinstance(self.table.errors['e'], TimeoutError))
+    self.assertEqual({'gsmTCHActive': 0, 'gsmTCHTotal': 6},
+                     self.table.row('d'))
+
+  def test_aggregates(self):
+    """Missing values are ignored."""
+    self.assertEqual(10, self.table.total('gsmTCHActive'))
+    self.assertEqual(-65, self.table.mean('noiseRSSI'))
+    self.assertEqual(None, self.table.mean('gprsPDCHActive'))
+    self.assertEqual([('b', -52), ('a', -68)],
+                     self.table.top('noiseRSSI', 2))
+    self.assertEqual([('c', -75)],
+                     self.table.top('noiseRSSI', 1, largest=False))
+
+  def test_threshold(self):
+    self.table.add_ratio('tchLoad', 'gsmTCHActive', 'gsmTCHTotal')
+    self.assertEqual([('b', 1.0)], self.table.over('tchLoad', 0.8))
+    self.assertEqual([('b', 1.0), ('a', 0.5), ('d', 0.0)],
+                     self.table.top('tchLoad'))
+
+  def test_fleet_monitor(self):
+    """Every node is queried at once by default."""
+    monitor = FleetMonitor(['a', 'b', 'c'], timeout=1)
+    self.assertEqual(3, monitor.fleet.max_in_flight)
+    monitor.fleet.monitor = lambda: iter([
+      NodeResult('a', [Response.from_data({'noiseRSSI': -60})])])
+    self.assertEqual(-60, monitor.refresh().total('noiseRSSI'))
+    self.assertTrue(monitor.table is not None)
+
+
+class NodeResultTestCase(unittest.TestCase):
+  """Testing the fleet.NodeResult class and helpers."""
+
+  def test_node_address(self):
+    self.assertEqual('tcp://10.0.0.1:45064',
+                     node_address('10.0.0.1', 'sipauthserve'))
+
+  def test_failed_result(self):
+    result = NodeResult('tcp://10.0.0.1:45060', [TimeoutError()])
+    self.assertEqual(None, result.response)
+    self.assertFalse(result.ok)
@@ -0,0 +1,144 @@
+"""openbts.tests.metrics_tests
+tests for the ring buffers and the metrics sampler
+"""
+
+import time
+import unittest
+
+import mock
+
+from openbts.exceptions import TimeoutError
+from openbts.metrics import MetricsSampler, RingBuffer
+
+
+class RingBufferTest(unittest.TestCase):
+  """Testing the metrics.RingBuffer class."""
+
+  def setUp(self):
+    self.buffer = RingBuffer(4)
+    for second, value in enumerate([5, 1, 3, 2, 4, 6]):
+      self.buffer.append(value, timestamp=100 + second)
+
+  def test_capacity(self):
+    """Old samples are overwritten once the buffer is full."""
+    self.assertEqual(4, len(self.buffer))
+    self.assertEqual(4, len(self.buffer.values))
+    self.assertEqual([(102, 3), (103, 2), (104, 4), (105, 6)],
+                     self.buffer.last())
+
+  def test_last_n(self):
+    """We can get the last few samples."""
+    self.assertEqual([(104, 4), (105, 6)], self.buffer.last(2))
+    self.assertEqual(4, len(self.buffer.last(10)))
+
+  def test_window_stats(self):
+    """Stats are computed over a window of time."""
+    expected = {'count': 3, 'min': 2, 'mean': 4, 'max': 6}
+    self.assertEqual(expected, self.buffer.stats(seconds=2, now=105))
+    self.assertEqual(None, self.buffer.stats(seconds=2, now=200))
+
+  def test_percentile(self):
+    """Percentiles interpolate between samples."""
+    self.assertEqual(2, self.buffer.percentile(0))
+    self.assertEqual(6, self.buffer.percentile(100))
+    self.assertEqual(3.5, self.buffer.percentile(50))
+    with self.assertRaises(ValueError):
+      self.buffer.percentile(101)
+
+  def test_downsample(self):
+    """Samples are averaged into buckets."""
+    self.assertEqual([(102, 2.5), (104, 5)], self.buffer.downsample(2))
+
+  def test_empty(self):
+    """An empty buffer has no stats."""
+    buffer = RingBuffer(2)
+    self.assertEqual([], buffer.last())
+    self.assertEqual(None, buffer.stats())
+    self.assertEqual(None, buffer.percentile(50))
+
+
+class MetricsSamplerTest(unittest.TestCase):
+  """Testing the metrics.MetricsSampler class."""
+
+  def setUp(self):
+    self.openbts = mock.Mock()
+    self.openbts.monitor.return_value.data = {
+      'noiseRSSI': -68,
+      'gprsEnabled': True,
+      'version': 'release 4.0',
+    }
+    self.openbts.get_load.return_value = {'sdcch_load': 2}
+    self.openbts.get_noise.return_value = {'noise_rssi_db': -72}
+    self.sampler = MetricsSampler(self.openbts, capacity=3)
+
+  def test_sample(self):
+    """Numeric values from every source are recorded."""
+    self.sampler.sample()
+    self.assertEqual(['load.sdcch_load', 'monitor.noiseRSSI',
+                      'noise.noise_rssi_db'], self.sampler.metrics())
+    self.assertEqual(-68, self.sampler.last('monitor.noiseRSSI')[0][1])
+
+  def test_memory_is_bounded(self):
+    """Sampling many times does not grow the buffers."""
+    for _ in range(10):
+      self.sampler.sample()
+    self.assertEqual(3, len(self.sampler.last('load.sdcch_load')))
+
+  def test_errors_are_counted(self):
+    """A failing source does not stop the others from being sampled."""
+    self.openbts.get_load.side_effect = TimeoutError
+    self.sampler.sample()
+    self.assertEqual(1, self.sampler.errors['load'])
+    self.assertEqual(1, len(self.sampler.last('noise.noise_rssi_db')))
+
+  def test_parser_errors_are_counted(self):
+    """CLI output the parsers do not recognise counts as a source error."""
+    self.openbts.get_noise.side_effect = KeyError('noise_rssi_db')
+    self.openbts.get_load.side_effect = ValueError
+    self.sampler.sample()
+    self.assertEqual(1, self.sampler.errors['noise'])
+    self.assertEqual(1, self.sampler.errors['load'])
+
+  def test_reading_unknown_metrics(self):
+    """Reading a metric that was never sampled does not create it."""
+    self.assertEqual([], self.sampler.last('load.tchf_load'))
+    self.assertEqual([], self.sampler.metrics())
+
+  def test_background_thread(self):
+    """The sampler runs in the background until stopped."""
+    sampler = MetricsSampler(self.openbts, interval=0.01, sources=['noise'])
+    sampler.start()
+    time.sleep(0.05)
+    sampler.stop()
+    self.assertTrue(self.openbts.get_noise.called)
+
+  def test_background_thread_survives_errors(self):
+    """Unexpected errors are counted and sampling carries on."""
+    sampler = MetricsSampler(self.openbts, interval=0.01, sources=['noise'])
+    self.openbts.get_noise.side_effect = [
+      RuntimeError('unexpected')] + [{'noise_rssi_db': -72}] * 100
+    with mock.patch('openbts.metrics.logger'):
+      sampler.start()
+      time.sleep(0.05)
+      sampler.stop()
+    self.assertEqual(1, sampler.failures)
+    self.assertTrue(isinstance(sampler.last_error, RuntimeError))
+    self.assertTrue(sampler.last('noise.noise_rssi_db'))
+
+  def test_overruns_do_not_burst(self):
+    """A slow sample delays the next one instead of being caught up on."""
+    times = []
+
+    def get_noise():
+      times.append(time.time())
+      if len(times) == 1:
+        time.sleep(0.1)
+      return {'noise_rssi_db': -72}
+    self.openbts.get_noise.side_effect = get_noise
+    sampler = MetricsSampler(self.openbts, interval=0.02, sources=['noise'])
+    sampler.start()
+    time.sleep(0.15)
+    sampler.stop()
+    gaps = [b - a for a, b in zip(times[1:], times[2:])]
+    self.assertTrue(gaps)
+    self.assertTrue(all(gap >= 0.015 for gap in gaps))
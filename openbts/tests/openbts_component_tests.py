@@ -93,6 +93,20 @@ class OpenBTSNominalConfigTestCase(unittest.TestCase):
     response = self.openbts_connection.read_config('sample-key')
     self.assertEqual(response.code, SuccessCode.OK)
 
+  def test_config_snapshot(self):
+    """Every config key is read with one request."""
+    self.openbts_connection.socket.recv.return_value = json.dumps({
+      'code': 200,
+      'data': [
+        {'key': 'GSM.Radio.C0', 'value': '51'},
+        {'key': 'Control.NumSQLTries', 'value': '3'},
+      ]
+    })
+    snapshot = self.openbts_connection.config_snapshot()
+    self.assertEqual(1, self.openbts_connection.socket.send.call_count)
+    self.assertEqual('51', snapshot['GSM.Radio.C0']['value'])
+    self.assertEqual('3', snapshot['Control.NumSQLTries']['value'])
+
 
 class OpenBTSOffNominalConfigTestCase(unittest.TestCase):
   """Testing the components.OpenBTS class.
@@ -206,6 +220,42 @@ class OpenBTSNominalTMSIsTestCase(unittest.TestCase):
     self.assertEqual(len(response), 1)
     self.assertEqual(response[0]['IMSI'], '901550000000084')
 
+  def test_tmsis_by_imsi_and_fields(self):
+    """The 'tmsis' command can match an IMSI and fetch fewer fields."""
+    self.openbts_connection.tmsis(imsi='901550000000084',
+                                  fields=['IMSI', 'ACCESSED'])
+    expected_message = json.dumps({
+      'command': 'tmsis',
+      'action': 'read',
+      'match': {'AUTH': '2', 'IMSI': '901550000000084'},
+      'fields': ['IMSI', 'ACCESSED']
+    })
+    self.assertEqual(self.openbts_connection.socket.send.call_args[0],
+                     (expected_message,))
+
+  def test_iter_tmsis(self):
+    """Rows can be streamed and filtered with a predicate."""
+    rows = self.openbts_connection.iter_tmsis(
+      predicate=lambda row: row['IMEI'].endswith('1'))
+    self.assertFalse(self.openbts_connection.socket.send.called)
+    self.assertEqual(['901550000000082'], [row['IMSI'] for row in rows])
+
+  def test_iter_tmsis_not_found(self):
+    """A 404 reply yields no rows."""
+    self.openbts_connection.socket.recv.return_value = json.dumps({
+      'code': 404,
+    })
+    self.assertEqual([], list(self.openbts_connection.iter_tmsis()))
+
+  def test_failed_tmsis(self):
+    """tmsis returns no rows on a failure, which iter_tmsis raises."""
+    self.openbts_connection.socket.recv.return_value = json.dumps({
+      'code': 503,
+    })
+    self.assertEqual([], self.openbts_connection.tmsis())
+    with self.assertRaises(InvalidRequestError):
+      list(self.openbts_connection.iter_tmsis())
+
 
 class OpenBTSNominalMonitorTestCase(unittest.TestCase):
   """Testing the 'monitor' command on the components.OpenBTS class."""
@@ -292,6 +342,12 @@ class LoadTest(unittest.TestCase):
     }
     self.assertEqual(expected, self.openbts.get_load())
 
+  def test_missing_label(self):
+    """A label the CLI no longer prints is reported as a failed request."""
+    self.mock_envoy.return_text = 'SDCCH load/available: 2/4\n'
+    with self.assertRaises(InvalidRequestError):
+      self.openbts.get_load()
+
 
 class NoiseTest(unittest.TestCase):
   """Getting noise data by invoking the OpenBTSCLI."""
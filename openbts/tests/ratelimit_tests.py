@@ -0,0 +1,104 @@
+"""openbts.tests.ratelimit_tests
+tests for rate limiting and prioritizing requests
+"""
+
+import json
+import threading
+import time
+import unittest
+
+import mock
+
+from openbts.core import BaseComponent
+from openbts.exceptions import TimeoutError
+from openbts.ratelimit import RequestScheduler, TokenBucket
+
+
+class TokenBucketTestCase(unittest.TestCase):
+  """Testing the ratelimit.TokenBucket class."""
+
+  def test_refill(self):
+    bucket = TokenBucket(10, 2)
+    now = bucket.updated
+    self.assertEqual(0, bucket.wait_time(now))
+    bucket.tokens = 0
+    self.assertAlmostEqual(0.1, bucket.wait_time(now))
+    self.assertEqual(0, bucket.wait_time(now + 0.11))
+    # Tokens never exceed the burst size.
+    bucket.refill(now + 60)
+    self.assertEqual(2, bucket.tokens)
+
+
+class RequestSchedulerTestCase(unittest.TestCase):
+  """Testing the ratelimit.RequestScheduler class."""
+
+  ADDRESS = 'tcp://127.0.0.1:45064'
+
+  def setUp(self):
+    self.scheduler = RequestScheduler(rate=20, burst=1)
+    self.order = []
+
+  def request(self, priority):
+    """Acquires a token with some priority and records the grant."""
+    with self.scheduler.priority(priority):
+      self.scheduler.acquire(self.ADDRESS)
+    self.order.append(priority)
+
+  def test_interactive_requests_jump_the_queue(self):
+    self.scheduler.acquire(self.ADDRESS)
+    threads = [threading.Thread(target=self.request, args=('background',))
+               for _ in range(3)]
+    for thread in threads:
+      thread.start()
+    time.sleep(0.01)
+    self.assertEqual(3, self.scheduler.queue_depths()['background'])
+    interactive = threading.Thread(target=self.request,
+                                   args=('interactive',))
+    interactive.start()
+    for thread in threads + [interactive]:
+      thread.join()
+    self.assertEqual(['interactive'] + ['background'] * 3, self.order)
+    stats = self.scheduler.stats()
+    self.assertEqual(2, stats['interactive']['granted'])
+    self.assertEqual(3, stats['background']['granted'])
+    self.assertEqual(0, stats['background']['queued'])
+    self.assertTrue(stats['background']['wait_max'] > 0.1)
+
+  def test_endpoints_are_limited_separately(self):
+    start = time.time()
+    self.scheduler.acquire(self.ADDRESS)
+    self.scheduler.acquire('tcp://127.0.0.1:45060')
+    self.assertTrue(time.time() - start < 0.04)
+
+  def test_timeout(self):
+    self.scheduler.acquire(self.ADDRESS)
+    with self.assertRaises(TimeoutError):
+      self.scheduler.acquire(self.ADDRESS, timeout=0.01)
+    self.assertEqual(0, self.scheduler.queue_depths()['interactive'])
+
+  def test_unknown_priority(self):
+    with self.assertRaises(ValueError):
+      with self.scheduler.priority('urgent'):
+        pass
+
+  def test_component_requests_take_tokens(self):
+    """Components share the scheduler passed to them."""
+    component = BaseComponent(scheduler=self.scheduler)
+    component.address = self.ADDRESS
+    component.socket = mock.Mock()
+    component.socket.recv.return_value = json.dumps({'code': 200})
+    with self.scheduler.priority('background'):
+      component.get_version()
+    self.assertEqual(1, self.scheduler.stats()['background']['granted'])
+
+  def test_failover_takes_a_token_per_endpoint(self):
+    """A read retried on another endpoint is limited by that endpoint."""
+    component = BaseComponent(scheduler=self.scheduler, socket_timeout=0.01)
+    component.connect([self.ADDRESS, 'tcp://127.0.0.1:45060'])
+    for endpoint in component.endpoints:
+      endpoint.socket.close()
+      endpoint.socket = mock.Mock()
+      endpoint.socket.recv.return_value = json.dumps({'code': 200})
+    component.endpoints[0].socket.poll.return_value = 0
+    component.read_config('GSM.Radio.C0')
+    self.assertEqual(2, self.scheduler.stats()['interactive']['granted'])
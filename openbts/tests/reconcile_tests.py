@@ -0,0 +1,172 @@
+"""openbts.tests.reconcile_tests
+tests for reconciling the registry with a desired state
+"""
+
+import json
+import unittest
+
+import mock
+
+from openbts.components import SIPAuthServe
+from openbts.reconcile import Operation, apply_plan, plan, reconcile
+
+
+CURRENT = [{
+  'name': 'IMSI001010000000001',
+  'openbts_ipaddr': '127.0.0.1',
+  'openbts_port': '5062',
+  'numbers': ['5551111', '5550001'],
+  'account_balance': '100',
+  'caller_id': '5551111',
+}, {
+  'name': 'IMSI001010000000002',
+  'openbts_ipaddr': '127.0.0.1',
+  'openbts_port': '5062',
+  'numbers': ['5552222'],
+  'account_balance': '0',
+  'caller_id': '5552222',
+}]
+
+
+class PlanTestCase(unittest.TestCase):
+  """Testing reconcile.plan."""
+
+  def test_in_sync(self):
+    self.assertEqual([], plan(CURRENT, CURRENT))
+
+  def test_unspecified_fields_are_left_alone(self):
+    desired = [{'name': subscriber['name'], 'numbers': subscriber['numbers']}
+               for subscriber in CURRENT]
+    self.assertEqual([], plan(desired, CURRENT))
+
+  def test_minimal_changes(self):
+    desired = [{
+      'name': 'IMSI001010000000001',
+      'numbers': ['5550001', '5551234'],
+      'openbts_ipaddr': '127.0.0.2',
+      'account_balance': 100,
+    }, {
+      'name': 'IMSI001010000000003',
+      'numbers': ['5553333', '5550003'],
+      'openbts_ipaddr': '127.0.0.1',
+      'openbts_port': 5062,
+      'caller_id': '5550003',
+      'account_balance': '500',
+    }]
+    self.assertEqual([
+      Operation('delete', 'IMSI001010000000002', None),
+      Operation('remove_number', 'IMSI001010000000001', '5551111'),
+      Operation('add_number', 'IMSI001010000000001', '5551234'),
+      # The removed caller ID is replaced, as delete_number does.
+      Operation('update', 'IMSI001010000000001',
+                {'ipaddr': '127.0.0.2', 'callerid': '5551234'}),
+      Operation('create', 'IMSI001010000000003', {
+        'msisdn': '5550003',
+        'ipaddr': '127.0.0.1',
+        'port': 5062,
+        'ki': '',
+      }),
+      # NodeManager adds the msisdn itself.
+      Operation('add_number', 'IMSI001010000000003', '5553333'),
+      Operation('update', 'IMSI001010000000003', {'account_balance': '500'}),
+    ], plan(desired, CURRENT, prune=True))
+
+  def test_without_pruning(self):
+    self.assertEqual([], plan(CURRENT[:1], CURRENT))
+
+  def test_inconsistent_desired_state(self):
+    with self.assertRaises(ValueError):
+      plan([CURRENT[0], CURRENT[0]], CURRENT)
+    with self.assertRaises(ValueError):
+      plan([dict(CURRENT[1], numbers=['5551111']), CURRENT[0]], CURRENT)
+    with self.assertRaises(ValueError):
+      plan([dict(CURRENT[0], numbers=[])], CURRENT)
+    with self.assertRaises(ValueError):
+      plan([dict(CURRENT[0], caller_id='5559999')], CURRENT)
+    with self.assertRaises(ValueError):
+      plan([dict(CURRENT[0], name='IMSI001010000000003',
+                 caller_id='5559999')], [])
+
+
+class ReconcileTestCase(unittest.TestCase):
+  """Testing reconcile.reconcile with mocked sockets."""
+
+  def setUp(self):
+    self.sipauthserve_connection = SIPAuthServe()
+    self.sipauthserve_connection.socket = mock.Mock()
+    self.sipauthserve_connection.socket.recv.side_effect = [
+      json.dumps({'code': 200, 'data': [
+        {'dial': 'IMSI001010000000001', 'exten': '5551111'},
+        {'dial': 'IMSI001010000000001', 'exten': '5550001'},
+        {'dial': 'IMSI001010000000002', 'exten': '5552222'},
+      ]}),
+      json.dumps({'code': 200, 'data': [{
+        'name': subscriber['name'],
+        'ipaddr': subscriber['openbts_ipaddr'],
+        'port': subscriber['openbts_port'],
+        'callerid': subscriber['caller_id'],
+        'account_balance': subscriber['account_balance'],
+      } for subscriber in CURRENT]}),
+    ]
+    self.pipeline_socket = mock.Mock()
+    self.sipauthserve_connection.pipeline_socket = self.pipeline_socket
+    self.sent = []
+    self.pipeline_socket.send_multipart.side_effect = (
+      lambda frames: self.sent.append(json.loads(frames[1])))
+    self.pipeline_socket.recv_multipart.return_value = [
+      '', json.dumps({'code': 200})]
+
+  def test_no_op_costs_the_bulk_reads(self):
+    report = reconcile(self.sipauthserve_connection, CURRENT)
+    self.assertEqual([], report['plan'])
+    self.assertEqual(2, self.sipauthserve_connection.socket.send.call_count)
+    self.assertFalse(self.pipeline_socket.send_multipart.called)
+
+  def test_dry_run(self):
+    report = reconcile(self.sipauthserve_connection, CURRENT[:1],
+                       prune=True, dry_run=True)
+    self.assertEqual([Operation('delete', 'IMSI001010000000002', None)],
+                     report['plan'])
+    self.assertEqual(1, report['summary']['delete'])
+    self.assertEqual([], report['applied'])
+    self.assertFalse(self.pipeline_socket.send_multipart.called)
+
+  def test_apply(self):
+    desired = [dict(CURRENT[0], openbts_port='5064'), {
+      'name': 'IMSI001010000000003',
+      'numbers': ['5553333', '5550003'],
+      'openbts_ipaddr': '127.0.0.1',
+      'openbts_port': '5062',
+    }]
+    self.pipeline_socket.recv_multipart.side_effect = [
+      ['', json.dumps({'code': 200})],
+      ['', json.dumps({'code': 409})],
+      ['', json.dumps({'code': 200})],
+    ]
+    report = reconcile(self.sipauthserve_connection, desired, prune=True)
+    # The delete and the create are pipelined, and then the update; the
+    # number of the subscriber that could not be created is skipped.
+    self.assertEqual([('subscribers', 'delete'), ('subscribers', 'create'),
+                      ('sip_buddies', 'update')],
+                     [(m['command'], m['action']) for m in self.sent])
+    self.assertEqual({'port': '5064'}, self.sent[2]['fields'])
+    self.assertEqual('5553333', self.sent[1]['fields']['msisdn'])
+    self.assertEqual(2, len(report['applied']))
+    self.assertEqual('create', report['errors'][0][0].kind)
+    self.assertEqual([Operation('add_number', 'IMSI001010000000003',
+                                '5550003')], report['skipped'])
+
+  def test_write_through(self):
+    """The replica gets the msisdn that NodeManager adds on creation."""
+    replica = self.sipauthserve_connection.enable_replica(refresh=False)
+    self.addCleanup(replica.close)
+    apply_plan(self.sipauthserve_connection, plan([{
+      'name': 'IMSI001010000000003',
+      'numbers': ['5553333', '5550003'],
+      'openbts_ipaddr': '127.0.0.1',
+      'openbts_port': '5062',
+    }], []))
+    self.assertEqual(['5553333', '5550003'],
+                     replica.get_numbers('IMSI001010000000003'))
+    self.assertEqual('5553333',
+                     replica.get_caller_id('IMSI001010000000003'))
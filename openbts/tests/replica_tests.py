@@ -0,0 +1,140 @@
+"""openbts.tests.replica_tests
+tests for the SQLite read replica of the subscriber registry
+"""
+
+import json
+import unittest
+
+import mock
+
+from openbts.components import SIPAuthServe
+from openbts.exceptions import InvalidRequestError
+
+
+class RegistryReplicaTestCase(unittest.TestCase):
+  """Testing the replica.RegistryReplica class with a mocked socket."""
+
+  def setUp(self):
+    self.sipauthserve_connection = SIPAuthServe()
+    self.sipauthserve_connection.socket = mock.Mock()
+    self.sipauthserve_connection.socket.recv.side_effect = [
+      json.dumps({'code': 200, 'data': [{
+        'name': 'IMSI001010000000001',
+        'ipaddr': '127.0.0.1',
+        'port': '5062',
+        'callerid': '5551234',
+        'account_balance': '1000',
+      }, {
+        'name': 'IMSI001010000000002',
+        'ipaddr': '127.0.0.2',
+        'port': '5062',
+        'callerid': '5559876',
+        'account_balance': '0',
+      }]}),
+      json.dumps({'code': 200, 'data': [
+        {'dial': 'IMSI001010000000001', 'exten': '5551234'},
+        {'dial': 'IMSI001010000000001', 'exten': '5550000'},
+        {'dial': 'IMSI001010000000002', 'exten': '5559876'},
+      ]}),
+    ]
+    self.replica = self.sipauthserve_connection.enable_replica()
+
+  def tearDown(self):
+    self.replica.close()
+
+  def test_refresh_uses_bulk_reads(self):
+    """Two requests fill the replica, each reading a whole table."""
+    sent = [json.loads(call[0][0]) for call in
+            self.sipauthserve_connection.socket.send.call_args_list]
+    self.assertEqual(['sip_buddies', 'dialdata_table'],
+                     [message['command'] for message in sent])
+    self.assertEqual({}, sent[0]['match'])
+    status = self.replica.status()
+    self.assertEqual(2, status['subscribers'])
+    self.assertEqual(3, status['numbers'])
+    self.assertFalse(status['stale'])
+
+  def test_local_reads(self):
+    subscribers = self.replica.get_subscribers()
+    self.assertEqual(2, len(subscribers))
+    self.assertEqual({
+      'name': 'IMSI001010000000001',
+      'openbts_ipaddr': '127.0.0.1',
+      'openbts_port': '5062',
+      'numbers': ['5551234', '5550000'],
+      'account_balance': '1000',
+      'caller_id': '5551234',
+    }, subscribers[0])
+    self.assertEqual(['5559876'],
+                     self.replica.get_numbers('IMSI001010000000002'))
+    self.assertEqual('IMSI001010000000001',
+                     self.replica.get_imsi_from_number('5550000'))
+    self.assertEqual('0', self.replica.get_account_balance(
+      'IMSI001010000000002'))
+    with self.assertRaises(InvalidRequestError):
+      self.replica.get_imsi_from_number('5554321')
+    self.assertEqual(2, self.sipauthserve_connection.socket.send.call_count)
+
+  def test_write_through(self):
+    """Mutations accepted by NodeManager are applied to the replica."""
+    socket = self.sipauthserve_connection.socket
+    socket.recv.side_effect = None
+    socket.recv.return_value = json.dumps({'code': 200})
+    imsi = 'IMSI001010000000002'
+    self.sipauthserve_connection.update_openbts_ipaddr(imsi, '10.0.0.2')
+    self.sipauthserve_connection.update_account_balance(imsi, '500')
+    self.assertEqual('10.0.0.2', self.replica.get_openbts_ipaddr(imsi))
+    self.assertEqual('500', self.replica.get_account_balance(imsi))
+    self.sipauthserve_connection.delete_subscriber(imsi)
+    self.assertEqual([], self.replica.get_subscribers(imsi))
+    self.assertEqual([], self.replica.get_numbers(imsi))
+    socket.recv.side_effect = [
+      json.dumps({'code': 404}),
+      json.dumps({'code': 200}),
+    ]
+    self.sipauthserve_connection.create_subscriber(
+      'IMSI001010000000003', '5553333', '127.0.0.3', '5062')
+    subscriber = self.replica.get_subscribers('IMSI001010000000003')[0]
+    self.assertEqual(['5553333'], subscriber['numbers'])
+    self.assertEqual('5553333', subscriber['caller_id'])
+    self.assertEqual('0', subscriber['account_balance'])
+
+  def test_created_msisdn_is_recorded(self):
+    """The msisdn NodeManager already holds is recorded once."""
+    socket = self.sipauthserve_connection.socket
+    socket.reset_mock()
+    socket.recv.side_effect = [
+      json.dumps({'code': 404}),
+      json.dumps({'code': 200}),
+    ]
+    self.sipauthserve_connection.create_subscriber(
+      'IMSI001010000000003', '5553333', '127.0.0.3', '5062')
+    self.assertEqual(2, socket.send.call_count)
+    self.replica.add_number('IMSI001010000000003', '5553333')
+    self.assertEqual(['5553333'],
+                     self.replica.get_numbers('IMSI001010000000003'))
+
+  def test_failed_writes_are_not_applied(self):
+    socket = self.sipauthserve_connection.socket
+    socket.recv.side_effect = None
+    socket.recv.return_value = json.dumps({'code': 503})
+    with self.assertRaises(InvalidRequestError):
+      self.sipauthserve_connection.update_openbts_port(
+        'IMSI001010000000001', '5064')
+    self.assertEqual('5062', self.replica.get_openbts_port(
+      'IMSI001010000000001'))
+
+  def test_failed_refresh_keeps_the_tables(self):
+    """Only a 404 is read as an empty table."""
+    socket = self.sipauthserve_connection.socket
+    socket.recv.side_effect = [json.dumps({'code': 503})]
+    with self.assertRaises(InvalidRequestError):
+      self.replica.refresh()
+    self.assertEqual(2, self.replica.status()['subscribers'])
+    socket.recv.side_effect = [json.dumps({'code': 404})] * 2
+    self.assertEqual({'subscribers': 0, 'numbers': 0}, self.replica.refresh())
+
+  def test_staleness(self):
+    refreshed = self.replica.refreshed()
+    self.assertEqual(10, self.replica.staleness(now=refreshed + 10))
+    self.assertTrue(self.replica.is_stale(now=refreshed + 301))
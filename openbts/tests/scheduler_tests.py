@@ -0,0 +1,95 @@
+"""openbts.tests.scheduler_tests
+tests for the poll scheduler
+"""
+
+import threading
+import time
+import unittest
+
+from openbts.scheduler import PollScheduler
+
+
+class PollSchedulerTest(unittest.TestCase):
+  """Testing the scheduler.PollScheduler class."""
+
+  def setUp(self):
+    self.scheduler = PollScheduler(max_concurrency=1, jitter=0)
+    self.release = threading.Event()
+    self.calls = []
+
+  def tearDown(self):
+    self.release.set()
+    self.scheduler.stop()
+
+  def blocking_job(self, name):
+    """Makes a job that runs until self.release is set."""
+    def job():
+      self.calls.append(name)
+      self.release.wait(1)
+    return job
+
+  def wait_until_idle(self):
+    for _ in range(100):
+      if not self.scheduler.active:
+        return
+      time.sleep(0.01)
+
+  def test_first_runs_are_staggered(self):
+    """Jobs registered together are spread across their interval."""
+    scheduler = PollScheduler()
+    dues = [scheduler.register(str(i), lambda: None, 10).due
+            for i in range(20)]
+    self.assertTrue(max(dues) - min(dues) > 1)
+    self.assertTrue(max(dues) - time.time() <= 10)
+
+  def test_jitter(self):
+    """Later runs are jittered around their nominal tick."""
+    scheduler = PollScheduler(jitter=0.2)
+    job = scheduler.register('a', lambda: None, 10)
+    job.scheduled = job.due = 0
+    scheduler.run_pending(now=0)
+    self.assertEqual(10, job.scheduled)
+    self.assertTrue(8 <= job.due <= 12)
+
+  def test_priority_and_concurrency_limit(self):
+    """Only max_concurrency jobs run and the highest priority goes first."""
+    low = self.scheduler.register('low', self.blocking_job('low'), 10)
+    high = self.scheduler.register('high', self.blocking_job('high'), 10,
+                                   priority=5)
+    low.due = high.due = 0
+    self.assertEqual(['high'], self.scheduler.run_pending(now=1))
+    # The low priority job stays due until a slot frees up.
+    self.assertEqual([], self.scheduler.run_pending(now=1))
+    self.release.set()
+    self.wait_until_idle()
+    self.assertEqual(['low'], self.scheduler.run_pending(now=2))
+
+  def test_overrun_skips_tick(self):
+    """A job that is still running skips its tick instead of queueing."""
+    job = self.scheduler.register('slow', self.blocking_job('slow'), 10)
+    job.scheduled = job.due = 0
+    self.assertEqual(['slow'], self.scheduler.run_pending(now=0))
+    self.assertEqual([], self.scheduler.run_pending(now=10))
+    self.assertEqual(1, job.skips)
+    self.assertEqual(20, job.scheduled)
+    self.release.set()
+    self.wait_until_idle()
+    self.assertEqual(['slow'], self.calls)
+
+  def test_errors_are_recorded(self):
+    """A job that raises is counted and keeps being scheduled."""
+    def failing():
+      raise ValueError('boom')
+    job = self.scheduler.register('failing', failing, 10)
+    job.scheduled = job.due = 0
+    self.scheduler.run_pending(now=0)
+    self.wait_until_idle()
+    self.assertEqual(1, job.errors)
+    self.assertTrue(isinstance(job.last_error, ValueError))
+
+  def test_background_dispatch(self):
+    """The scheduler runs due jobs in the background."""
+    ran = threading.Event()
+    self.scheduler.register('a', ran.set, 0.01)
+    self.scheduler.start()
+    self.assertTrue(ran.wait(1))
@@ -7,7 +7,7 @@ import mock
 
 import openbts
 from openbts.components import SIPAuthServe
-from openbts.exceptions import InvalidRequestError
+from openbts.exceptions import InvalidRequestError, TimeoutError
 from openbts.codes import SuccessCode
 from openbts.tests import mocks
 
@@ -212,6 +212,147 @@ class SIPAuthServeNominalSubscriberTestCase(unittest.TestCase):
     self.assertEqual('subscriber_a', response[0]['name'])
     self.assertEqual('3000', response[0]['account_balance'])
 
+  def test_get_compact_subscribers(self):
+    """Compact subscribers read like dicts and share their BTS strings."""
+    self.sipauthserve_connection.socket.recv.side_effect = [
+      json.dumps({
+        'code': 200,
+        'data': [{
+          'name': 'subscriber_a',
+          'ipaddr': '127.0.0.1',
+          'port': '5555'
+        }, {
+          'name': 'subscriber_b',
+          'ipaddr': '127.0.0.1',
+          'port': '5555'
+        }]
+      }),
+      json.dumps({'code': 200, 'data': [{'exten': '5551234'}]}),
+      json.dumps({'code': 200, 'data': [{'account_balance': '3000'}]}),
+      json.dumps({'code': 200, 'data': [{'callerid': '5551234'}]}),
+      json.dumps({'code': 200, 'data': [{'exten': '5559876'}]}),
+      json.dumps({'code': 200, 'data': [{'account_balance': '100000'}]}),
+      json.dumps({'code': 200, 'data': [{'callerid': '5559876'}]}),
+    ]
+    response = self.sipauthserve_connection.get_subscribers(compact=True)
+    self.assertEqual({
+      'name': 'subscriber_a',
+      'openbts_ipaddr': '127.0.0.1',
+      'openbts_port': '5555',
+      'numbers': ['5551234'],
+      'account_balance': '3000',
+      'caller_id': '5551234',
+    }, response[0])
+    self.assertEqual(('5559876',), response[1]['numbers'])
+    self.assertIs(response[0]['openbts_ipaddr'],
+                  response[1]['openbts_ipaddr'])
+
+  def test_iter_subscribers(self):
+    """Subscribers are enriched in batches from one read of the numbers."""
+    self.sipauthserve_connection.socket.recv.side_effect = [
+      json.dumps({
+        'code': 200,
+        'data': [{
+          'name': 'IMSI00101000000000%d' % index,
+          'ipaddr': '127.0.0.1',
+          'port': '5555',
+          'callerid': '555000%d' % index,
+          'account_balance': str(index * 100),
+        } for index in range(5)]
+      }),
+      # IMSI ...3 has no number.
+      json.dumps({
+        'code': 200,
+        'data': [{
+          'dial': 'IMSI00101000000000%d' % index,
+          'exten': '555000%d' % index,
+        } for index in (0, 1, 2, 4)]
+      }),
+    ]
+    subscribers = self.sipauthserve_connection.iter_subscribers(batch_size=2)
+    first = next(subscribers)
+    self.assertEqual({
+      'name': 'IMSI001010000000000',
+      'openbts_ipaddr': '127.0.0.1',
+      'openbts_port': '5555',
+      'numbers': ['5550000'],
+      'account_balance': '0',
+      'caller_id': '5550000',
+    }, first)
+    rest = list(subscribers)
+    self.assertEqual(4, len(rest))
+    self.assertEqual([], rest[2]['numbers'])
+    self.assertEqual('400', rest[3]['account_balance'])
+    self.assertEqual(['5550004'], rest[3]['numbers'])
+    sent = [json.loads(call[0][0]) for call in
+            self.sipauthserve_connection.socket.send.call_args_list]
+    self.assertEqual(['sip_buddies', 'dialdata_table'],
+                     [message['command'] for message in sent])
+    self.assertTrue('callerid' in sent[0]['fields'])
+    self.assertEqual({}, sent[1]['match'])
+
+  def test_iter_subscribers_errors(self):
+    """Only a 404 is read as an empty registry."""
+    self.sipauthserve_connection.socket.recv.side_effect = [
+      json.dumps({'code': 404}),
+      json.dumps({'code': 503}),
+    ]
+    self.assertEqual([],
+                     list(self.sipauthserve_connection.iter_subscribers()))
+    with self.assertRaises(InvalidRequestError):
+      list(self.sipauthserve_connection.iter_subscribers())
+    self.sipauthserve_connection.socket.recv.side_effect = [
+      json.dumps({'code': 200, 'data': [{'name': 'IMSI001010000000000'}]}),
+      json.dumps({'code': 503}),
+    ]
+    with self.assertRaises(InvalidRequestError):
+      list(self.sipauthserve_connection.iter_subscribers())
+
+  def test_get_subscribers_projection(self):
+    """Only the requested columns are read, with a single request."""
+    self.sipauthserve_connection.socket.recv.side_effect = [
+      json.dumps({'code': 200, 'data': [
+        {'name': 'IMSI001010000000000', 'ipaddr': '127.0.0.1'},
+        {'name': 'IMSI001010000000001', 'ipaddr': '127.0.0.2'},
+      ]}),
+    ]
+    subscribers = self.sipauthserve_connection.get_subscribers(
+      fields=['name', 'openbts_ipaddr'])
+    self.assertEqual([
+      {'name': 'IMSI001010000000000', 'openbts_ipaddr': '127.0.0.1'},
+      {'name': 'IMSI001010000000001', 'openbts_ipaddr': '127.0.0.2'},
+    ], subscribers)
+    message = json.loads(
+      self.sipauthserve_connection.socket.send.call_args[0][0])
+    self.assertEqual(['name', 'ipaddr'], message['fields'])
+    self.assertEqual(1, self.sipauthserve_connection.socket.send.call_count)
+
+  def test_get_subscribers_projection_with_numbers(self):
+    self.sipauthserve_connection.socket.recv.side_effect = [
+      json.dumps({'code': 200, 'data': [{'name': 'IMSI001010000000000'}]}),
+      json.dumps({'code': 200, 'data': [
+        {'dial': 'IMSI001010000000000', 'exten': '5550000'}]}),
+    ]
+    subscribers = self.sipauthserve_connection.get_subscribers(
+      fields=['numbers'], compact=True)
+    self.assertEqual(('5550000',), subscribers[0]['numbers'])
+    self.assertEqual(['numbers'], subscribers[0].keys())
+    self.assertIsNone(subscribers[0].get('openbts_ipaddr'))
+    message = json.loads(
+      self.sipauthserve_connection.socket.send.call_args_list[0][0][0])
+    self.assertEqual(['name'], message['fields'])
+
+  def test_get_subscribers_unknown_field(self):
+    with self.assertRaises(ValueError):
+      self.sipauthserve_connection.get_subscribers(fields=['ki'])
+    self.assertFalse(self.sipauthserve_connection.socket.send.called)
+
+  def test_iter_subscribers_not_found(self):
+    self.sipauthserve_connection.socket.recv.return_value = json.dumps(
+      {'code': 404})
+    self.assertEqual(
+      [], list(self.sipauthserve_connection.iter_subscribers('IMSI000')))
+
   def test_create_subscriber_with_ki(self):
     """Creating a subscriber should send a zmq message and get a response."""
     self.sipauthserve_connection.socket.recv.side_effect = [
@@ -219,13 +360,6 @@ class SIPAuthServeNominalSubscriberTestCase(unittest.TestCase):
       json.dumps({'code': 404}),
       # The actual create sub message should succeed.
       json.dumps({'code': 200}),
-      # The add_number request triggers a number lookup (should fail) and then
-      # an actual "dialdata_table create" message which should succeed.
-      json.dumps({'code': 404}),
-      json.dumps({'code': 200}),
-      # Then the OpenBTS ipaddr and port updates should succeed.
-      json.dumps({'code': 200}),
-      json.dumps({'code': 200}),
     ]
     self.sipauthserve_connection.create_subscriber(
       310150123456789, 123456789, '127.0.0.1', '1234', ki='abc')
@@ -237,16 +371,34 @@ class SIPAuthServeNominalSubscriberTestCase(unittest.TestCase):
       json.dumps({'code': 404}),
       # The actual create sub message should succeed.
       json.dumps({'code': 200}),
-      # The add_number request triggers a number lookup (should fail) and then
-      # an actual "dialdata_table create" message which should succeed.
+    ]
+    self.sipauthserve_connection.create_subscriber(
+      310150123456789, 123456789, '127.0.0.1', '1234')
+    # NodeManager adds the msisdn itself; no dialdata_table request is sent.
+    self.assertEqual(
+      ['sip_buddies', 'subscribers'],
+      [json.loads(call[0][0])['command'] for call in
+       self.sipauthserve_connection.socket.send.call_args_list])
+
+  def test_create_subscriber_deadline(self):
+    """Every request of create_subscriber shares the deadline."""
+    self.sipauthserve_connection.socket.recv.side_effect = [
       json.dumps({'code': 404}),
       json.dumps({'code': 200}),
-      # Then the OpenBTS ipaddr and port updates should succeed.
-      json.dumps({'code': 200}),
-      json.dumps({'code': 200}),
     ]
     self.sipauthserve_connection.create_subscriber(
-      310150123456789, 123456789, '127.0.0.1', '1234')
+      310150123456789, 123456789, '127.0.0.1', '1234', deadline=2)
+    timeouts = [call[1]['timeout'] for call in
+                self.sipauthserve_connection.socket.poll.call_args_list]
+    self.assertEqual(2, len(timeouts))
+    self.assertTrue(all(timeout <= 2000 for timeout in timeouts))
+
+  def test_expired_deadline(self):
+    """Requests fail at once when the deadline has passed."""
+    with self.assertRaises(TimeoutError):
+      self.sipauthserve_connection.delete_number(310150123456789, '5551234',
+                                                 deadline=0)
+    self.assertFalse(self.sipauthserve_connection.socket.send.called)
 
   def test_delete_subscriber_by_imsi(self):
     """Deleting a subscriber by IMSI should use zmq."""
@@ -0,0 +1,176 @@
+"""openbts.tests.snapshot_tests
+tests for memory-mapped registry snapshots
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from openbts.components import SIPAuthServe
+from openbts.snapshot import (RegistrySnapshot, SnapshotRegistry,
+                              write_snapshot)
+
+
+SIP_BUDDIES = [{
+  'name': 'IMSI001010000000002',
+  'ipaddr': '127.0.0.1',
+  'port': '5062',
+  'callerid': '5559876',
+  'account_balance': '0',
+}, {
+  'name': 'IMSI001010000000001',
+  'ipaddr': '127.0.0.1',
+  'port': '5062',
+  'callerid': '5551234',
+  'account_balance': None,
+}]
+DIALDATA = [
+  {'dial': 'IMSI001010000000001', 'exten': '5551234'},
+  {'dial': 'IMSI001010000000001', 'exten': '5550000'},
+  {'dial': 'IMSI001010000000002', 'exten': '5559876'},
+]
+
+
+def registry_responses(sip_buddies=SIP_BUDDIES, dialdata=DIALDATA):
+  """Builds the responses to the two bulk reads of a revalidation."""
+  return [json.dumps({'code': 200, 'data': dialdata}),
+          json.dumps({'code': 200, 'data': sip_buddies})]
+
+
+class RegistrySnapshotTestCase(unittest.TestCase):
+  """Testing the snapshot.RegistrySnapshot class."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'registry.snapshot')
+    write_snapshot(self.path, [{
+      'name': 'IMSI001010000000002',
+      'openbts_ipaddr': '127.0.0.1',
+      'openbts_port': '5062',
+      'caller_id': '5559876',
+      'account_balance': '0',
+      'numbers': ['5559876'],
+    }, {
+      'name': u'IMSI001010000000001',
+      'openbts_ipaddr': '127.0.0.1',
+      'openbts_port': '5062',
+      'caller_id': '5551234',
+      'account_balance': None,
+      'numbers': ['5551234', '5550000'],
+    }], created=1000)
+    self.snapshot = RegistrySnapshot(self.path)
+
+  def tearDown(self):
+    self.snapshot.close()
+    shutil.rmtree(self.directory)
+
+  def test_lookups(self):
+    self.assertEqual(2, len(self.snapshot))
+    self.assertEqual(1000, self.snapshot.created)
+    self.assertEqual({
+      'name': 'IMSI001010000000001',
+      'openbts_ipaddr': '127.0.0.1',
+      'openbts_port': '5062',
+      'caller_id': '5551234',
+      'account_balance': None,
+      'numbers': ['5551234', '5550000'],
+    }, self.snapshot.get('IMSI001010000000001'))
+    self.assertIsNone(self.snapshot.get('IMSI001010000000003'))
+    self.assertEqual('IMSI001010000000001',
+                     self.snapshot.lookup_number('5550000'))
+    self.assertEqual('IMSI001010000000002',
+                     self.snapshot.lookup_number('5559876'))
+    self.assertIsNone(self.snapshot.lookup_number('5554321'))
+    self.assertIsNone(self.snapshot.lookup_number('9999999'))
+
+  def test_iteration_is_sorted_by_imsi(self):
+    self.assertEqual(['IMSI001010000000001', 'IMSI001010000000002'],
+                     [subscriber['name'] for subscriber in self.snapshot])
+
+  def test_strings_are_stored_once(self):
+    size = os.path.getsize(self.path)
+    self.assertEqual(1, open(self.path, 'rb').read().count('127.0.0.1'))
+    self.assertTrue(size < 300)
+
+  def test_invalid_file(self):
+    with open(self.path, 'wb') as snapshot_file:
+      snapshot_file.write('not a snapshot' * 10)
+    with self.assertRaises(ValueError):
+      RegistrySnapshot(self.path)
+
+
+class SnapshotRegistryTestCase(unittest.TestCase):
+  """Testing the snapshot.SnapshotRegistry class with a mocked socket."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'registry.snapshot')
+    self.sipauthserve_connection = SIPAuthServe()
+    self.sipauthserve_connection.socket = mock.Mock()
+    self.socket = self.sipauthserve_connection.socket
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_cold_start_reads_the_registry(self):
+    self.socket.recv.side_effect = registry_responses()
+    registry = SnapshotRegistry(self.sipauthserve_connection, self.path)
+    registry.start()
+    self.assertIsNone(registry._thread)
+    self.assertEqual('IMSI001010000000002', registry.lookup_number('5559876'))
+    self.assertEqual(1, registry.updates)
+    sent = [json.loads(call[0][0])
+            for call in self.socket.send.call_args_list]
+    self.assertEqual(['dialdata_table', 'sip_buddies'],
+                     [message['command'] for message in sent])
+    self.assertEqual({}, sent[0]['match'])
+
+  def test_warm_start_and_revalidation(self):
+    write_snapshot(self.path, [], created=1000)
+    self.socket.recv.side_effect = registry_responses()
+    registry = SnapshotRegistry(self.sipauthserve_connection, self.path)
+    with mock.patch.object(registry, '_run'):
+      registry.start()
+    # The old snapshot is served without contacting NodeManager.
+    self.assertEqual(0, len(registry))
+    self.assertEqual(0, self.socket.send.call_count)
+    self.assertEqual(10, registry.staleness(now=1010))
+    self.assertTrue(registry.revalidate())
+    self.assertEqual(2, len(registry))
+    self.socket.recv.side_effect = registry_responses()
+    registry.validated = 1000
+    self.assertFalse(registry.revalidate())
+    self.assertEqual(1, registry.updates)
+    # An unchanged registry still counts as validated.
+    self.assertTrue(registry.staleness() < 60)
+    self.assertEqual(['5551234', '5550000'],
+                     registry.get('IMSI001010000000001')['numbers'])
+    # A new process warm-starts from the rewritten file.
+    self.assertEqual(2, len(RegistrySnapshot(self.path)))
+
+  def test_failed_revalidation_keeps_the_snapshot(self):
+    write_snapshot(self.path, [], created=1000)
+    self.socket.recv.side_effect = [json.dumps({'code': 503})]
+    registry = SnapshotRegistry(self.sipauthserve_connection, self.path)
+    registry.start()
+    registry._thread.join()
+    self.assertEqual(1, registry.errors)
+    self.assertEqual(0, registry.updates)
+    self.assertEqual(1000, registry.snapshot.created)
+
+  def test_write_errors_are_recorded(self):
+    """Failing to write the snapshot does not kill the thread silently."""
+    write_snapshot(self.path, [], created=1000)
+    self.socket.recv.side_effect = registry_responses()
+    registry = SnapshotRegistry(self.sipauthserve_connection, self.path)
+    with mock.patch('openbts.snapshot.write_snapshot',
+                    side_effect=IOError('disk full')):
+      registry.start()
+      registry._thread.join()
+    self.assertEqual(1, registry.errors)
+    self.assertTrue(isinstance(registry.last_error, IOError))
+    self.assertEqual(1000, registry.staleness(now=2000))
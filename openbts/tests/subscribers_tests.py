@@ -0,0 +1,62 @@
+"""openbts.tests.subscribers_tests
+tests for compact subscriber records
+"""
+
+import unittest
+
+from openbts.subscribers import Subscriber
+
+
+class SubscriberTestCase(unittest.TestCase):
+  """Testing the subscribers.Subscriber class."""
+
+  def setUp(self):
+    self.subscriber = Subscriber.from_dict({
+      'name': u'IMSI001010000000001',
+      'openbts_ipaddr': u'127.0.0.1',
+      'openbts_port': u'5062',
+      'numbers': [u'5551234', u'5550000'],
+      'account_balance': u'1000',
+      'caller_id': u'5551234',
+    })
+
+  def test_dict_access(self):
+    self.assertEqual(u'IMSI001010000000001', self.subscriber['name'])
+    self.assertEqual('5062', self.subscriber.get('openbts_port'))
+    self.assertIsNone(self.subscriber.get('ki'))
+    self.assertTrue('caller_id' in self.subscriber)
+    with self.assertRaises(KeyError):
+      self.subscriber['ki']
+    self.assertEqual(('5551234', '5550000'),
+                     dict(self.subscriber)['numbers'])
+    self.assertEqual(['5551234', '5550000'],
+                     self.subscriber.to_dict()['numbers'])
+
+  def test_compact_representation(self):
+    self.assertFalse(hasattr(self.subscriber, '__dict__'))
+    self.assertEqual(('5551234', '5550000'), self.subscriber.numbers)
+    other = Subscriber(u'IMSI001010000000002', u'127.0.0.1', u'5062')
+    self.assertIs(self.subscriber.openbts_ipaddr, other.openbts_ipaddr)
+    self.assertIs(self.subscriber.openbts_port, other.openbts_port)
+
+  def test_equality(self):
+    self.assertEqual(Subscriber(**self.subscriber.to_dict()), self.subscriber)
+    self.assertNotEqual(dict(self.subscriber, caller_id='5550000'),
+                        self.subscriber)
+    self.assertNotEqual('IMSI001010000000001', self.subscriber)
+
+  def test_projection(self):
+    """A projected record has only the projected fields as keys."""
+    projected = Subscriber.from_dict({
+      'name': u'IMSI001010000000001',
+      'numbers': [u'5551234'],
+    })
+    self.assertEqual(['name', 'numbers'], projected.keys())
+    self.assertEqual(2, len(projected))
+    self.assertFalse('caller_id' in projected)
+    self.assertIsNone(projected.get('caller_id'))
+    with self.assertRaises(KeyError):
+      projected['caller_id']
+    self.assertEqual({'name': u'IMSI001010000000001',
+                      'numbers': [u'5551234']}, projected)
+    self.assertNotEqual(self.subscriber, projected)
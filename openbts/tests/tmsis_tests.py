@@ -0,0 +1,170 @@
+"""openbts.tests.tmsis_tests
+tests for the local TMSI table copies
+"""
+
+import json
+import unittest
+
+import mock
+
+from openbts.components import OpenBTS
+from openbts.exceptions import InvalidRequestError
+from openbts.tmsis import TMSISync, TMSIStore
+
+
+class FakeOpenBTS(object):
+  """Serves iter_tmsis() from an in-memory table and records the requests."""
+
+  def __init__(self, rows):
+    self.rows = rows
+    self.requests = []
+
+  def iter_tmsis(self, access_period=0, auth=2, imsi=None, fields=None):
+    self.requests.append((imsi, fields))
+    rows = [row for row in self.rows if imsi is None or row['IMSI'] == imsi]
+    if fields:
+      rows = [dict((f, row[f]) for f in fields) for row in rows]
+    return [dict(row) for row in rows]
+
+
+def make_row(imsi, accessed, imei='355534065410400'):
+  return {
+    'IMSI': imsi,
+    'TMSI': '0x40000000',
+    'IMEI': imei,
+    'AUTH': '2',
+    'CREATED': 100,
+    'ACCESSED': accessed,
+    'TMSI_ASSIGNED': '0',
+  }
+
+
+class TMSISyncTest(unittest.TestCase):
+  """Testing the tmsis.TMSISync class."""
+
+  def setUp(self):
+    self.openbts = FakeOpenBTS([
+      make_row('901550000000001', 1000),
+      make_row('901550000000002', 1500),
+      make_row('901550000000003', 1900),
+    ])
+    self.sync = TMSISync(self.openbts, max_delta=1)
+
+  def test_initial_sync(self):
+    """The first sync fetches the whole table."""
+    changes = self.sync.sync()
+    self.assertEqual(3, len(changes['added']))
+    self.assertEqual(3, len(self.sync))
+    self.assertEqual(1, self.sync.stats['full_syncs'])
+
+  def test_delta_sync(self):
+    """Only the rows of accessed IMSIs are re-fetched."""
+    self.sync.sync()
+    self.openbts.rows[0]['ACCESSED'] = 2000
+    self.openbts.requests = []
+    changes = self.sync.sync()
+    self.assertEqual({'added': [], 'updated': ['901550000000001'],
+                      'removed': []}, changes)
+    self.assertEqual([(None, ['IMSI', 'ACCESSED']), ('901550000000001', None)],
+                     self.openbts.requests)
+    self.assertEqual(2000, self.sync.get('901550000000001')['ACCESSED'])
+    self.assertEqual(1, self.sync.stats['delta_syncs'])
+
+  def test_removed_rows(self):
+    """Rows that disappear from the table are dropped."""
+    self.sync.sync()
+    del self.openbts.rows[1]
+    changes = self.sync.sync()
+    self.assertEqual(['901550000000002'], changes['removed'])
+    self.assertFalse('901550000000002' in self.sync)
+
+  def test_falls_back_to_full_sync(self):
+    """Many changed rows are handled with a single full fetch."""
+    self.sync.sync()
+    self.openbts.rows[0]['ACCESSED'] = 2000
+    self.openbts.rows.append(make_row('901550000000004', 2000))
+    changes = self.sync.sync()
+    self.assertEqual(['901550000000004'], changes['added'])
+    self.assertEqual(['901550000000001'], changes['updated'])
+    self.assertEqual(2, self.sync.stats['full_syncs'])
+
+  def test_active(self):
+    """Active subscribers are answered from the local copy."""
+    self.sync.sync()
+    requests = len(self.openbts.requests)
+    self.assertEqual(2, self.sync.count_active(600, now=2000))
+    self.assertEqual(['901550000000003'],
+                     [row['IMSI'] for row in self.sync.active(200, now=2000)])
+    self.assertEqual(requests, len(self.openbts.requests))
+
+  def test_failed_sync_keeps_the_rows(self):
+    """A 503 is raised rather than read as an empty table."""
+    openbts = OpenBTS()
+    openbts.socket = mock.Mock()
+    openbts.socket.recv.side_effect = [
+      json.dumps({'code': 200, 'data': self.openbts.rows}),
+      json.dumps({'code': 503}),
+    ]
+    sync = TMSISync(openbts)
+    sync.sync()
+    with self.assertRaises(InvalidRequestError):
+      sync.sync()
+    self.assertEqual(3, len(sync))
+
+
+class TMSIStoreTest(unittest.TestCase):
+  """Testing the tmsis.TMSIStore class."""
+
+  def setUp(self):
+    rows = [
+      make_row('901550000000001', 1000),
+      make_row('901550000000002', 1500, imei='355534065410401'),
+      make_row('901550000000003', 1900, imei='355534065410402'),
+    ]
+    rows[0]['AUTH'] = '1'
+    rows[2]['CREATED'] = 1800
+    rows[2]['TMSI'] = '0x40000001'
+    self.store = TMSIStore(rows)
+
+  def test_lookups(self):
+    """Rows can be found by IMSI, TMSI and IMEI."""
+    row = self.store.lookup_imsi('901550000000002')
+    self.assertEqual(1500, row['ACCESSED'])
+    self.assertEqual('0', row['TMSI_ASSIGNED'])
+    self.assertEqual(None, self.store.lookup_imsi('901550000000009'))
+    self.assertEqual(2, len(self.store.lookup_tmsi('0x40000000')))
+    self.assertEqual('901550000000003',
+                     self.store.lookup_imei('355534065410402')[0]['IMSI'])
+
+  def test_row_types(self):
+    """AUTH comes back as an int and the timestamps as floats."""
+    row = self.store.lookup_imsi('901550000000001')
+    self.assertEqual(1, row['AUTH'])
+    self.assertTrue(isinstance(row['CREATED'], float))
+    self.assertTrue(isinstance(row['ACCESSED'], float))
+
+  def test_window_counts(self):
+    """Accesses are counted per window."""
+    self.assertEqual({300: 1, 900: 2, 3600: 3},
+                     self.store.window_counts(now=2000))
+
+  def test_new_imeis(self):
+    """IMEIs are new if they were first created after some time."""
+    self.assertEqual(set(['355534065410402']), self.store.new_imeis(1000))
+    self.assertEqual(1, self.store.count_created_since(1000))
+    # An IMEI seen before is not new, even on a newly created row.
+    rows = [make_row('901550000000004', 2000, imei='355534065410401')]
+    rows[0]['CREATED'] = 1900
+    store = TMSIStore([self.store.row(i) for i in range(3)] + rows)
+    self.assertEqual(set(['355534065410402']), store.new_imeis(1000))
+    self.assertEqual(set(), store.new_imeis(1800))
+
+  def test_auth_breakdown(self):
+    """Rows are counted per AUTH value."""
+    self.assertEqual({1: 1, 2: 2}, self.store.auth_breakdown())
+
+  def test_from_openbts(self):
+    """A store is loaded with one request per AUTH value."""
+    openbts = FakeOpenBTS([make_row('901550000000001', 1000)])
+    store = TMSIStore.from_openbts(openbts, auths=[2])
+    self.assertEqual(1, len(store))
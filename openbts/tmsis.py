@@ -0,0 +1,257 @@
+"""openbts.tmsis
+local copies of the OpenBTS TMSI table
+"""
+
+import array
+import bisect
+import time
+
+
+class TMSISync(object):
+  """Keeps a local copy of the TMSI table, keyed by IMSI.
+
+  NodeManager can only match TMSI rows on equality, so it cannot send just
+  the rows that changed since the last poll.  Instead, each sync fetches the
+  narrow (IMSI, ACCESSED) projection of the table, which is a fraction of the
+  full rows, and then re-fetches the full rows of only those IMSIs that are
+  new or were accessed since the last sync.  If more than max_delta rows
+  changed, it is cheaper to fetch the whole table once, and the sync falls
+  back to a full fetch and a diff against the local copy.
+
+  Active-subscriber queries are answered from the local copy.
+
+  Args:
+    openbts: an openbts.components.OpenBTS instance
+    auth: the AUTH value of the rows to track (see OpenBTS.tmsis)
+    max_delta: the number of changed rows above which a full fetch is used
+
+  Attributes:
+    rows: dict of TMSI rows keyed by IMSI
+    last_sync: the time of the last successful sync
+    stats: counts of full and delta syncs and of rows fetched
+  """
+
+  def __init__(self, openbts, auth=2, max_delta=100):
+    self.openbts = openbts
+    self.auth = auth
+    self.max_delta = max_delta
+    self.rows = {}
+    self.last_sync = None
+    self.stats = {
+      'full_syncs': 0,
+      'delta_syncs': 0,
+      'rows_fetched': 0,
+    }
+
+  def __len__(self):
+    return len(self.rows)
+
+  def __contains__(self, imsi):
+    return imsi in self.rows
+
+  def get(self, imsi, default=None):
+    """Gets the local TMSI row of an IMSI."""
+    return self.rows.get(imsi, default)
+
+  def sync(self, full=False):
+    """Brings the local copy up to date.
+
+    Args:
+      full: always fetch the whole table and diff it against the local copy
+
+    Raises:
+      OpenBTSError if a read fails, in which case the local copy is left
+      unchanged
+
+    Returns:
+      a dict of the IMSIs that changed, of the form: {
+        'added': ['901550000000084'],
+        'updated': [],
+        'removed': ['901550000000082'],
+      }
+    """
+    if full or not self.rows:
+      return self._full_sync()
+    accessed = dict(
+      (row['IMSI'], row['ACCESSED']) for row in self.openbts.iter_tmsis(
+        auth=self.auth, fields=['IMSI', 'ACCESSED']))
+    self.stats['rows_fetched'] += len(accessed)
+    changed = [imsi for imsi, value in accessed.iteritems()
+               if imsi not in self.rows
+               or self.rows[imsi]['ACCESSED'] != value]
+    if len(changed) > self.max_delta:
+      return self._full_sync()
+    self.stats['delta_syncs'] += 1
+    fetched = {}
+    for imsi in changed:
+      for row in self.openbts.iter_tmsis(auth=self.auth, imsi=imsi):
+        fetched[row['IMSI']] = row
+    self.stats['rows_fetched'] += len(fetched)
+    removed = [imsi for imsi in self.rows if imsi not in accessed]
+    return self._apply(fetched, removed)
+
+  def _full_sync(self):
+    """Fetches the whole table and applies the difference."""
+    self.stats['full_syncs'] += 1
+    rows = list(self.openbts.iter_tmsis(auth=self.auth))
+    self.stats['rows_fetched'] += len(rows)
+    latest = dict((row['IMSI'], row) for row in rows)
+    changed = dict((imsi, row) for imsi, row in latest.iteritems()
+                   if self.rows.get(imsi) != row)
+    removed = [imsi for imsi in self.rows if imsi not in latest]
+    return self._apply(changed, removed)
+
+  def _apply(self, changed, removed):
+    """Applies changed and removed rows to the local copy."""
+    result = {'added': [], 'updated': [], 'removed': removed}
+    for imsi, row in changed.iteritems():
+      if imsi in self.rows:
+        result['updated'].append(imsi)
+      else:
+        result['added'].append(imsi)
+      self.rows[imsi] = row
+    for imsi in removed:
+      del self.rows[imsi]
+    self.last_sync = time.time()
+    return result
+
+  def active(self, access_period, now=None):
+    """Gets the rows accessed within the last access_period seconds."""
+    if now is None:
+      now = time.time()
+    cutoff = now - access_period
+    return [row for row in self.rows.itervalues() if row['ACCESSED'] > cutoff]
+
+  def count_active(self, access_period, now=None):
+    """Counts the IMSIs accessed within the last access_period seconds."""
+    return len(self.active(access_period, now))
+
+
+class TMSIStore(object):
+  """A columnar, indexed snapshot of TMSI rows for analytics.
+
+  The CREATED, ACCESSED and AUTH columns are kept in arrays, with sorted
+  copies of the timestamps so that window counts are binary searches rather
+  than loops over dicts.  IMSIs and IMEIs are interned, and lookup indexes are
+  built for IMSI, TMSI and IMEI.  Load one fetch and run as many queries over
+  it as needed.
+
+  Rows rebuilt from the store hold AUTH as an int and CREATED and ACCESSED as
+  floats, whatever types OpenBTS.tmsis returned them as.
+
+  Args:
+    rows: an iterable of TMSI rows as returned by OpenBTS.tmsis
+  """
+
+  def __init__(self, rows):
+    self.imsis = []
+    self.tmsis = []
+    self.imeis = []
+    self.tmsi_assigned = []
+    self.created = array.array('d')
+    self.accessed = array.array('d')
+    self.auth = array.array('b')
+    self.by_imsi = {}
+    self.by_tmsi = {}
+    self.by_imei = {}
+    first_created = {}
+    for row in rows:
+      index = len(self.imsis)
+      imsi = intern(str(row['IMSI']))
+      imei = intern(str(row['IMEI']))
+      self.imsis.append(imsi)
+      self.tmsis.append(row['TMSI'])
+      self.imeis.append(imei)
+      self.tmsi_assigned.append(row.get('TMSI_ASSIGNED'))
+      created = float(row['CREATED'])
+      self.created.append(created)
+      if imei not in first_created or created < first_created[imei]:
+        first_created[imei] = created
+      self.accessed.append(float(row['ACCESSED']))
+      self.auth.append(int(row['AUTH']))
+      self.by_imsi[imsi] = index
+      self.by_tmsi.setdefault(row['TMSI'], []).append(index)
+      self.by_imei.setdefault(imei, []).append(index)
+    self.sorted_accessed = array.array('d', sorted(self.accessed))
+    self.sorted_created = array.array('d', sorted(self.created))
+    # IMEIs in the order they were first seen, for new_imeis.
+    first_seen = sorted((created, imei)
+                        for imei, created in first_created.iteritems())
+    self.first_created = array.array('d', [c for c, _ in first_seen])
+    self.imeis_by_first_created = [imei for _, imei in first_seen]
+
+  @classmethod
+  def from_openbts(cls, openbts, auths=(0, 1, 2, 3)):
+    """Loads a store from an OpenBTS component.
+
+    The TMSI table can only be read one AUTH value at a time, so one request
+    is made per value in auths.  A failed request raises OpenBTSError rather
+    than leave those rows out of the store.
+    """
+    rows = []
+    for auth in auths:
+      rows.extend(openbts.iter_tmsis(auth=auth))
+    return cls(rows)
+
+  def __len__(self):
+    return len(self.imsis)
+
+  def row(self, index):
+    """Rebuilds the TMSI row dict at some index.
+
+    AUTH is an int and CREATED and ACCESSED are floats (see TMSIStore).
+    """
+    return {
+      'IMSI': self.imsis[index],
+      'TMSI': self.tmsis[index],
+      'IMEI': self.imeis[index],
+      'AUTH': self.auth[index],
+      'CREATED': self.created[index],
+      'ACCESSED': self.accessed[index],
+      'TMSI_ASSIGNED': self.tmsi_assigned[index],
+    }
+
+  def lookup_imsi(self, imsi):
+    """Gets the row of an IMSI, or None if it is unknown."""
+    index = self.by_imsi.get(imsi)
+    return None if index is None else self.row(index)
+
+  def lookup_tmsi(self, tmsi):
+    """Gets the rows that have a TMSI."""
+    return [self.row(i) for i in self.by_tmsi.get(tmsi, [])]
+
+  def lookup_imei(self, imei):
+    """Gets the rows that have an IMEI."""
+    return [self.row(i) for i in self.by_imei.get(imei, [])]
+
+  def count_accessed_since(self, cutoff):
+    """Counts the rows accessed after a timestamp."""
+    return len(self) - bisect.bisect_right(self.sorted_accessed, cutoff)
+
+  def count_created_since(self, cutoff):
+    """Counts the rows created after a timestamp."""
+    return len(self) - bisect.bisect_right(self.sorted_created, cutoff)
+
+  def window_counts(self, windows=(300, 900, 3600), now=None):
+    """Counts the IMSIs accessed within several windows.
+
+    Args:
+      windows: window widths in seconds
+      now: the end of the windows (default the current time)
+
+    Returns:
+      a dict of counts keyed by window width
+    """
+    if now is None:
+      now = time.time()
+    return dict((seconds, self.count_accessed_since(now - seconds))
+                for seconds in windows)
+
+  def new_imeis(self, since):
+    """Gets the IMEIs first seen (created) after a timestamp."""
+    start = bisect.bisect_right(self.first_created, since)
+    return set(self.imeis_by_first_created[start:])
+
+  def auth_breakdown(self):
+    """Counts the rows per AUTH value."""
+    return dict((auth, self.auth.count(auth)) for auth in set(self.auth))